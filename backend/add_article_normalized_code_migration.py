@@ -0,0 +1,40 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine
+from app.article_codes import normalize_article_code
+
+# Колонка normalized_code, ее заполнение и индексы для поиска по артикулам (Postgres)
+with engine.begin() as conn:
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text("ALTER TABLE articles ADD COLUMN IF NOT EXISTS normalized_code VARCHAR"))
+
+    # Заполняем пачками, чтобы не держать в памяти всю таблицу
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, code FROM articles WHERE id > :last_id AND normalized_code IS NULL ORDER BY id LIMIT 5000"),
+            {"last_id": last_id},
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            text("UPDATE articles SET normalized_code = :normalized WHERE id = :id"),
+            [{"id": row.id, "normalized": normalize_article_code(row.code)} for row in rows],
+        )
+        last_id = rows[-1].id
+        print(f"Обработано артикулов до id {last_id}")
+
+    # Префиксный поиск (LIKE 'ABC%') и нечеткий поиск по триграммам
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_articles_normalized_code_prefix "
+        "ON articles (normalized_code varchar_pattern_ops)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_articles_normalized_code_trgm "
+        "ON articles USING gist (normalized_code gist_trgm_ops)"
+    ))
+
+print("Колонка normalized_code и индексы поиска по артикулам готовы!")
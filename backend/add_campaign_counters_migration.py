@@ -0,0 +1,19 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine
+
+# Счетчики артикулов и сообщений в email_campaigns (Postgres) и их заполнение по текущим данным
+with engine.begin() as conn:
+    conn.execute(text("ALTER TABLE email_campaigns ADD COLUMN IF NOT EXISTS articles_count INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text("ALTER TABLE email_campaigns ADD COLUMN IF NOT EXISTS messages_count INTEGER NOT NULL DEFAULT 0"))
+    result = conn.execute(text("""
+        UPDATE email_campaigns c SET
+            articles_count = (SELECT count(*) FROM email_campaign_articles a WHERE a.campaign_id = c.id),
+            messages_count = (SELECT count(*) FROM email_messages m WHERE m.campaign_id = c.id)
+    """))
+    print(f"Счетчики пересчитаны для кампаний: {result.rowcount}")
+
+print("Счетчики email кампаний готовы!")
@@ -0,0 +1,17 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine, Base
+from app import models
+
+# Загрузка ответов по IMAP: таблица mailbox_sync_state и индекс по Message-ID писем (Postgres).
+# Запускать после add_outbound_mail_migration.py
+Base.metadata.create_all(bind=engine, tables=[models.MailboxSyncState.__table__])
+
+with engine.begin() as conn:
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_email_messages_external_id ON email_messages (external_id)"))
+    conn.execute(text("ALTER TABLE mailbox_sync_state ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP"))
+
+print("Загрузка ответов поставщиков готова!")
@@ -0,0 +1,25 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine
+
+# create_all не добавляет индексы в существующие таблицы — создаем их отдельно.
+# Список зафиксирован: индексы, появившиеся в моделях позже, создают свои миграции
+LIST_INDEXES = [
+    ("ix_requests_user_id", "requests", "user_id"),
+    ("ix_requests_created_at", "requests", "created_at"),
+    ("ix_articles_user_id", "articles", "user_id"),
+    ("ix_articles_request_id", "articles", "request_id"),
+    ("ix_articles_created_at", "articles", "created_at"),
+    ("ix_analytics_user_id", "analytics", "user_id"),
+    ("ix_analytics_timestamp", "analytics", "timestamp"),
+]
+
+with engine.begin() as conn:
+    for name, table, column in LIST_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+        print(f"Индекс {name} готов")
+
+print("Индексы для фильтров и пагинации списков созданы (Postgres)!")
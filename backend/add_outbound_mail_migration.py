@@ -0,0 +1,23 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine
+
+# Поля очереди исходящих писем в email_messages (Postgres).
+# Старые письма остаются с delivery_status = NULL — воркер их не трогает
+with engine.begin() as conn:
+    conn.execute(text("ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS delivery_status VARCHAR"))
+    conn.execute(text("ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0"))
+    conn.execute(text("ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP"))
+    conn.execute(text("ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP"))
+    conn.execute(text("ALTER TABLE email_messages ADD COLUMN IF NOT EXISTS delivery_error TEXT"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_email_messages_delivery_status ON email_messages (delivery_status)"))
+    # Общий для всех процессов лимит писем на домен получателя
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS mail_domain_throttle ("
+        "domain VARCHAR PRIMARY KEY, next_send_at DOUBLE PRECISION NOT NULL)"
+    ))
+
+print("Очередь исходящих писем готова!")
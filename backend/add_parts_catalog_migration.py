@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine, Base
+from app import models
+
+# Каталог деталей: таблицы parts/part_suppliers и ссылка articles.part_id (Postgres).
+# Запускать после add_article_normalized_code_migration.py
+Base.metadata.create_all(bind=engine, tables=[models.Part.__table__, models.PartSupplier.__table__])
+
+with engine.begin() as conn:
+    conn.execute(text("ALTER TABLE articles ADD COLUMN IF NOT EXISTS part_id INTEGER REFERENCES parts(id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_articles_part_id ON articles (part_id)"))
+
+    # Деталь на каждый нормализованный артикул; code — самый ранний вариант написания
+    conn.execute(text("""
+        INSERT INTO parts (normalized_code, code, created_at)
+        SELECT DISTINCT ON (normalized_code) normalized_code, code, now()
+        FROM articles
+        WHERE normalized_code IS NOT NULL AND normalized_code <> ''
+        ORDER BY normalized_code, id
+        ON CONFLICT (normalized_code) DO NOTHING
+    """))
+    result = conn.execute(text("""
+        UPDATE articles a SET part_id = p.id
+        FROM parts p
+        WHERE a.part_id IS NULL AND p.normalized_code = a.normalized_code
+    """))
+    print(f"Артикулов привязано к каталогу: {result.rowcount}")
+
+    # Уже найденные поставщики переносятся в каталог без дублей по домену.
+    # suppliers_updated_at не ставим: деталь считается найденной после следующего полного поиска
+    result = conn.execute(text("""
+        INSERT INTO part_suppliers (part_id, domain, name, website, email, country, first_seen_at, last_seen_at)
+        SELECT DISTINCT ON (a.part_id, d.domain)
+               a.part_id, d.domain, s.name, s.website, COALESCE(s.email, ''), s.country, now(), now()
+        FROM suppliers s
+        JOIN articles a ON a.id = s.article_id
+        CROSS JOIN LATERAL (
+            SELECT split_part(split_part(regexp_replace(lower(trim(s.website)), '^https?://', ''), '/', 1), ':', 1) AS domain
+        ) d
+        WHERE a.part_id IS NOT NULL AND d.domain <> ''
+        ORDER BY a.part_id, d.domain, (s.email IS NULL OR s.email = ''), s.id
+        ON CONFLICT (part_id, domain) DO NOTHING
+    """))
+    print(f"Поставщиков перенесено в каталог: {result.rowcount}")
+
+print("Каталог деталей готов!")
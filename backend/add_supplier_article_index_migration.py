@@ -0,0 +1,13 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import engine
+from app.models import Supplier
+
+# create_all не добавляет индексы в существующие таблицы — создаем их отдельно
+for index in Supplier.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+    print(f"Индекс {index.name} готов")
+
+print("Индекс suppliers.article_id для группировки рассылок создан (Postgres)!")
@@ -9,14 +9,14 @@ import io
 import pandas as pd
 from fastapi.responses import StreamingResponse
 
-from app.database import get_db
+from app.database import get_db, pool_status
 from app.models import User, Article, Request, Supplier, SupportTicket, Role, Department
-from app import auth
+from app import auth, admin_metrics
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 # Используем правильную функцию аутентификации
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 def check_admin_access(current_user: User):
     """Проверка прав администратора"""
@@ -26,55 +26,36 @@ def check_admin_access(current_user: User):
             detail="Недостаточно прав доступа"
         )
 
+@router.get("/db-pool")
+async def get_db_pool_status(
+    current_user: User = Depends(get_current_user)
+):
+    """Состояние пула соединений с БД (по текущему воркеру)"""
+    check_admin_access(current_user)
+    return pool_status()
+
 @router.get("/metrics")
-async def get_admin_metrics(
+def get_admin_metrics(
+    refresh: bool = False,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Получить метрики для админ-дашборда"""
+    """Получить метрики для админ-дашборда (из снимка, refresh=true — пересчитать)"""
     check_admin_access(current_user)
     
     try:
-        # Базовые метрики
-        total_users = db.query(User).count()
-        total_articles = db.query(Article).count()
-        total_requests = db.query(Request).count()
-        total_suppliers = db.query(Supplier).count()
-        
-        # Метрики поддержки
-        total_tickets = db.query(SupportTicket).count()
-        open_tickets = db.query(SupportTicket).filter(
-            SupportTicket.status.in_(['open', 'in_progress'])
-        ).count()
-        
-        # Метрики пользователей по ролям
-        users_by_role = db.query(
-            User.role, 
-            func.count(User.id).label('count')
-        ).group_by(User.role).all()
-        
-        # Недавние пользователи (за последние 30 дней)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_users = db.query(User).filter(
-            User.created_at >= thirty_days_ago
-        ).count()
-        
-        # Активные запросы (за последние 7 дней)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_requests = db.query(Request).filter(
-            Request.created_at >= week_ago
-        ).count()
-        
+        metrics = admin_metrics.get_metrics(db, force=refresh)
         return {
-            "users": total_users,
-            "articles": total_articles,
-            "requests": total_requests,
-            "suppliers": total_suppliers,
-            "tickets": total_tickets,
-            "open_tickets": open_tickets,
-            "recent_users": recent_users,
-            "recent_requests": recent_requests,
-            "users_by_role": {role: count for role, count in users_by_role},
+            "users": metrics["users"]["total"],
+            "articles": metrics["articles"],
+            "requests": metrics["requests"]["total"],
+            "suppliers": metrics["suppliers"],
+            "tickets": metrics["tickets"]["total"],
+            "open_tickets": metrics["tickets"]["active"],
+            "recent_users": metrics["users"]["recent_30_days"],
+            "recent_requests": metrics["requests"]["recent_7_days"],
+            "users_by_role": metrics["users"]["by_role"],
+            "computed_at": metrics["computed_at"],
             "events": 0,  # Добавим позже если нужно
             "documents": 0  # Добавим позже если нужно
         }
@@ -219,8 +200,12 @@ async def delete_table_record(
                 detail="Нельзя удалить самого себя"
             )
         
+        username = record.username if table_name == 'users' else None
         db.delete(record)
         db.commit()
+        if username:
+            # Удаленный пользователь не должен проходить аутентификацию по кэшу
+            auth.invalidate_user_cache(username)
         
         return {"message": "Запись удалена"}
     except Exception as e:
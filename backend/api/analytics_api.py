@@ -1,14 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional
+from datetime import datetime
 
 from app.database import get_db
 from app.models import User, Analytics
 from app.schemas import AnalyticsOut
 from app import auth
-from app import crud
+from app import crud, pagination
 
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
@@ -35,6 +37,14 @@ def get_analytics(
 
 @router.get("/admin/all")
 def get_all_analytics(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.LIST_MAX_LIMIT),
+    cursor: Optional[int] = Query(None, description="id последней строки предыдущей страницы (X-Next-Cursor)"),
+    user_id: Optional[int] = None,
+    action: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    count: Optional[str] = Query(None, pattern=pagination.COUNT_MODES),
     current_user: User = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
@@ -45,15 +55,27 @@ def get_all_analytics(
             detail="Доступ запрещен"
         )
     
-    # Получаем всю аналитику
-    all_analytics = db.query(Analytics).join(User).order_by(Analytics.timestamp.desc()).all()
+    # Новые сначала; пользователи подгружаются одним запросом на страницу
+    stmt = select(Analytics).options(selectinload(Analytics.user))
+    if user_id is not None:
+        stmt = stmt.where(Analytics.user_id == user_id)
+    if action:
+        stmt = stmt.where(Analytics.action == action)
+    if date_from is not None:
+        stmt = stmt.where(Analytics.timestamp >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Analytics.timestamp < date_to)
+    page = pagination.paginate(db, stmt, Analytics.id, limit, cursor, count,
+                               unpaged_order=Analytics.timestamp.desc())
+    pagination.set_page_headers(response, page)
+    all_analytics = page.items
     
     analytics_data = []
     for analytics in all_analytics:
         analytics_data.append({
             "id": analytics.id,
             "user_id": analytics.user_id,
-            "username": analytics.user.username,
+            "username": analytics.user.username if analytics.user else None,
             "action": analytics.action,
             "timestamp": analytics.timestamp.isoformat() if analytics.timestamp else "",
             "details": analytics.details
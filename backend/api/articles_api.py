@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models import Article, User
-from app.schemas import ArticleOut
+from app.schemas import ArticleOut, ArticleSearchResult
 from typing import List, Optional
 from pydantic import BaseModel
-from app.auth import get_current_user
+from datetime import datetime
+from app import auth, catalog, crud, pagination
+
+get_current_user = auth.get_token_user
 
 class ArticleCreate(BaseModel):
     code: str
@@ -14,40 +18,82 @@ class ArticleCreate(BaseModel):
 router = APIRouter(prefix="/articles", tags=["articles"])
 
 @router.post("/", response_model=ArticleOut)
-def create_article(article: ArticleCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_article(article: ArticleCreate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
     db_article = Article(code=article.code, user_id=current_user.id, request_id=article.request_id)
+    await db.run_sync(catalog.attach_part, db_article)
     db.add(db_article)
-    db.commit()
-    db.refresh(db_article)
+    await db.commit()
+    await db.refresh(db_article)
     return db_article
 
 @router.get("/", response_model=List[ArticleOut])
-def get_articles(db: Session = Depends(get_db)):
-    return db.query(Article).all()
+async def get_articles(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.LIST_MAX_LIMIT),
+    cursor: Optional[int] = Query(None, description="id последней строки предыдущей страницы (X-Next-Cursor)"),
+    user_id: Optional[int] = None,
+    request_id: Optional[int] = None,
+    code_prefix: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    count: Optional[str] = Query(None, pattern=pagination.COUNT_MODES),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Список артикулов постранично, новые сначала. Без limit и cursor — все строки в порядке добавления"""
+    stmt = select(Article)
+    if user_id is not None:
+        stmt = stmt.where(Article.user_id == user_id)
+    if request_id is not None:
+        stmt = stmt.where(Article.request_id == request_id)
+    if code_prefix:
+        stmt = stmt.where(Article.code.startswith(code_prefix, autoescape=True))
+    if created_from is not None:
+        stmt = stmt.where(Article.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Article.created_at < created_to)
+    page = await db.run_sync(pagination.paginate, stmt, Article.id, limit, cursor, count,
+                              unpaged_order=Article.id)
+    pagination.set_page_headers(response, page)
+    return page.items
+
+@router.get("/search", response_model=List[ArticleSearchResult])
+async def search_articles(
+    q: str = Query(..., min_length=1, description="Артикул целиком или частично, с любыми разделителями"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Поиск артикулов: точные совпадения, затем по префиксу, затем нечеткие"""
+    found = await db.run_sync(crud.search_articles, q, limit)
+    return [
+        {**ArticleOut.model_validate(item["article"]).model_dump(), "normalized_code": item["article"].normalized_code,
+         "match": item["match"], "score": item["score"]}
+        for item in found
+    ]
 
 @router.get("/{article_id}", response_model=ArticleOut)
-def get_article(article_id: int, db: Session = Depends(get_db)):
-    article = db.query(Article).filter(Article.id == article_id).first()
+async def get_article(article_id: int, db: AsyncSession = Depends(get_async_db)):
+    article = await db.get(Article, article_id)
     if not article:
         raise HTTPException(status_code=404, detail="Article not found")
     return article
 
 @router.put("/{article_id}", response_model=ArticleOut)
-def update_article(article_id: int, article: ArticleOut, db: Session = Depends(get_db)):
-    db_article = db.query(Article).filter(Article.id == article_id).first()
+async def update_article(article_id: int, article: ArticleOut, db: AsyncSession = Depends(get_async_db)):
+    db_article = await db.get(Article, article_id)
     if not db_article:
         raise HTTPException(status_code=404, detail="Article not found")
     for key, value in article.dict().items():
         setattr(db_article, key, value)
-    db.commit()
-    db.refresh(db_article)
+    await db.run_sync(catalog.attach_part, db_article)
+    await db.commit()
+    await db.refresh(db_article)
     return db_article
 
 @router.delete("/{article_id}")
-def delete_article(article_id: int, db: Session = Depends(get_db)):
-    db_article = db.query(Article).filter(Article.id == article_id).first()
+async def delete_article(article_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_article = await db.get(Article, article_id)
     if not db_article:
         raise HTTPException(status_code=404, detail="Article not found")
-    db.delete(db_article)
-    db.commit()
-    return {"ok": True} 
\ No newline at end of file
+    await db.delete(db_article)
+    await db.commit()
+    return {"ok": True}
@@ -1,23 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Form, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from datetime import datetime
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models import User
 from app.schemas import UserResponse
 from app import auth
 
+get_current_user = auth.get_current_user_async
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/login")
-def login(
+async def login(
+    request: Request,
     username: str = Form(...), 
     password: str = Form(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Вход пользователя"""
-    user = auth.authenticate_user(db, username, password)
+    ip = request.client.host if request.client else None
+    auth.check_login_rate(username, ip)
+    user = await auth.authenticate_user_async(db, username, password)
+    auth.record_login_result(username, ip, success=bool(user))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -27,7 +33,7 @@ def login(
     
     access_token_expires = auth.datetime.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     
     return {
@@ -37,15 +43,15 @@ def login(
     }
 
 @router.post("/register")
-def register(
+async def register(
     username: str = Form(...),
     password: str = Form(...),
     email: str = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Регистрация нового пользователя"""
     # Проверяем, существует ли пользователь
-    existing_user = db.query(User).filter(User.username == username).first()
+    existing_user = await auth.get_user_async(db, username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -53,7 +59,7 @@ def register(
         )
     
     # Создаем нового пользователя
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password)
     user = User(
         username=username,
         hashed_password=hashed_password,
@@ -62,39 +68,39 @@ def register(
     )
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
     
     return {"message": "Пользователь успешно зарегистрирован"}
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user_info(
-    current_user: User = Depends(auth.get_current_user)
+async def get_current_user_info(
+    current_user: User = Depends(get_current_user)
 ):
     """Получить информацию о текущем пользователе"""
     return current_user
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     current_password: str = Form(...),
     new_password: str = Form(...),
-    current_user: User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Смена пароля пользователем"""
     # Проверяем текущий пароль
-    if not auth.verify_password(current_password, current_user.hashed_password):
+    if not await auth.verify_password_async(current_password, current_user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Неверный текущий пароль"
         )
     
     # Хешируем новый пароль
-    hashed_new_password = auth.get_password_hash(new_password)
+    hashed_new_password = await auth.get_password_hash_async(new_password)
     
     # Обновляем пароль и сбрасываем флаг принудительной смены
     current_user.hashed_password = hashed_new_password
     current_user.force_password_change = False
-    db.commit()
+    await db.commit()
+    auth.invalidate_user_cache(current_user.username)
     
     return {"message": "Пароль успешно изменен"} 
\ No newline at end of file
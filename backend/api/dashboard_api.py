@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from app.database import get_db
 from app.models import User
-from app.auth import get_current_user
+from app.auth import get_token_user as get_current_user
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
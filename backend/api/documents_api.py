@@ -10,7 +10,7 @@ from app.schemas import DocumentCreate, DocumentUpdate, DocumentResponse, Docume
 from app import auth
 
 # Используем правильную функцию аутентификации
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
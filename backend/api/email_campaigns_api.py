@@ -1,18 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, insert
 from typing import List, Dict, Any
 from datetime import datetime
 
 from app.database import get_db
-from app.models import User, Request, Article, Supplier, EmailCampaign, EmailCampaignArticle, EmailMessage, EmailAttachment
+from app.models import User, Request, Article, Supplier, EmailCampaign, EmailCampaignArticle, EmailMessage, EmailAttachment, Analytics
 from app.schemas import (
     EmailCampaignCreate, EmailCampaignUpdate, EmailCampaignResponse, 
     EmailCampaignArticleResponse, EmailMessageCreate, EmailMessageResponse,
-    SupplierGroupingRequest, SupplierGroupingResponse
+    SupplierGroupingRequest, SupplierGroupingResponse, EmailCampaignBulkSend, EmailCampaignBulkCreate
 )
 from app import auth
 from app import crud
+from app import outbound_mail
 
 get_current_user = auth.get_current_user
 
@@ -26,79 +27,76 @@ def group_suppliers_by_email(
 ):
     """Группировка поставщиков по email для выбранных запросов"""
     
-    # Получаем все артикулы из выбранных запросов
-    articles = db.query(Article).filter(
+    # Один запрос: артикулы выбранных запросов и их поставщики с email.
+    # Outer join, чтобы отличить "нет артикулов" от "нет поставщиков с email"
+    rows = db.query(
+        Article.code,
+        Article.request_id,
+        Supplier.email,
+        Supplier.name,
+        Supplier.website,
+        Supplier.country,
+    ).outerjoin(
+        Supplier,
+        and_(
+            Supplier.article_id == Article.id,
+            Supplier.email.isnot(None),
+            Supplier.email != ""
+        )
+    ).filter(
         Article.request_id.in_(request.request_ids)
-    ).all()
+    ).order_by(Supplier.id).all()
     
-    if not articles:
+    if not rows:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Артикулы не найдены в выбранных запросах"
         )
     
-    article_ids = [a.id for a in articles]
-    
-    # Получаем всех поставщиков для этих артикулов
-    suppliers = db.query(Supplier).filter(
-        Supplier.article_id.in_(article_ids),
-        Supplier.email.isnot(None),
-        Supplier.email != ""
-    ).all()
-    
-    # Группируем поставщиков по email
+    # Группируем поставщиков по email за один проход; имя и сайт берутся у первого поставщика
     supplier_groups: Dict[str, Dict[str, Any]] = {}
     
-    for supplier in suppliers:
-        email = supplier.email.lower().strip()
-        if email not in supplier_groups:
-            supplier_groups[email] = {
-                "supplier_email": email,
-                "supplier_name": supplier.name,
-                "supplier_website": supplier.website,
-                "supplier_country": supplier.country,
+    for code, request_id, email, name, website, country in rows:
+        email = (email or "").lower().strip()
+        if not email:
+            continue
+        group = supplier_groups.get(email)
+        if group is None:
+            group = supplier_groups[email] = {
+                "supplier_name": name,
+                "supplier_website": website,
+                "supplier_country": country,
                 "articles": {},
                 "requests": set(),
                 "total_articles": 0
             }
-        
-        # Добавляем артикул
-        article = db.query(Article).filter(Article.id == supplier.article_id).first()
-        if article:
-            if article.code not in supplier_groups[email]["articles"]:
-                supplier_groups[email]["articles"][article.code] = {
-                    "code": article.code,
-                    "quantity": 0,
-                    "requests": set()
-                }
-            supplier_groups[email]["articles"][article.code]["quantity"] += 1
-            supplier_groups[email]["articles"][article.code]["requests"].add(article.request_id)
-            supplier_groups[email]["requests"].add(article.request_id)
-            supplier_groups[email]["total_articles"] += 1
-    
-    # Преобразуем в список ответов
-    result = []
-    for email, group in supplier_groups.items():
-        articles_list = [
-            {
-                "code": article_data["code"],
-                "quantity": article_data["quantity"],
-                "requests": list(article_data["requests"])
-            }
-            for article_data in group["articles"].values()
-        ]
-        
-        result.append(SupplierGroupingResponse(
+        article_data = group["articles"].get(code)
+        if article_data is None:
+            article_data = group["articles"][code] = {"code": code, "quantity": 0, "requests": set()}
+        article_data["quantity"] += 1
+        article_data["requests"].add(request_id)
+        group["requests"].add(request_id)
+        group["total_articles"] += 1
+    
+    return [
+        SupplierGroupingResponse(
             supplier_email=email,
             supplier_name=group["supplier_name"],
             supplier_website=group["supplier_website"],
             supplier_country=group["supplier_country"],
-            articles=articles_list,
-            requests=list(group["requests"]),
+            articles=[
+                {
+                    "code": article_data["code"],
+                    "quantity": article_data["quantity"],
+                    "requests": sorted(article_data["requests"])
+                }
+                for article_data in group["articles"].values()
+            ],
+            requests=sorted(group["requests"]),
             total_articles=group["total_articles"]
-        ))
-    
-    return result
+        )
+        for email, group in supplier_groups.items()
+    ]
 
 @router.post("/", response_model=EmailCampaignResponse)
 def create_email_campaign(
@@ -121,12 +119,14 @@ def create_email_campaign(
     )
     
     db.add(db_campaign)
-    db.commit()
-    db.refresh(db_campaign)
+    db.flush()
     
-    # Добавляем артикулы в кампанию
+    # Добавляем артикулы в кампанию (одним запросом на все article_ids)
+    articles = db.query(Article).filter(Article.id.in_(campaign.article_ids)).all() if campaign.article_ids else []
+    articles_by_id = {article.id: article for article in articles}
+    articles_count = 0
     for article_id in campaign.article_ids:
-        article = db.query(Article).filter(Article.id == article_id).first()
+        article = articles_by_id.get(article_id)
         if article:
             campaign_article = EmailCampaignArticle(
                 campaign_id=db_campaign.id,
@@ -135,14 +135,98 @@ def create_email_campaign(
                 quantity=1
             )
             db.add(campaign_article)
+            articles_count += 1
     
+    db_campaign.articles_count = articles_count
     db.commit()
+    db.refresh(db_campaign)
     
     # Записываем аналитику
     crud.add_analytics(db, current_user.id, "Создана email кампания", f"Кампания: {campaign.name}")
     
     return db_campaign
 
+DEFAULT_CAMPAIGN_BODY = (
+    "Уважаемые коллеги!\n\n"
+    "Просим предоставить коммерческое предложение на следующие позиции:\n\n"
+    "{articles}\n\n"
+    "С уважением,\nВаша компания"
+)
+
+@router.post("/bulk", response_model=List[EmailCampaignResponse])
+def create_email_campaigns_bulk(
+    request: EmailCampaignBulkCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Создать кампании по группам поставщиков (результат group-suppliers) одной транзакцией"""
+    
+    if not request.groups:
+        return []
+    
+    # Артикулы всех групп одним запросом: (запрос, код) -> id артикулов
+    request_ids = {
+        request_id
+        for group in request.groups
+        for article in group.articles
+        for request_id in article.requests
+    }
+    articles_by_key: Dict[tuple, List[int]] = {}
+    if request_ids:
+        for article_id, code, request_id in db.query(Article.id, Article.code, Article.request_id).filter(
+            Article.request_id.in_(request_ids)
+        ):
+            articles_by_key.setdefault((request_id, code), []).append(article_id)
+    
+    now = datetime.utcnow()
+    campaign_rows = []
+    campaign_articles = {}
+    for group in request.groups:
+        if group.supplier_email in campaign_articles:
+            continue  # Одна кампания на email, повторные группы пропускаются
+        rows = {}
+        for article in group.articles:
+            for request_id in article.requests:
+                for article_id in articles_by_key.get((request_id, article.code), []):
+                    rows[article_id] = request_id
+        campaign_articles[group.supplier_email] = rows
+        
+        articles_text = "\n".join(f"- {a.code} (количество: {a.quantity})" for a in group.articles)
+        body = request.body if request.body is not None else DEFAULT_CAMPAIGN_BODY
+        campaign_rows.append({
+            "name": request.name or f"Кампания для {group.supplier_name}",
+            "supplier_email": group.supplier_email,
+            "supplier_name": group.supplier_name,
+            "supplier_website": group.supplier_website,
+            "supplier_country": group.supplier_country,
+            "status": "draft",
+            "subject": request.subject,
+            "body": body.replace("{supplier_name}", group.supplier_name).replace("{articles}", articles_text),
+            "user_id": current_user.id,
+            "created_at": now,
+            "updated_at": now,
+            "articles_count": len(rows),
+            "messages_count": 0,
+        })
+    
+    # RETURNING без гарантии порядка строк: кампании сопоставляются по email поставщика
+    inserted = db.execute(
+        insert(EmailCampaign).returning(EmailCampaign.id, EmailCampaign.supplier_email),
+        campaign_rows
+    ).all()
+    campaign_ids = [campaign_id for campaign_id, _ in inserted]
+    article_rows = [
+        {"campaign_id": campaign_id, "article_id": article_id, "request_id": request_id, "quantity": 1}
+        for campaign_id, supplier_email in inserted
+        for article_id, request_id in campaign_articles[supplier_email].items()
+    ]
+    if article_rows:
+        db.execute(insert(EmailCampaignArticle), article_rows)
+    db.add(Analytics(user_id=current_user.id, action="Созданы email кампании", details=f"Кампаний: {len(campaign_ids)}"))
+    db.commit()
+    
+    return db.query(EmailCampaign).filter(EmailCampaign.id.in_(campaign_ids)).order_by(EmailCampaign.id).all()
+
 @router.get("/", response_model=List[EmailCampaignResponse])
 def get_email_campaigns(
     current_user: User = Depends(get_current_user),
@@ -150,42 +234,10 @@ def get_email_campaigns(
 ):
     """Получить список email кампаний пользователя"""
     
-    campaigns = db.query(EmailCampaign).filter(
+    # Счетчики хранятся в самой кампании, поэтому список — один запрос
+    return db.query(EmailCampaign).filter(
         EmailCampaign.user_id == current_user.id
     ).order_by(EmailCampaign.created_at.desc()).all()
-    
-    result = []
-    for campaign in campaigns:
-        # Подсчитываем количество артикулов и сообщений
-        articles_count = db.query(EmailCampaignArticle).filter(
-            EmailCampaignArticle.campaign_id == campaign.id
-        ).count()
-        
-        messages_count = db.query(EmailMessage).filter(
-            EmailMessage.campaign_id == campaign.id
-        ).count()
-        
-        campaign_dict = {
-            "id": campaign.id,
-            "name": campaign.name,
-            "supplier_email": campaign.supplier_email,
-            "supplier_name": campaign.supplier_name,
-            "supplier_website": campaign.supplier_website,
-            "supplier_country": campaign.supplier_country,
-            "status": campaign.status,
-            "subject": campaign.subject,
-            "body": campaign.body,
-            "user_id": campaign.user_id,
-            "created_at": campaign.created_at,
-            "updated_at": campaign.updated_at,
-            "sent_at": campaign.sent_at,
-            "last_reply_at": campaign.last_reply_at,
-            "articles_count": articles_count,
-            "messages_count": messages_count
-        }
-        result.append(campaign_dict)
-    
-    return result
 
 @router.get("/{campaign_id}", response_model=EmailCampaignResponse)
 def get_email_campaign(
@@ -206,35 +258,7 @@ def get_email_campaign(
             detail="Кампания не найдена"
         )
     
-    # Подсчитываем количество артикулов и сообщений
-    articles_count = db.query(EmailCampaignArticle).filter(
-        EmailCampaignArticle.campaign_id == campaign.id
-    ).count()
-    
-    messages_count = db.query(EmailMessage).filter(
-        EmailMessage.campaign_id == campaign.id
-    ).count()
-    
-    campaign_dict = {
-        "id": campaign.id,
-        "name": campaign.name,
-        "supplier_email": campaign.supplier_email,
-        "supplier_name": campaign.supplier_name,
-        "supplier_website": campaign.supplier_website,
-        "supplier_country": campaign.supplier_country,
-        "status": campaign.status,
-        "subject": campaign.subject,
-        "body": campaign.body,
-        "user_id": campaign.user_id,
-        "created_at": campaign.created_at,
-        "updated_at": campaign.updated_at,
-        "sent_at": campaign.sent_at,
-        "last_reply_at": campaign.last_reply_at,
-        "articles_count": articles_count,
-        "messages_count": messages_count
-    }
-    
-    return campaign_dict
+    return campaign
 
 @router.put("/{campaign_id}", response_model=EmailCampaignResponse)
 def update_email_campaign(
@@ -399,6 +423,7 @@ def add_campaign_message(
     )
     
     db.add(db_message)
+    campaign.messages_count = EmailCampaign.messages_count + 1
     db.commit()
     db.refresh(db_message)
     
@@ -415,13 +440,21 @@ def add_campaign_message(
     
     return db_message
 
+def _require_outbound_mail():
+    # Без SMTP воркер не запущен: письмо в очереди никто не отправит, а кампания застрянет в sending
+    if not outbound_mail.is_enabled():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Отправка почты не настроена (SMTP_HOST)"
+        )
+
 @router.post("/{campaign_id}/send")
 def send_campaign(
     campaign_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Отправить кампанию (симуляция отправки)"""
+    """Поставить кампанию в очередь отправки"""
     
     campaign = db.query(EmailCampaign).filter(
         EmailCampaign.id == campaign_id,
@@ -434,33 +467,51 @@ def send_campaign(
             detail="Кампания не найдена"
         )
     
-    if campaign.status == "sent":
+    if campaign.status in ("sending", "sent"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Кампания уже отправлена"
         )
+    _require_outbound_mail()
     
-    # Создаем сообщение об отправке
-    sent_message = EmailMessage(
-        campaign_id=campaign_id,
-        message_type="sent",
-        subject=campaign.subject,
-        body=campaign.body,
-        from_email=current_user.email or "noreply@company.com",
-        to_email=campaign.supplier_email,
-        external_id=f"sent_{campaign_id}_{datetime.utcnow().timestamp()}"
-    )
+    # Письмо уходит в очередь, отправляет его outbound_mail воркер
+    sent_message = outbound_mail.enqueue_campaign(db, campaign, current_user.email)
+    db.commit()
     
-    db.add(sent_message)
+    # Записываем аналитику
+    crud.add_analytics(db, current_user.id, "Отправлена email кампания", f"Кампания: {campaign.name}")
     
-    # Обновляем статус кампании
-    campaign.status = "sent"
-    campaign.sent_at = datetime.utcnow()
-    campaign.updated_at = datetime.utcnow()
+    return {"status": "queued", "message_id": sent_message.id}
+
+@router.post("/send-bulk")
+def send_campaigns_bulk(
+    request: EmailCampaignBulkSend,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Поставить в очередь отправки несколько кампаний одной транзакцией"""
+    _require_outbound_mail()
+    
+    campaigns = db.query(EmailCampaign).filter(
+        EmailCampaign.id.in_(request.campaign_ids),
+        EmailCampaign.user_id == current_user.id
+    ).all()
     
+    queued = []
+    for campaign in campaigns:
+        if campaign.status in ("sending", "sent"):
+            continue
+        outbound_mail.enqueue_campaign(db, campaign, current_user.email)
+        queued.append(campaign.id)
     db.commit()
     
-    # Записываем аналитику
-    crud.add_analytics(db, current_user.id, "Отправлена email кампания", f"Кампания: {campaign.name}")
+    queued_ids = set(queued)
+    skipped = [campaign_id for campaign_id in request.campaign_ids if campaign_id not in queued_ids]
+    if queued:
+        crud.add_analytics(db, current_user.id, "Отправлены email кампании", f"Кампаний в очереди: {len(queued)}")
     
-    return {"status": "sent", "message_id": sent_message.id} 
\ No newline at end of file
+    return {
+        "status": "queued",
+        "queued": queued,
+        "skipped": skipped
+    } 
\ No newline at end of file
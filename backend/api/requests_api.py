@@ -1,41 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
 from sqlalchemy.exc import IntegrityError
+import asyncio
+import os
+import time
 
-from app.database import get_db
+from app.database import get_async_db, AsyncSessionLocal
 from app.models import User, Request, Article
 from app.schemas import RequestOut, RequestCreate, ArticleOut
 from app import auth
-from app import crud
+from app import catalog, crud, google_search, pagination
+from app.sse import sse_event, sse_response
 
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 router = APIRouter(prefix="/requests", tags=["requests"])
 
+# Сколько разных артикулов заявки искать одновременно
+REQUEST_SEARCH_CONCURRENCY = int(os.getenv("REQUEST_SEARCH_CONCURRENCY", "4"))
+
 @router.post("/", response_model=RequestOut)
-def create_request(
+async def create_request(
     req: RequestCreate, 
     current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Создать новый запрос"""
     request = Request(number=req.number, user_id=current_user.id)
     db.add(request)
     
     try:
-        db.commit()
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Запрос с таким номером уже существует"
         )
     
-    db.refresh(request)
+    await db.refresh(request)
     
     # Записываем аналитику
-    crud.add_analytics(db, current_user.id, "Создан запрос", f"Номер запроса: {req.number}")
+    await db.run_sync(crud.add_analytics, current_user.id, "Создан запрос", f"Номер запроса: {req.number}")
     
     return {
         "id": request.id,
@@ -44,9 +53,31 @@ def create_request(
     }
 
 @router.get("/", response_model=List[RequestOut])
-def get_requests(db: Session = Depends(get_db)):
-    """Получить все запросы"""
-    requests = db.query(Request).all()
+async def get_requests(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=pagination.LIST_MAX_LIMIT),
+    cursor: Optional[int] = Query(None, description="id последней строки предыдущей страницы (X-Next-Cursor)"),
+    user_id: Optional[int] = None,
+    number_prefix: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    count: Optional[str] = Query(None, pattern=pagination.COUNT_MODES),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Получить запросы постранично, новые сначала. Без limit и cursor — все строки в порядке добавления"""
+    stmt = select(Request)
+    if user_id is not None:
+        stmt = stmt.where(Request.user_id == user_id)
+    if number_prefix:
+        stmt = stmt.where(Request.number.startswith(number_prefix, autoescape=True))
+    if created_from is not None:
+        stmt = stmt.where(Request.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Request.created_at < created_to)
+    page = await db.run_sync(pagination.paginate, stmt, Request.id, limit, cursor, count,
+                              unpaged_order=Request.id)
+    pagination.set_page_headers(response, page)
+    requests = page.items
     return [
         {
             "id": req.id,
@@ -57,67 +88,68 @@ def get_requests(db: Session = Depends(get_db)):
     ]
 
 @router.delete("/{request_id}")
-def delete_request(
+async def delete_request(
     request_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Удалить запрос"""
     # Сбросить request_id у всех артикулов
-    db.query(Article).filter(Article.request_id == request_id).update({Article.request_id: None})
+    await db.execute(update(Article).where(Article.request_id == request_id).values(request_id=None))
     
     # Удалить сам запрос
-    request = db.query(Request).filter(Request.id == request_id).first()
+    request = await db.get(Request, request_id)
     if not request:
         raise HTTPException(status_code=404, detail="Запрос не найден")
     
-    db.delete(request)
-    db.commit()
+    await db.delete(request)
+    await db.commit()
     
     return {"status": "deleted"}
 
 @router.post("/{request_id}/add-article/{article_id}")
-def add_article_to_request(
+async def add_article_to_request(
     request_id: int, 
     article_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Добавить артикул в запрос"""
-    article = db.query(Article).filter(Article.id == article_id).first()
+    article = await db.get(Article, article_id)
     if not article:
         raise HTTPException(status_code=404, detail="Артикул не найден")
     
     article.request_id = request_id
-    db.commit()
+    await db.commit()
     
     return {"status": "added"}
 
 @router.post("/{request_id}/remove-article/{article_id}")
-def remove_article_from_request(
+async def remove_article_from_request(
     request_id: int, 
     article_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Удалить артикул из запроса"""
-    article = db.query(Article).filter(
+    result = await db.execute(select(Article).where(
         Article.id == article_id, 
         Article.request_id == request_id
-    ).first()
+    ))
+    article = result.scalars().first()
     
     if not article:
         raise HTTPException(status_code=404, detail="Артикул не найден в этом запросе")
     
     article.request_id = None
-    db.commit()
+    await db.commit()
     
     return {"status": "removed"}
 
 @router.get("/{request_id}/articles", response_model=List[ArticleOut])
-def get_articles_by_request(
+async def get_articles_by_request(
     request_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить артикулы по запросу"""
-    articles = db.query(Article).filter(Article.request_id == request_id).all()
+    articles = (await db.execute(select(Article).where(Article.request_id == request_id))).scalars().all()
     return [
         {
             "id": a.id,
@@ -125,4 +157,78 @@ def get_articles_by_request(
             "request_id": a.request_id
         }
         for a in articles
-    ] 
\ No newline at end of file
+    ]
+
+@router.post("/{request_id}/search-suppliers")
+async def search_request_suppliers(
+    request_id: int, 
+    refresh: bool = Query(False, description="Игнорировать кэш результатов поиска"),
+    current_user: User = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Поиск поставщиков сразу для всех артикулов заявки (поток Server-Sent Events)"""
+    request = await db.get(Request, request_id)
+    if not request:
+        raise HTTPException(status_code=404, detail="Запрос не найден")
+    
+    # Одинаковые артикулы ищем один раз
+    articles_by_code = {}
+    rows = await db.execute(select(Article.id, Article.code).where(Article.request_id == request_id))
+    for article_id, code in rows.all():
+        articles_by_code.setdefault(google_search.normalize_article_code(code), []).append((article_id, code))
+    user_id = current_user.id
+    request_number = request.number
+    
+    async def events():
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(REQUEST_SEARCH_CONCURRENCY)
+        
+        async def run(articles):
+            code = articles[0][1]
+            article_ids = [article_id for article_id, _ in articles]
+            async with semaphore:
+                try:
+                    found, stats = await catalog.search_suppliers(code, use_cache=not refresh)
+                    # Поставщики всех артикулов с этим кодом заменяются одной транзакцией
+                    async with AsyncSessionLocal() as session:
+                        saved = len(await session.run_sync(crud.add_suppliers_bulk, article_ids, found, user_id))
+                except Exception as e:
+                    print(f"Request {request_id} supplier search error ({code}): {e}")
+                    return {"code": code, "article_ids": article_ids, "error": str(e)}
+                return {
+                    "code": code,
+                    "article_ids": article_ids,
+                    "suppliers_found": len(found),
+                    "suppliers_saved": saved,
+                    "region_stats": stats,
+                }
+        
+        yield sse_event("start", {"request_id": request_id, "articles": sum(len(a) for a in articles_by_code.values()), "unique_codes": len(articles_by_code)})
+        tasks = [asyncio.create_task(run(articles)) for articles in articles_by_code.values()]
+        total_saved = 0
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if "error" in result:
+                    failed += 1
+                    yield sse_event("error", result)
+                    continue
+                total_saved += result["suppliers_saved"]
+                yield sse_event("article", result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        summary = {
+            "request_id": request_id,
+            "unique_codes": len(articles_by_code),
+            "failed": failed,
+            "suppliers_saved": total_saved,
+            "elapsed_ms": int((time.perf_counter() - started) * 1000),
+        }
+        async with AsyncSessionLocal() as session:
+            await session.run_sync(crud.add_analytics, user_id, "Поиск поставщиков по запросу", f"Запрос: {request_number}, артикулов: {len(articles_by_code)}, найдено: {total_saved} поставщиков")
+        yield sse_event("done", summary)
+    
+    return sse_response(events())
@@ -1,15 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from pydantic import BaseModel
+import asyncio
+import time
 
-from app.database import get_db
-from app.models import User, Supplier, Article
-from app.schemas import SupplierOut
+from app.database import get_async_db, AsyncSessionLocal
+from app.models import User, Supplier, Article, SupplierSearchJob
+from app.schemas import SupplierOut, SupplierSearchJobOut
 from app import auth
-from app import crud, google_search
+from app import catalog, crud, google_search, supplier_jobs
+from app.sse import sse_event, sse_response
 
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 router = APIRouter(prefix="/suppliers", tags=["suppliers"])
 
@@ -19,88 +24,184 @@ class EmailUpdateRequest(BaseModel):
 class EmailValidatedRequest(BaseModel):
     validated: bool
 
+class FindEmailsRequest(BaseModel):
+    article_id: Optional[int] = None
+    supplier_ids: Optional[List[int]] = None
+    only_missing: bool = True  # Искать только для поставщиков без email
+
 @router.get("/{article_id}", response_model=List[SupplierOut])
-def get_suppliers(
+async def get_suppliers(
     article_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить поставщиков для артикула"""
-    return crud.get_suppliers_for_article(db, article_id)
+    result = await db.execute(select(Supplier).where(Supplier.article_id == article_id))
+    return result.scalars().all()
 
-@router.post("/search/{article_id}", response_model=List[SupplierOut])
+@router.post("/search/{article_id}", response_model=SupplierSearchJobOut)
 async def search_suppliers(
     article_id: int, 
+    refresh: bool = Query(False, description="Игнорировать кэш результатов поиска"),
     current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Поиск поставщиков для артикула"""
-    article = db.query(Article).filter(Article.id == article_id).first()
+    """Поставить поиск поставщиков для артикула в очередь"""
+    article = await db.get(Article, article_id)
     if not article:
         raise HTTPException(status_code=404, detail="Артикул не найден")
     
-    # Удаляем старых поставщиков для этого артикула
-    db.query(Supplier).filter(Supplier.article_id == article_id).delete()
-    db.commit()
+    job = await db.run_sync(supplier_jobs.enqueue_search_job, article_id, current_user.id, not refresh)
+    return supplier_jobs.job_to_dict(job)
+
+@router.get("/search/jobs/{job_id}", response_model=SupplierSearchJobOut)
+async def get_search_job(
+    job_id: int, 
+    current_user: User = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Статус задачи поиска поставщиков"""
+    job = await db.get(SupplierSearchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return supplier_jobs.job_to_dict(job)
+
+@router.get("/search/jobs/{job_id}/events")
+async def stream_search_job(
+    job_id: int, 
+    current_user: User = Depends(get_current_user)
+):
+    """Поток прогресса задачи поиска (Server-Sent Events)"""
+    async def events():
+        last = None
+        while True:
+            async with AsyncSessionLocal() as db:
+                job = await db.get(SupplierSearchJob, job_id)
+                payload = jsonable_encoder(supplier_jobs.job_to_dict(job)) if job else None
+            if payload is None:
+                yield sse_event("error", {"detail": "Задача не найдена"})
+                return
+            if payload != last:
+                yield sse_event("progress", payload)
+                last = payload
+            if payload["status"] in supplier_jobs.FINISHED_STATUSES:
+                return
+            await asyncio.sleep(1)
     
-    regions = ["Europe", "North America", "South America", "Russia", "Asia"]
-    suppliers = []
+    return sse_response(events())
+
+@router.post("/search/{article_id}/stream")
+async def search_suppliers_stream(
+    article_id: int, 
+    refresh: bool = Query(False, description="Игнорировать кэш результатов поиска"),
+    current_user: User = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Поиск поставщиков с выдачей каждого найденного поставщика событием SSE"""
+    article = await db.get(Article, article_id)
+    if not article:
+        raise HTTPException(status_code=404, detail="Артикул не найден")
+    code = article.code
+    user_id = current_user.id
+    
+    async def events():
+        started = time.perf_counter()
+        stats = []
+        total = 0
+        async for region, found, stat in catalog.iter_suppliers(code, use_cache=not refresh):
+            # Прежние поставщики удаляются вместе с сохранением первого региона
+            async with AsyncSessionLocal() as session:
+                saved = await session.run_sync(crud.add_suppliers_bulk, [article_id], found, user_id, not stats)
+            stats.append(stat)
+            total += len(saved)
+            for supplier in saved:
+                yield sse_event("supplier", {"region": region, **supplier})
+            yield sse_event("region", stat)
+        
+        region_stats = google_search.format_region_stats(stats)
+        async with AsyncSessionLocal() as session:
+            await session.run_sync(crud.add_analytics, user_id, "Поиск поставщиков", f"Артикул: {code}, найдено: {total} поставщиков; регионы: {region_stats}")
+        yield sse_event("done", {
+            "article_id": article_id,
+            "suppliers_found": total,
+            "region_stats": stats,
+            "elapsed_ms": int((time.perf_counter() - started) * 1000),
+        })
+    
+    return sse_response(events())
+
+@router.post("/find-emails")
+async def find_supplier_emails(
+    req: FindEmailsRequest, 
+    current_user: User = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Массовый поиск email для поставщиков артикула или заданного списка поставщиков"""
+    if req.article_id is None and not req.supplier_ids:
+        raise HTTPException(status_code=400, detail="Укажите article_id или supplier_ids")
     
-    for region in regions:
-        found = await google_search.search_suppliers_perplexity(article.code, region)
-        for s in found:
-            supplier = crud.add_supplier(
-                db, 
-                article_id, 
-                s["name"], 
-                s["website"], 
-                s["email"], 
-                s["country"],
-                current_user.id
-            )
-            suppliers.append(supplier)
+    query = select(Supplier)
+    if req.article_id is not None:
+        query = query.where(Supplier.article_id == req.article_id)
+    if req.supplier_ids:
+        query = query.where(Supplier.id.in_(req.supplier_ids))
+    suppliers = (await db.execute(query)).scalars().all()
+    if req.only_missing:
+        suppliers = [s for s in suppliers if not s.email]
     
-    # Записываем аналитику
-    crud.add_analytics(db, current_user.id, "Поиск поставщиков", f"Артикул: {article.code}, найдено: {len(suppliers)} поставщиков")
+    found = await google_search.find_emails_for_domains([
+        {"name": s.name, "website": s.website, "region": s.country} for s in suppliers
+    ])
+    emails = {}
+    for s in suppliers:
+        email = found.get(google_search.extract_domain(s.website))
+        if email:
+            emails[s.id] = email
+    updated = await db.run_sync(crud.set_supplier_emails_bulk, emails)
+    await db.run_sync(catalog.set_part_supplier_emails, found)
     
-    return suppliers
+    return {
+        "checked": len(suppliers),
+        "domains": len(found),
+        "updated": updated,
+        "emails": [{"id": supplier_id, "email": email} for supplier_id, email in emails.items()],
+    }
 
 @router.patch("/{supplier_id}/email")
-def update_supplier_email(
+async def update_supplier_email(
     supplier_id: int, 
     req: EmailUpdateRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновить email поставщика"""
-    supplier = db.query(Supplier).filter(Supplier.id == supplier_id).first()
+    supplier = await db.get(Supplier, supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Поставщик не найден")
     
     supplier.email = req.email
-    db.commit()
-    db.refresh(supplier)
+    await db.commit()
     
     return {"id": supplier.id, "email": supplier.email}
 
 @router.patch("/{supplier_id}/email-validated")
-def update_supplier_email_validated(
+async def update_supplier_email_validated(
     supplier_id: int, 
     req: EmailValidatedRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновить статус валидации email поставщика"""
-    supplier = crud.set_supplier_email_validated(db, supplier_id, req.validated)
+    supplier = await db.run_sync(crud.set_supplier_email_validated, supplier_id, req.validated)
     if not supplier:
         raise HTTPException(status_code=404, detail="Поставщик не найден")
     
     return {"id": supplier.id, "email_validated": supplier.email_validated}
 
 @router.delete("/{supplier_id}")
-def delete_supplier(
+async def delete_supplier(
     supplier_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Удалить поставщика"""
-    success = crud.delete_supplier(db, supplier_id)
+    success = await db.run_sync(crud.delete_supplier, supplier_id)
     if not success:
         raise HTTPException(status_code=404, detail="Поставщик не найден")
     
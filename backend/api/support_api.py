@@ -1,14 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
 from typing import List
 from datetime import datetime
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models import User, SupportMessage
 from app.schemas import SupportMessageCreate, SupportMessageResponse, SupportMessageList
 from app import auth
 
-get_current_user = auth.get_current_user
+get_current_user = auth.get_token_user
 
 router = APIRouter(prefix="/support", tags=["support"])
 
@@ -16,7 +18,7 @@ router = APIRouter(prefix="/support", tags=["support"])
 async def send_support_message(
     message_data: SupportMessageCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Отправить сообщение в поддержку
@@ -31,8 +33,8 @@ async def send_support_message(
         )
         
         db.add(support_message)
-        db.commit()
-        db.refresh(support_message)
+        await db.commit()
+        await db.refresh(support_message)
         
         # Добавляем имя пользователя для ответа
         response_data = SupportMessageResponse(
@@ -49,7 +51,7 @@ async def send_support_message(
         return response_data
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при отправке сообщения: {str(e)}"
@@ -58,7 +60,7 @@ async def send_support_message(
 @router.get("/messages", response_model=SupportMessageList)
 async def get_support_messages(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100)
 ):
@@ -67,14 +69,14 @@ async def get_support_messages(
     """
     try:
         # Получаем сообщения пользователя
-        messages = db.query(SupportMessage).filter(
+        messages = (await db.execute(select(SupportMessage).where(
             SupportMessage.user_id == current_user.id
-        ).order_by(SupportMessage.created_at.desc()).offset(skip).limit(limit).all()
+        ).order_by(SupportMessage.created_at.desc()).offset(skip).limit(limit))).scalars().all()
         
         # Получаем общее количество
-        total = db.query(SupportMessage).filter(
+        total = await db.scalar(select(func.count(SupportMessage.id)).where(
             SupportMessage.user_id == current_user.id
-        ).count()
+        ))
         
         # Формируем ответ
         response_messages = []
@@ -105,16 +107,16 @@ async def get_support_messages(
 async def mark_message_as_read(
     message_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Отметить сообщение как прочитанное
     """
     try:
-        message = db.query(SupportMessage).filter(
+        message = (await db.execute(select(SupportMessage).where(
             SupportMessage.id == message_id,
             SupportMessage.user_id == current_user.id
-        ).first()
+        ))).scalars().first()
         
         if not message:
             raise HTTPException(
@@ -123,12 +125,12 @@ async def mark_message_as_read(
             )
         
         message.is_read = True
-        db.commit()
+        await db.commit()
         
         return {"message": "Сообщение отмечено как прочитанное"}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при обновлении сообщения: {str(e)}"
@@ -138,7 +140,7 @@ async def mark_message_as_read(
 @router.get("/admin/messages", response_model=List[SupportMessageResponse])
 async def get_all_support_messages(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить все сообщения поддержки (только для админов)
@@ -151,9 +153,11 @@ async def get_all_support_messages(
         )
     
     try:
-        messages = db.query(SupportMessage).join(User).order_by(
+        messages = (await db.execute(select(SupportMessage).join(SupportMessage.user).options(
+            contains_eager(SupportMessage.user)
+        ).order_by(
             SupportMessage.created_at.desc()
-        ).all()
+        ))).scalars().all()
         
         response_messages = []
         for msg in messages:
@@ -181,7 +185,7 @@ async def admin_reply(
     user_id: int,
     message_data: SupportMessageCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Ответить пользователю от имени администратора
@@ -195,7 +199,7 @@ async def admin_reply(
     
     try:
         # Проверяем, что пользователь существует
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             raise HTTPException(
                 status_code=404,
@@ -211,8 +215,8 @@ async def admin_reply(
         )
         
         db.add(support_message)
-        db.commit()
-        db.refresh(support_message)
+        await db.commit()
+        await db.refresh(support_message)
         
         return SupportMessageResponse(
             id=support_message.id,
@@ -226,7 +230,7 @@ async def admin_reply(
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Ошибка при отправке ответа: {str(e)}"
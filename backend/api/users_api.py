@@ -55,6 +55,8 @@ async def update_user_profile(
             detail="Пользователь не найден"
         )
     
+    old_username = user.username
+
     # Обновляем разрешенные поля
     if profile_update.username:
         # Проверяем, что username уникален
@@ -96,6 +98,7 @@ async def update_user_profile(
     user.updated_at = datetime.utcnow()
     
     db.commit()
+    auth.invalidate_user_cache(old_username)
     db.refresh(user)
     
     return user
@@ -216,7 +219,7 @@ async def generate_new_password(
     
     # Генерируем новый пароль
     new_password = auth.generate_random_password()
-    hashed_password = auth.get_password_hash(new_password)
+    hashed_password = await auth.get_password_hash_async(new_password)
     
     # Обновляем пароль пользователя
     user.hashed_password = hashed_password
@@ -224,6 +227,7 @@ async def generate_new_password(
     user.updated_at = datetime.utcnow()
     
     db.commit()
+    auth.invalidate_user_cache(user.username)
     db.refresh(user)
     
     return {
@@ -327,7 +331,7 @@ async def create_user(
     
     # Генерируем случайный пароль
     generated_password = auth.generate_random_password()
-    hashed_password = auth.get_password_hash(generated_password)
+    hashed_password = await auth.get_password_hash_async(generated_password)
     
     # Создаем нового пользователя
     new_user = User(
@@ -398,6 +402,8 @@ async def update_user(
             detail="Пользователь не найден"
         )
     
+    old_username = user.username
+
     # Обновляем поля
     update_data = user_data.model_dump(exclude_unset=True)
     for field, value in update_data.items():
@@ -406,6 +412,7 @@ async def update_user(
     
     try:
         db.commit()
+        auth.invalidate_user_cache(old_username)
         db.refresh(user)
         return user
     except Exception as e:
@@ -447,6 +454,7 @@ async def delete_user(
     try:
         db.delete(user)
         db.commit()
+        auth.invalidate_user_cache(user.username)
         return {"message": "Пользователь успешно удален"}
     except Exception as e:
         db.rollback()
@@ -489,9 +497,7 @@ async def reset_user_password(
     new_password = generate_password()
     
     # Хешируем пароль
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    hashed_password = pwd_context.hash(new_password)
+    hashed_password = await auth.get_password_hash_async(new_password)
     
     # Обновляем пароль и устанавливаем флаг принудительной смены
     user.hashed_password = hashed_password
@@ -499,6 +505,7 @@ async def reset_user_password(
     
     try:
         db.commit()
+        auth.invalidate_user_cache(user.username)
         return {"password": new_password, "message": "Пароль успешно сброшен"}
     except Exception as e:
         db.rollback()
@@ -532,6 +539,7 @@ async def upload_avatar(
     user = db.query(User).filter(User.id == current_user.id).first()
     user.avatar_url = avatar_url
     db.commit()
+    auth.invalidate_user_cache(user.username)
     db.refresh(user)
     return {"avatar_url": avatar_url} 
 
@@ -0,0 +1,181 @@
+"""Счетчики для админских дашбордов.
+
+Все счетчики считаются одним запросом (UNION ALL по таблицам с GROUP BY) и хранятся
+в таблице admin_metrics_snapshots. Дашборды читают снимок; если он старше
+ADMIN_METRICS_MAX_AGE секунд — пересчитывают. Фоновая задача обновляет снимок заранее,
+поэтому обычно страница получает готовые данные за один запрос к БД.
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+
+from sqlalchemy import String, Integer, case, cast, func, literal, null, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+# Допустимая устарелость снимка для дашбордов, секунды
+ADMIN_METRICS_MAX_AGE = int(os.getenv("ADMIN_METRICS_MAX_AGE", "60"))
+# Как часто фоновая задача проверяет снимок (0 — только пересчет при чтении)
+ADMIN_METRICS_REFRESH_INTERVAL = float(os.getenv("ADMIN_METRICS_REFRESH_INTERVAL", "30"))
+
+SNAPSHOT_ID = 1
+ACTIVE_TICKET_STATUSES = ("open", "in_progress")
+
+_refresher_task = None
+
+
+def _row(metric: str, key1=None, key2=None, total=None, recent=None):
+    return [
+        literal(metric).label("metric"),
+        cast(key1 if key1 is not None else null(), String).label("key1"),
+        cast(key2 if key2 is not None else null(), String).label("key2"),
+        (total if total is not None else func.count()).label("total"),
+        cast(func.coalesce(recent, 0) if recent is not None else literal(0), Integer).label("recent"),
+    ]
+
+
+def _metrics_query(now: datetime.datetime):
+    month_ago = now - datetime.timedelta(days=30)
+    week_ago = now - datetime.timedelta(days=7)
+    in_three_days = now + datetime.timedelta(days=3)
+    return union_all(
+        select(*_row("users", models.User.role, recent=func.sum(case((models.User.created_at >= month_ago, 1), else_=0))))
+        .group_by(models.User.role),
+        select(*_row("requests", recent=func.sum(case((models.Request.created_at >= week_ago, 1), else_=0))))
+        .select_from(models.Request),
+        select(*_row("articles")).select_from(models.Article),
+        select(*_row("suppliers")).select_from(models.Supplier),
+        select(*_row("tickets", models.SupportTicket.status, models.SupportTicket.priority))
+        .group_by(models.SupportTicket.status, models.SupportTicket.priority),
+        select(*_row("deadlines")).select_from(models.SupportEvent).where(
+            models.SupportEvent.event_type == "deadline",
+            models.SupportEvent.event_date >= now,
+            models.SupportEvent.event_date <= in_three_days,
+            models.SupportEvent.is_completed == False,
+        ),
+    )
+
+
+def compute_metrics(db: Session) -> dict:
+    """Считает все счетчики одним запросом"""
+    now = datetime.datetime.utcnow()
+    data = {
+        "users": {"total": 0, "by_role": {}, "recent_30_days": 0},
+        "requests": {"total": 0, "recent_7_days": 0},
+        "articles": 0,
+        "suppliers": 0,
+        "tickets": {"total": 0, "by_status": {}, "by_priority": {}, "active": 0, "urgent_active": 0},
+        "deadlines_upcoming_3_days": 0,
+    }
+    for metric, key1, key2, total, recent in db.execute(_metrics_query(now)):
+        if metric == "users":
+            data["users"]["total"] += total
+            data["users"]["by_role"][key1] = data["users"]["by_role"].get(key1, 0) + total
+            data["users"]["recent_30_days"] += recent
+        elif metric == "requests":
+            data["requests"] = {"total": total, "recent_7_days": recent}
+        elif metric == "tickets":
+            tickets = data["tickets"]
+            tickets["total"] += total
+            tickets["by_status"][key1] = tickets["by_status"].get(key1, 0) + total
+            tickets["by_priority"][key2] = tickets["by_priority"].get(key2, 0) + total
+            if key1 in ACTIVE_TICKET_STATUSES:
+                tickets["active"] += total
+                if key2 == "urgent":
+                    tickets["urgent_active"] += total
+        elif metric == "deadlines":
+            data["deadlines_upcoming_3_days"] = total
+        else:
+            data[metric] = total
+    return data
+
+
+def _payload(snapshot: models.AdminMetricsSnapshot) -> dict:
+    data = json.loads(snapshot.data)
+    data["computed_at"] = snapshot.computed_at
+    data["age_seconds"] = int((datetime.datetime.utcnow() - snapshot.computed_at).total_seconds())
+    return data
+
+
+def refresh_snapshot(db: Session, snapshot: models.AdminMetricsSnapshot = None) -> models.AdminMetricsSnapshot:
+    started = time.perf_counter()
+    data = json.dumps(compute_metrics(db), ensure_ascii=False)
+    compute_ms = int((time.perf_counter() - started) * 1000)
+    if snapshot is None:
+        snapshot = models.AdminMetricsSnapshot(id=SNAPSHOT_ID)
+        db.add(snapshot)
+    snapshot.data = data
+    snapshot.computed_at = datetime.datetime.utcnow()
+    snapshot.compute_ms = compute_ms
+    try:
+        db.commit()
+    except IntegrityError:
+        # Первый снимок одновременно создал другой воркер
+        db.rollback()
+        snapshot = db.get(models.AdminMetricsSnapshot, SNAPSHOT_ID)
+    return snapshot
+
+
+def get_metrics(db: Session, max_age: int = None, force: bool = False) -> dict:
+    """Снимок счетчиков не старше max_age секунд (по умолчанию ADMIN_METRICS_MAX_AGE)"""
+    max_age = ADMIN_METRICS_MAX_AGE if max_age is None else max_age
+    snapshot = db.get(models.AdminMetricsSnapshot, SNAPSHOT_ID)
+    if snapshot is None:
+        return _payload(refresh_snapshot(db))
+    age = (datetime.datetime.utcnow() - snapshot.computed_at).total_seconds()
+    if not force and age <= max_age:
+        return _payload(snapshot)
+    # Пересчитывает тот, кто взял блокировку; остальные отдают прежний снимок
+    locked = (
+        db.query(models.AdminMetricsSnapshot)
+        .filter(models.AdminMetricsSnapshot.id == SNAPSHOT_ID)
+        .with_for_update(skip_locked=True)
+        .populate_existing()
+        .first()
+    )
+    if locked is None:
+        db.rollback()
+        return _payload(db.get(models.AdminMetricsSnapshot, SNAPSHOT_ID))
+    if not force and (datetime.datetime.utcnow() - locked.computed_at).total_seconds() <= max_age:
+        # Пока ждали, снимок уже обновили
+        db.commit()
+        return _payload(locked)
+    return _payload(refresh_snapshot(db, locked))
+
+
+def _refresh_if_stale():
+    db = SessionLocal()
+    try:
+        # Обновляем заранее, чтобы чтение почти никогда не попадало на пересчет
+        get_metrics(db, max_age=ADMIN_METRICS_MAX_AGE / 2)
+    finally:
+        db.close()
+
+
+async def refresher_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, _refresh_if_stale)
+        except Exception as e:
+            print(f"Admin metrics refresh error: {e}")
+        await asyncio.sleep(ADMIN_METRICS_REFRESH_INTERVAL)
+
+
+def start_refresher():
+    global _refresher_task
+    if ADMIN_METRICS_REFRESH_INTERVAL > 0 and _refresher_task is None:
+        _refresher_task = asyncio.create_task(refresher_loop())
+
+
+async def stop_refresher():
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        await asyncio.gather(_refresher_task, return_exceptions=True)
+        _refresher_task = None
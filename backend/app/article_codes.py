@@ -0,0 +1,8 @@
+import re
+
+_SEPARATORS_RE = re.compile(r"[\s\-_./\\]+")
+
+
+def normalize_article_code(article_code: str) -> str:
+    """Приводит артикул к каноническому виду: верхний регистр, без пробелов и разделителей"""
+    return _SEPARATORS_RE.sub("", (article_code or "").upper())
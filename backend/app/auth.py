@@ -2,17 +2,52 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from . import models, database
+from sqlalchemy import select, inspect as sa_inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from . import models, database, schemas
+from .cache import TTLCache
+from .ratelimit import SlidingWindowLimiter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime
+import math
+import os
 import secrets
 import string
+import time
 
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Кэш аутентифицированных пользователей (на процесс): снимок колонок по (username, token)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2000"))
+# Класть id, role и department в токен, чтобы get_token_user обходился без запроса к БД.
+# Инвалидация claims хранится только в памяти процесса, где поменяли пользователя: остальные
+# воркеры (и этот же после перезапуска) верят role/department из токена до его истечения,
+# т.е. смена роли или разжалование админа вступает в силу до ACCESS_TOKEN_EXPIRE_MINUTES позже.
+# Включать, только если такая задержка допустима.
+AUTH_TOKEN_CLAIMS = os.getenv("AUTH_TOKEN_CLAIMS", "false").lower() in ("1", "true", "yes")
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# username -> время инвалидации: claims из токенов, выданных раньше, перепроверяются по БД
+# (только в текущем процессе, см. AUTH_TOKEN_CLAIMS)
+_claims_revoked = TTLCache(maxsize=USER_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt (~250 мс CPU) считается в отдельном пуле потоков, чтобы не блокировать event loop;
+# размер пула ограничивает число одновременных хешей на процесс
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Лимит неудачных попыток входа (0 — без лимита). Успешные входы не считаются; пользовательский
+# лимит ведется по паре (username, IP), чтобы чужие неверные пароли не блокировали вход владельцу
+LOGIN_RATE_WINDOW = float(os.getenv("LOGIN_RATE_WINDOW", "60"))
+login_user_limiter = SlidingWindowLimiter(int(os.getenv("LOGIN_RATE_LIMIT_PER_USER", "5")), LOGIN_RATE_WINDOW)
+login_ip_limiter = SlidingWindowLimiter(int(os.getenv("LOGIN_RATE_LIMIT_PER_IP", "20")), LOGIN_RATE_WINDOW)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def generate_random_password(length: int = 12) -> str:
@@ -32,12 +67,71 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, get_password_hash, password)
+
+def _login_user_key(username: str, ip: str = None):
+    return (username.lower(), ip)
+
+def check_login_rate(username: str, ip: str = None):
+    """Бросает 429, если исчерпан лимит неудачных попыток входа по username или IP"""
+    retry_after = max(
+        login_user_limiter.peek(_login_user_key(username, ip)),
+        login_ip_limiter.peek(ip) if ip else 0,
+    )
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа, попробуйте позже",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+def record_login_result(username: str, ip: str = None, success: bool = False):
+    """Неудачная попытка учитывается в лимитах, успешная сбрасывает счетчик пользователя"""
+    if success:
+        login_user_limiter.reset(_login_user_key(username, ip))
+        return
+    login_user_limiter.hit(_login_user_key(username, ip))
+    if ip:
+        login_ip_limiter.hit(ip)
+
 def create_access_token(data: dict, expires_delta: datetime.timedelta = None):
     to_encode = data.copy()
     expire = datetime.datetime.utcnow() + (expires_delta or datetime.timedelta(minutes=15))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def token_claims(user: models.User) -> dict:
+    """Данные для access-токена: sub всегда, id/role/department — при AUTH_TOKEN_CLAIMS"""
+    claims = {"sub": user.username}
+    if AUTH_TOKEN_CLAIMS:
+        claims.update({
+            "uid": user.id,
+            "role": user.role,
+            "department": user.department,
+            "iat": datetime.datetime.utcnow(),
+        })
+    return claims
+
+def invalidate_user_cache(username: str):
+    """Сбрасывает кэш пользователя. Вызывать при смене роли, пароля, username и удалении"""
+    user_cache.pop_matching(lambda key: key[0] == username)
+    _claims_revoked.set(username, time.time())
+
+def _user_snapshot(user: models.User) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in sa_inspect(models.User).column_attrs}
+
+def _user_from_snapshot(snapshot: dict) -> models.User:
+    # Detached-объект с известным ключом: session.merge(load=False) привяжет его без SELECT
+    user = models.User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
 def get_user(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
@@ -47,20 +141,81 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    user = await get_user_async(db, username)
+    if not user or not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def _username_from_token(token: str) -> str:
+    return _decode_token(token)["sub"]
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    username = _username_from_token(token)
+    snapshot = user_cache.get((username, token))
+    if snapshot is not None:
+        return db.merge(_user_from_snapshot(snapshot), load=False)
     user = get_user(db, username=username)
     if user is None:
-        raise credentials_exception
-    return user 
\ No newline at end of file
+        raise _credentials_exception()
+    user_cache.set((username, token), _user_snapshot(user))
+    return user
+
+async def get_user_async(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
+    """То же, что get_current_user, но через AsyncSession (для роутеров на get_async_db)"""
+    username = _username_from_token(token)
+    snapshot = user_cache.get((username, token))
+    if snapshot is not None:
+        return await db.merge(_user_from_snapshot(snapshot), load=False)
+    user = await get_user_async(db, username=username)
+    if user is None:
+        raise _credentials_exception()
+    user_cache.set((username, token), _user_snapshot(user))
+    return user
+
+async def get_token_user(token: str = Depends(oauth2_scheme)) -> schemas.TokenUser:
+    """Текущий пользователь для ручек, которым нужны только id, username, role и department.
+
+    Если в токене есть claims и пользователь не инвалидирован после выдачи токена — БД не трогаем,
+    иначе берем снимок из кэша или загружаем пользователя в короткой сессии: соединение
+    возвращается в пул сразу после запроса, а не держится до конца ручки.
+    """
+    payload = _decode_token(token)
+    username = payload["sub"]
+    revoked_at = _claims_revoked.get(username)
+    if "uid" in payload and (revoked_at is None or payload.get("iat", 0) > revoked_at):
+        return schemas.TokenUser(
+            id=payload["uid"],
+            username=username,
+            role=payload.get("role") or "user",
+            department=payload.get("department"),
+        )
+    snapshot = user_cache.get((username, token))
+    if snapshot is None:
+        async with database.AsyncSessionLocal() as db:
+            user = await get_user_async(db, username=username)
+        if user is None:
+            raise _credentials_exception()
+        snapshot = _user_snapshot(user)
+        user_cache.set((username, token), snapshot)
+    return schemas.TokenUser.model_validate(snapshot)
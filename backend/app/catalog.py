@@ -0,0 +1,191 @@
+"""Общий каталог деталей.
+
+Артикулы пользователей ссылаются на деталь (Part) по нормализованному коду, а найденные
+поставщики копятся на детали (PartSupplier) без дублей по домену. Если деталь уже искали
+недавно, повторный поиск по тому же коду — это чтение из каталога, а не запросы к LLM.
+"""
+import asyncio
+import datetime
+import os
+import time
+from typing import List, Optional
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import google_search, models
+from .article_codes import normalize_article_code
+from .database import SessionLocal
+
+# Сколько секунд найденные поставщики детали считаются актуальными
+PART_CATALOG_TTL = int(os.getenv("PART_CATALOG_TTL", str(30 * 24 * 3600)))
+
+CATALOG_REGION = "catalog"
+
+
+def get_or_create_part(db: Session, code: str) -> Optional[models.Part]:
+    """Деталь каталога для артикула; создается при первом обращении (без commit)"""
+    normalized = normalize_article_code(code)
+    if not normalized:
+        return None
+    part = db.query(models.Part).filter(models.Part.normalized_code == normalized).first()
+    if part:
+        return part
+    try:
+        # Savepoint: параллельный запрос мог создать ту же деталь
+        with db.begin_nested():
+            part = models.Part(normalized_code=normalized, code=code.strip())
+            db.add(part)
+    except IntegrityError:
+        part = db.query(models.Part).filter(models.Part.normalized_code == normalized).first()
+    return part
+
+
+def attach_part(db: Session, article: models.Article) -> models.Article:
+    part = get_or_create_part(db, article.code)
+    article.part_id = part.id if part else None
+    return article
+
+
+def load_part_suppliers(db: Session, code: str, max_age: int = None) -> Optional[List[dict]]:
+    """Поставщики детали из каталога или None, если деталь не искали дольше max_age секунд"""
+    part = db.query(models.Part).filter(models.Part.normalized_code == normalize_article_code(code)).first()
+    if not part or not part.suppliers_updated_at:
+        return None
+    max_age = PART_CATALOG_TTL if max_age is None else max_age
+    if part.suppliers_updated_at < datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age):
+        return None
+    rows = db.query(models.PartSupplier).filter(models.PartSupplier.part_id == part.id).order_by(models.PartSupplier.id).all()
+    if not rows:
+        # Пустой результат не считаем знанием: поиск мог просто ничего не вернуть
+        return None
+    return [
+        {"name": s.name, "website": s.website, "email": s.email or "", "country": s.country}
+        for s in rows
+    ]
+
+
+def merge_part_suppliers(db: Session, code: str, suppliers: List[dict], complete: bool = True) -> int:
+    """Добавляет найденных поставщиков к детали, объединяя по домену. Возвращает число новых.
+
+    complete=False (часть регионов не ответила) — поставщики сохраняются, но деталь
+    не помечается как найденная, и следующий поиск снова пойдет во внешние источники.
+    """
+    part = get_or_create_part(db, code)
+    if not part:
+        return 0
+    now = datetime.datetime.utcnow()
+    existing = {
+        s.domain: s
+        for s in db.query(models.PartSupplier).filter(models.PartSupplier.part_id == part.id)
+    }
+    new_rows = {}
+    for s in suppliers:
+        domain = google_search.extract_domain(s.get("website"))
+        if not domain:
+            continue
+        known = existing.get(domain)
+        if known is not None:
+            known.last_seen_at = now
+            if s.get("email") and not known.email:
+                known.email = s["email"]
+        elif domain in new_rows:
+            if s.get("email") and not new_rows[domain]["email"]:
+                new_rows[domain]["email"] = s["email"]
+        else:
+            new_rows[domain] = {
+                "part_id": part.id,
+                "domain": domain,
+                "name": s.get("name"),
+                "website": s.get("website"),
+                "email": s.get("email") or "",
+                "country": s.get("country"),
+                "first_seen_at": now,
+                "last_seen_at": now,
+            }
+    added = 0
+    if new_rows:
+        # Параллельный поиск по той же детали мог уже вставить домен: такие строки пропускаем
+        insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(models.PartSupplier).values(list(new_rows.values()))
+        added = db.execute(stmt.on_conflict_do_nothing(index_elements=["part_id", "domain"])).rowcount
+    if complete:
+        part.suppliers_updated_at = now
+    db.commit()
+    return added
+
+
+def set_part_supplier_emails(db: Session, emails: dict) -> int:
+    """Проставляет найденные email ({domain: email}) поставщикам каталога, у которых email пуст"""
+    emails = {domain: email for domain, email in emails.items() if domain and email}
+    if not emails:
+        return 0
+    stmt = (
+        update(models.PartSupplier)
+        .where(models.PartSupplier.domain == bindparam("b_domain"))
+        .where(or_(models.PartSupplier.email.is_(None), models.PartSupplier.email == ""))
+        .values(email=bindparam("b_email"))
+    )
+    db.connection().execute(stmt, [{"b_domain": domain, "b_email": email} for domain, email in emails.items()])
+    db.commit()
+    return len(emails)
+
+
+def _load_part_suppliers(code: str) -> Optional[List[dict]]:
+    db = SessionLocal()
+    try:
+        return load_part_suppliers(db, code)
+    finally:
+        db.close()
+
+
+def _merge_part_suppliers(code: str, suppliers: List[dict], complete: bool):
+    db = SessionLocal()
+    try:
+        merge_part_suppliers(db, code, suppliers, complete)
+    except Exception as e:
+        db.rollback()
+        print(f"Part catalog update error ({code}): {e}")
+    finally:
+        db.close()
+
+
+async def iter_suppliers(article_code: str, use_cache: bool = True, **kwargs):
+    """То же, что google_search.iter_suppliers_by_region, но сначала смотрит в каталог.
+
+    Если деталь недавно искали, отдается один элемент с регионом "catalog" и статусом
+    "catalog". Иначе идет поиск по регионам, а результат пополняет каталог.
+    """
+    loop = asyncio.get_running_loop()
+    if use_cache:
+        started = time.perf_counter()
+        known = await loop.run_in_executor(None, _load_part_suppliers, article_code)
+        if known is not None:
+            yield CATALOG_REGION, known, {
+                "region": CATALOG_REGION,
+                "status": "catalog",
+                "latency_ms": int((time.perf_counter() - started) * 1000),
+                "count": len(known),
+            }
+            return
+
+    collected = []
+    complete = True
+    async for region, found, stat in google_search.iter_suppliers_by_region(article_code, use_cache=use_cache, **kwargs):
+        collected.extend(found)
+        complete = complete and stat["status"] in ("ok", "cached")
+        yield region, found, stat
+    await loop.run_in_executor(None, _merge_part_suppliers, article_code, collected, complete)
+
+
+async def search_suppliers(article_code: str, use_cache: bool = True, **kwargs):
+    """Все поставщики артикула одним списком: (found, stats)"""
+    found = []
+    stats = []
+    async for region, region_found, stat in iter_suppliers(article_code, use_cache=use_cache, **kwargs):
+        found.extend(region_found)
+        stats.append(stat)
+    return found, stats
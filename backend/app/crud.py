@@ -1,5 +1,8 @@
+from sqlalchemy import Float, func, insert, literal, update
 from sqlalchemy.orm import Session
-from . import models, schemas, auth
+from typing import List
+from . import catalog, models, schemas, auth
+from .article_codes import normalize_article_code
 
 def create_user(db: Session, username: str, password: str):
     hashed_password = auth.get_password_hash(password)
@@ -13,12 +16,57 @@ def get_article_by_code(db: Session, code: str, user_id: int):
     return db.query(models.Article).filter(models.Article.code == code, models.Article.user_id == user_id).first()
 
 def create_article(db: Session, code: str, user_id: int):
-    db_article = models.Article(code=code, user_id=user_id)
+    db_article = catalog.attach_part(db, models.Article(code=code, user_id=user_id))
     db.add(db_article)
     db.commit()
     db.refresh(db_article)
     return db_article
 
+def search_articles(db: Session, query: str, limit: int = 20) -> List[dict]:
+    """Поиск артикулов по нормализованному коду: точные, префиксные, затем нечеткие совпадения.
+
+    Каждый этап ограничен limit и идет по своему индексу, поэтому не сортирует всю таблицу.
+    """
+    code = normalize_article_code(query)
+    if not code:
+        return []
+    column = models.Article.normalized_code
+    results = []
+    seen_ids = []
+
+    def collect(rows, match, score):
+        for article in rows:
+            results.append({"article": article, "match": match, "score": round(score(article), 3)})
+            seen_ids.append(article.id)
+
+    collect(
+        db.query(models.Article).filter(column == code).limit(limit).all(),
+        "exact", lambda article: 1.0,
+    )
+    if len(results) < limit:
+        # LIKE 'ABC%' по индексу varchar_pattern_ops; короткие коды ближе к запросу,
+        # поэтому сортируем до LIMIT, иначе в выдачу попадут произвольные длинные коды
+        rows = db.query(models.Article).filter(
+            column.startswith(code, autoescape=True), column != code,
+        ).order_by(func.length(column), column).limit(limit - len(results)).all()
+        collect(rows, "prefix", lambda article: len(code) / len(article.normalized_code))
+    if len(results) < limit:
+        remaining = limit - len(results)
+        fuzzy = db.query(models.Article)
+        if seen_ids:
+            fuzzy = fuzzy.filter(models.Article.id.notin_(seen_ids))
+        if db.get_bind().dialect.name == "postgresql":
+            # word_similarity из pg_trgm: часть артикула или опечатки; KNN по GiST-индексу
+            term = literal(code)
+            distance = term.op("<<->", return_type=Float)(column)
+            rows = fuzzy.add_columns(distance).filter(term.op("<%")(column)).order_by(distance).limit(remaining).all()
+            for article, dist in rows:
+                results.append({"article": article, "match": "fuzzy", "score": round(1 - dist, 3)})
+        else:
+            rows = fuzzy.filter(column.contains(code, autoescape=True)).limit(remaining).all()
+            collect(rows, "fuzzy", lambda article: len(code) / len(article.normalized_code))
+    return results
+
 def add_supplier(db: Session, article_id: int, name: str, website: str, email: str, country: str, user_id: int):
     supplier = models.Supplier(article_id=article_id, name=name, website=website, email=email, country=country, user_id=user_id)
     db.add(supplier)
@@ -26,6 +74,50 @@ def add_supplier(db: Session, article_id: int, name: str, website: str, email: s
     db.refresh(supplier)
     return supplier
 
+def add_suppliers_bulk(db: Session, article_ids: List[int], suppliers: List[dict], user_id: int, replace: bool = True):
+    """Сохраняет найденных поставщиков для артикулов одной транзакцией.
+
+    Вставка идет одним INSERT ... RETURNING, поэтому ответ (поля SupplierOut)
+    собирается без повторного SELECT. replace=True сначала удаляет прежних
+    поставщиков этих артикулов в той же транзакции.
+    """
+    try:
+        if replace:
+            db.query(models.Supplier).filter(models.Supplier.article_id.in_(article_ids)).delete(synchronize_session=False)
+        rows = [
+            {
+                "article_id": article_id,
+                "name": s["name"],
+                "website": s["website"],
+                "email": s["email"],
+                "country": s["country"],
+                "email_validated": False,
+                "user_id": user_id,
+            }
+            for article_id in article_ids
+            for s in suppliers
+        ]
+        created = []
+        if rows:
+            result = db.execute(
+                insert(models.Supplier).returning(
+                    models.Supplier.id,
+                    models.Supplier.article_id,
+                    models.Supplier.name,
+                    models.Supplier.website,
+                    models.Supplier.email,
+                    models.Supplier.country,
+                    models.Supplier.email_validated,
+                ),
+                rows,
+            )
+            created = [dict(row._mapping) for row in result]
+        db.commit()
+        return created
+    except Exception:
+        db.rollback()
+        raise
+
 def get_suppliers_for_article(db: Session, article_id: int):
     return db.query(models.Supplier).filter(models.Supplier.article_id == article_id).all()
 
@@ -101,6 +193,18 @@ def delete_supplier(db: Session, supplier_id: int):
         return True
     return False
 
+def set_supplier_emails_bulk(db: Session, emails: dict):
+    """Проставляет email поставщикам ({supplier_id: email}) одной транзакцией"""
+    if not emails:
+        return 0
+    try:
+        db.execute(update(models.Supplier), [{"id": supplier_id, "email": email} for supplier_id, email in emails.items()])
+        db.commit()
+        return len(emails)
+    except Exception:
+        db.rollback()
+        raise
+
 def set_supplier_email_validated(db: Session, supplier_id: int, validated: bool):
     supplier = db.query(models.Supplier).filter(models.Supplier.id == supplier_id).first()
     if supplier:
@@ -1,6 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 POSTGRES_USER = os.getenv("POSTGRES_USER", "appuser")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "apppassword")
@@ -8,14 +13,150 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "appdb")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+# Настройки пула соединений. Каждый uvicorn-воркер держит два пула (sync и async), оба
+# берутся из одного бюджета на процесс: DB_PROCESS_CONNECTIONS (по умолчанию 10, т.е. 40
+# соединений на 4 воркера) или DB_MAX_CONNECTIONS, поделенный на WEB_CONCURRENCY воркеров.
+# Бюджет делится пополам между пулами; DB_POOL_SIZE / DB_MAX_OVERFLOW, если заданы явно,
+# имеют приоритет над ним.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "4"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+if DB_MAX_CONNECTIONS:
+    DB_PROCESS_CONNECTIONS = max(2, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)
+    _budget_source = f"DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} / WEB_CONCURRENCY={WEB_CONCURRENCY}"
+else:
+    DB_PROCESS_CONNECTIONS = int(os.getenv("DB_PROCESS_CONNECTIONS", "10"))
+    _budget_source = f"DB_PROCESS_CONNECTIONS={DB_PROCESS_CONNECTIONS}"
+_pool_capacity = max(1, DB_PROCESS_CONNECTIONS // 2)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str((_pool_capacity + 1) // 2)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(0, _pool_capacity - DB_POOL_SIZE))))
+_pool_overridden = "DB_POOL_SIZE" in os.environ or "DB_MAX_OVERFLOW" in os.environ
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# Режим для PgBouncer (transaction pooling): без серверных prepared statements
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER", False)
+
+
+class PoolMetrics:
+    """Время ожидания соединения из пула и число таймаутов (на процесс)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.waits,
+                "wait_avg_ms": round(self.wait_total / self.waits * 1000, 2) if self.waits else 0,
+                "wait_max_ms": round(self.wait_max * 1000, 2),
+                "timeouts": self.timeouts,
+            }
+
+
+class _MeteredPoolMixin:
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.observe(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - started)
+        return conn
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    metrics = PoolMetrics()
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    metrics = PoolMetrics()
+
+
+_pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
 SQLALCHEMY_DATABASE_URL = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=MeteredQueuePool, **_pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Асинхронный движок (asyncpg) для обработчиков async def: запросы не блокируют event loop
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+_async_connect_args = {}
+if DB_PGBOUNCER:
+    _async_connect_args = {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=MeteredAsyncQueuePool,
+    connect_args=_async_connect_args,
+    **_pool_options,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def _pool_status(pool, metrics: PoolMetrics) -> dict:
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 3) if capacity else 0,
+        **metrics.snapshot(),
+    }
+
+def describe_pool_config() -> str:
+    """Строка о размере пулов и источнике бюджета соединений (для лога при старте приложения)"""
+    if _pool_overridden:
+        return (f"DB pool: DB_POOL_SIZE={DB_POOL_SIZE}, DB_MAX_OVERFLOW={DB_MAX_OVERFLOW} override budget {_budget_source}"
+                f" (up to {2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW)} connections per process)")
+    return f"DB pool: pool_size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW} per pool from {_budget_source}"
+
+def pool_status() -> dict:
+    """Состояние пулов соединений текущего воркера"""
+    return {
+        "pid": os.getpid(),
+        "pgbouncer_mode": DB_PGBOUNCER,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "sync": _pool_status(engine.pool, MeteredQueuePool.metrics),
+        "async": _pool_status(async_engine.sync_engine.pool, MeteredAsyncQueuePool.metrics),
+    }
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
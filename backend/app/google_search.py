@@ -3,9 +3,20 @@ import httpx
 import re
 import json
 import asyncio
-from openai import OpenAI
+import time
+import datetime
+import random
+import openai
+from openai import AsyncOpenAI
 import whois
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from . import models
+from .article_codes import normalize_article_code
+from .cache import TTLCache
+from .ratelimit import AsyncRateLimiter
+from .database import SessionLocal
 
 AGGREGATORS = ["alibaba", "ebay", "amazon", "yandex", "avito", "ozon", "aliexpress"]
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "...")
@@ -15,8 +26,82 @@ SEARCH_ROLES = [
     "дилер", "дистрибьютор", "поставщик", "производитель", "официальный сайт", "купить оптом", "distributor", "supplier", "manufacturer"
 ]
 
+# Регионы, по которым ищутся поставщики для артикула
+SEARCH_REGIONS = ["Europe", "North America", "South America", "Russia", "Asia"]
+# Сколько регионов опрашивать одновременно и сколько ждать ответа по одному региону (сек)
+SEARCH_REGION_CONCURRENCY = int(os.getenv("SUPPLIER_SEARCH_CONCURRENCY", "5"))
+SEARCH_REGION_TIMEOUT = float(os.getenv("SUPPLIER_SEARCH_REGION_TIMEOUT", "90"))
+# Если Perplexity ничего не нашел — искать через Google CSE
+SUPPLIER_SEARCH_GOOGLE_FALLBACK = os.getenv("SUPPLIER_SEARCH_GOOGLE_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+# Кэш результатов поиска: в памяти воркера (LRU) и в Postgres (общий для всех воркеров)
+SUPPLIER_CACHE_TTL = int(os.getenv("SUPPLIER_SEARCH_CACHE_TTL", str(24 * 3600)))
+SUPPLIER_CACHE_SIZE = int(os.getenv("SUPPLIER_SEARCH_CACHE_SIZE", "1000"))
+supplier_search_cache = TTLCache(maxsize=SUPPLIER_CACHE_SIZE, ttl=SUPPLIER_CACHE_TTL)
+
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "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")
-client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai")
+# Пул соединений к Perplexity: общий на процесс, с keep-alive и явными лимитами
+PERPLEXITY_MAX_CONNECTIONS = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", "20"))
+PERPLEXITY_MAX_KEEPALIVE = int(os.getenv("PERPLEXITY_MAX_KEEPALIVE", "10"))
+PERPLEXITY_TIMEOUT = float(os.getenv("PERPLEXITY_TIMEOUT", "60"))
+PERPLEXITY_CONNECT_TIMEOUT = float(os.getenv("PERPLEXITY_CONNECT_TIMEOUT", "10"))
+PERPLEXITY_MAX_RETRIES = int(os.getenv("PERPLEXITY_MAX_RETRIES", "3"))
+PERPLEXITY_BACKOFF_BASE = float(os.getenv("PERPLEXITY_BACKOFF_BASE", "0.5"))
+PERPLEXITY_BACKOFF_MAX = float(os.getenv("PERPLEXITY_BACKOFF_MAX", "10"))
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_perplexity_client = None
+
+def get_perplexity_client() -> AsyncOpenAI:
+    """Ленивая инициализация асинхронного клиента (привязывается к event loop воркера)"""
+    global _perplexity_client
+    if _perplexity_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=PERPLEXITY_MAX_CONNECTIONS,
+                max_keepalive_connections=PERPLEXITY_MAX_KEEPALIVE,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(PERPLEXITY_TIMEOUT, connect=PERPLEXITY_CONNECT_TIMEOUT),
+        )
+        # Повторы делаем сами (с jitter), встроенные в SDK отключаем
+        _perplexity_client = AsyncOpenAI(
+            api_key=PERPLEXITY_API_KEY,
+            base_url="https://api.perplexity.ai",
+            http_client=http_client,
+            max_retries=0,
+        )
+    return _perplexity_client
+
+async def close_clients():
+    """Закрывает общие HTTP-клиенты модуля (на остановке приложения)"""
+    global _perplexity_client, _google_client
+    if _perplexity_client is not None:
+        await _perplexity_client.close()
+        _perplexity_client = None
+    if _google_client is not None:
+        await _google_client.aclose()
+        _google_client = None
+
+async def perplexity_chat(messages: List[dict], model: str = "sonar-pro") -> str:
+    """Запрос к Perplexity с повторами при сетевых ошибках, 429 и 5xx (full jitter backoff)"""
+    attempt = 0
+    while True:
+        try:
+            response = await get_perplexity_client().chat.completions.create(model=model, messages=messages)
+            return response.choices[0].message.content
+        except RETRYABLE_ERRORS as e:
+            if attempt >= PERPLEXITY_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(PERPLEXITY_BACKOFF_MAX, PERPLEXITY_BACKOFF_BASE * 2 ** attempt))
+            print(f"Perplexity retry {attempt + 1}/{PERPLEXITY_MAX_RETRIES} in {delay:.2f}s: {e}")
+            attempt += 1
+            await asyncio.sleep(delay)
 
 def extract_country_from_url(url):
     tld = url.split('.')[-1].split('/')[0]
@@ -26,58 +111,130 @@ def extract_country_from_url(url):
     }
     return tld_map.get(tld, "")
 
-async def search_suppliers(article_code: str, region: str):
-    async with httpx.AsyncClient(verify=False) as client:
-        results = []
-        seen_sites = set()
-        article_variants = list(set([
-            article_code,
-            article_code.upper(),
-            article_code.lower()
-        ]))
-        for variant in article_variants:
-            for role in SEARCH_ROLES:
-                query = f"{variant} {role} {region}"
-                url = (
-                    f"https://www.googleapis.com/customsearch/v1?q={query}&key={GOOGLE_API_KEY}&cx={GOOGLE_CX}&num=10"
-                )
-                resp = await client.get(url)
-                data = resp.json()
-                if "items" in data:
-                    for item in data["items"]:
-                        link = item.get("link", "")
-                        if not link or any(a in link for a in AGGREGATORS) or link in seen_sites:
-                            continue
-                        seen_sites.add(link)
-                        # Название компании
-                        name = item.get("title", link.split('//')[1].split('/')[0])
-                        # Email из snippet
-                        snippet = item.get("snippet", "")
-                        emails = re.findall(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+", snippet)
-                        email = emails[0] if emails else ""
-                        # Если не нашли — ищем на сайте
-                        if not email:
-                            try:
-                                site_resp = await client.get(link, timeout=5)
-                                emails = re.findall(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+", site_resp.text)
-                                email = emails[0] if emails else ""
-                            except Exception:
-                                pass
-                        # Страна
-                        country = extract_country_from_url(link)
-                        results.append({
-                            "name": name,
-                            "website": link,
-                            "email": email,
-                            "country": country or region
-                        })
-                        if len(results) >= 12:
-                            break
-                if len(results) >= 12:
-                    break
-            if len(results) >= 12:
-                break
-        return results 
+EMAIL_RE = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+
+# Краулер Google CSE: общий клиент (HTTP/2, если установлен h2), ограничения
+# на число одновременных запросов всего и к одному хосту
+GOOGLE_QUERY_CONCURRENCY = int(os.getenv("GOOGLE_QUERY_CONCURRENCY", "4"))
+GOOGLE_SCRAPE_CONCURRENCY = int(os.getenv("GOOGLE_SCRAPE_CONCURRENCY", "10"))
+GOOGLE_PER_HOST_CONCURRENCY = int(os.getenv("GOOGLE_PER_HOST_CONCURRENCY", "2"))
+GOOGLE_SCRAPE_TIMEOUT = float(os.getenv("GOOGLE_SCRAPE_TIMEOUT", "5"))
+GOOGLE_RESULTS_TARGET = 12
+GOOGLE_CSE_URL = "https://www.googleapis.com/customsearch/v1"
+try:
+    import h2  # noqa: F401
+    GOOGLE_HTTP2 = True
+except ImportError:
+    GOOGLE_HTTP2 = False
+
+_google_client = None
+_host_semaphores = {}  # host -> [семафор, число запросов, которые его держат или ждут]
+
+def get_google_client() -> httpx.AsyncClient:
+    global _google_client
+    if _google_client is None:
+        _google_client = httpx.AsyncClient(
+            http2=GOOGLE_HTTP2,
+            verify=False,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=GOOGLE_SCRAPE_CONCURRENCY + GOOGLE_QUERY_CONCURRENCY, max_keepalive_connections=10),
+            timeout=httpx.Timeout(15, connect=5),
+        )
+    return _google_client
+
+async def _fetch(url: str, per_host: int = None, **kwargs) -> httpx.Response:
+    """GET через общий клиент с ограничением числа одновременных запросов к одному хосту.
+
+    Семафор хоста живет, пока к хосту есть запросы, и удаляется после последнего,
+    поэтому словарь не растет с каждым просмотренным сайтом.
+    """
+    host = httpx.URL(url).host
+    entry = _host_semaphores.get(host)
+    if entry is None:
+        entry = _host_semaphores[host] = [asyncio.Semaphore(per_host or GOOGLE_PER_HOST_CONCURRENCY), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            return await get_google_client().get(url, **kwargs)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _host_semaphores[host]
+
+async def search_suppliers(article_code: str, region: str, target: int = GOOGLE_RESULTS_TARGET):
+    """Поиск поставщиков через Google CSE.
+
+    Поиск Google не различает регистр, поэтому варианты артикула схлопываются в
+    один набор запросов. Запросы к CSE и загрузка сайтов идут параллельно, после
+    набора target результатов оставшиеся задачи отменяются.
+    """
+    queries = list({
+        f"{variant} {role} {region}".casefold(): f"{variant} {role} {region}"
+        for variant in (article_code, article_code.upper(), article_code.lower())
+        for role in SEARCH_ROLES
+    }.values())
+    results = []
+    seen_sites = set()
+    enough = asyncio.Event()
+    query_semaphore = asyncio.Semaphore(GOOGLE_QUERY_CONCURRENCY)
+    scrape_semaphore = asyncio.Semaphore(GOOGLE_SCRAPE_CONCURRENCY)
+
+    async def handle_item(item: dict):
+        link = item["link"]
+        # Название компании
+        name = item.get("title", link.split('//')[-1].split('/')[0])
+        # Email из snippet, если нет — ищем на сайте
+        emails = EMAIL_RE.findall(item.get("snippet", ""))
+        email = emails[0] if emails else ""
+        if not email:
+            try:
+                async with scrape_semaphore:
+                    site_resp = await _fetch(link, timeout=GOOGLE_SCRAPE_TIMEOUT)
+                emails = EMAIL_RE.findall(site_resp.text)
+                email = emails[0] if emails else ""
+            except Exception:
+                pass
+        if enough.is_set():
+            return
+        results.append({
+            "name": name,
+            "website": link,
+            "email": email,
+            "country": extract_country_from_url(link) or region
+        })
+        if len(results) >= target:
+            enough.set()
+
+    async def run_query(query: str):
+        async with query_semaphore:
+            if enough.is_set():
+                return
+            # Запросы к CSE ограничены GOOGLE_QUERY_CONCURRENCY, а не лимитом на хост сайтов
+            resp = await _fetch(
+                GOOGLE_CSE_URL,
+                per_host=GOOGLE_QUERY_CONCURRENCY,
+                params={"q": query, "key": GOOGLE_API_KEY, "cx": GOOGLE_CX, "num": 10},
+            )
+        items = []
+        for item in resp.json().get("items", []):
+            link = item.get("link", "")
+            if not link or any(a in link for a in AGGREGATORS) or link in seen_sites:
+                continue
+            seen_sites.add(link)
+            items.append(item)
+        await asyncio.gather(*(handle_item(item) for item in items))
+
+    tasks = [asyncio.create_task(run_query(q)) for q in queries]
+    all_done = asyncio.gather(*tasks, return_exceptions=True)
+    enough_task = asyncio.create_task(enough.wait())
+    try:
+        await asyncio.wait([all_done, enough_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        enough_task.cancel()
+        await asyncio.gather(all_done, enough_task, return_exceptions=True)
+    return results[:target]
 
 async def search_suppliers_perplexity(article_code: str, region: str):
     prompt = (
@@ -98,15 +255,7 @@ async def search_suppliers_perplexity(article_code: str, region: str):
         },
     ]
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="sonar-pro",
-                messages=messages,
-            )
-        )
-        content = response.choices[0].message.content
+        content = await perplexity_chat(messages)
         # Ищем JSON-массив в ответе
         match = re.search(r'(\[.*?\])', content, re.DOTALL)
         if match:
@@ -126,10 +275,153 @@ async def search_suppliers_perplexity(article_code: str, region: str):
                 return []
         return []
     except Exception as e:
+        # Ошибку пробрасываем: iter_suppliers_by_region пометит регион как error,
+        # и деталь не будет считаться найденной по неполному результату
         print(f"Perplexity API error: {e}")
-        return [] 
+        raise
+
+def extract_domain(url: str) -> str:
+    return re.sub(r"^https?://", "", (url or "").strip().lower()).split("/")[0].split(":")[0]
+
+def _load_cached_suppliers(code: str, region: str):
+    db = SessionLocal()
+    try:
+        fresh_since = datetime.datetime.utcnow() - datetime.timedelta(seconds=SUPPLIER_CACHE_TTL)
+        row = db.query(models.SupplierSearchCache).filter(
+            models.SupplierSearchCache.article_code == code,
+            models.SupplierSearchCache.region == region,
+            models.SupplierSearchCache.created_at >= fresh_since,
+        ).first()
+        return json.loads(row.results) if row else None
+    finally:
+        db.close()
+
+def _store_cached_suppliers(code: str, region: str, found: List[dict]):
+    db = SessionLocal()
+    try:
+        stmt = pg_insert(models.SupplierSearchCache).values(
+            article_code=code,
+            region=region,
+            results=json.dumps(found, ensure_ascii=False),
+            created_at=datetime.datetime.utcnow(),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["article_code", "region"],
+            set_={"results": stmt.excluded.results, "created_at": stmt.excluded.created_at},
+        )
+        db.execute(stmt)
+        db.commit()
+    finally:
+        db.close()
+
+async def get_cached_suppliers(article_code: str, region: str) -> Optional[List[dict]]:
+    """Ищет результат в кэше: сначала в памяти, затем в Postgres. None — промах"""
+    key = (normalize_article_code(article_code), region)
+    found = supplier_search_cache.get(key)
+    if found is not None:
+        return found
+    try:
+        loop = asyncio.get_event_loop()
+        found = await loop.run_in_executor(None, _load_cached_suppliers, *key)
+    except Exception as e:
+        print(f"Supplier cache read error: {e}")
+        return None
+    if found is not None:
+        supplier_search_cache.set(key, found)
+    return found
+
+async def store_cached_suppliers(article_code: str, region: str, found: List[dict]):
+    """Сохраняет непустой результат поиска в оба уровня кэша"""
+    if not found:
+        return
+    key = (normalize_article_code(article_code), region)
+    supplier_search_cache.set(key, found)
+    try:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, _store_cached_suppliers, *key, found)
+    except Exception as e:
+        print(f"Supplier cache write error: {e}")
+
+async def search_suppliers_cached(article_code: str, region: str):
+    """search_suppliers_perplexity с кэшем. Возвращает (found, from_cache)"""
+    found = await get_cached_suppliers(article_code, region)
+    if found is not None:
+        return found, True
+    found = await search_suppliers_perplexity(article_code, region)
+    if not found and SUPPLIER_SEARCH_GOOGLE_FALLBACK:
+        found = await search_suppliers(article_code, region)
+    await store_cached_suppliers(article_code, region, found)
+    return found, False
 
-async def search_email_perplexity(company_name: str, website: str, region: str) -> str:
+async def iter_suppliers_by_region(
+    article_code: str,
+    regions: Optional[List[str]] = None,
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    use_cache: bool = True,
+):
+    """Параллельно опрашивает регионы и отдает (region, found, stat) по мере готовности.
+
+    stat — словарь {region, status, latency_ms, count}, где status: ok, cached, timeout или error.
+    Регион, не уложившийся в timeout, отдается с пустым списком, остальные не ждут его.
+    """
+    regions = regions or SEARCH_REGIONS
+    timeout = timeout or SEARCH_REGION_TIMEOUT
+    semaphore = asyncio.Semaphore(concurrency or SEARCH_REGION_CONCURRENCY)
+
+    async def run(region: str):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if use_cache:
+                    found, from_cache = await asyncio.wait_for(search_suppliers_cached(article_code, region), timeout)
+                else:
+                    found, from_cache = await asyncio.wait_for(search_suppliers_perplexity(article_code, region), timeout), False
+                status = "cached" if from_cache else "ok"
+            except asyncio.TimeoutError:
+                found, status = [], "timeout"
+            except Exception as e:
+                print(f"Supplier search error ({region}): {e}")
+                found, status = [], "error"
+            latency_ms = int((time.perf_counter() - started) * 1000)
+        return region, found, {"region": region, "status": status, "latency_ms": latency_ms, "count": len(found)}
+
+    tasks = [asyncio.create_task(run(region)) for region in regions]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def search_suppliers_all_regions(
+    article_code: str,
+    regions: Optional[List[str]] = None,
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    use_cache: bool = True,
+):
+    """Поиск поставщиков сразу по всем регионам.
+
+    Возвращает (found_by_region, stats): результаты сгруппированы по регионам в исходном
+    порядке, stats — задержка и статус по каждому региону.
+    """
+    regions = regions or SEARCH_REGIONS
+    found_by_region = {}
+    stats = {}
+    async for region, found, stat in iter_suppliers_by_region(article_code, regions, concurrency, timeout, use_cache):
+        found_by_region[region] = found
+        stats[region] = stat
+    return (
+        {region: found_by_region.get(region, []) for region in regions},
+        [stats[region] for region in regions if region in stats],
+    )
+
+def format_region_stats(stats: List[dict]) -> str:
+    """Короткая строка со статистикой по регионам для логов и аналитики"""
+    return ", ".join(f"{s['region']}: {s['count']} за {s['latency_ms']} мс ({s['status']})" for s in stats)
+
+async def search_email_perplexity(company_name: str, website: str, region: str, raise_errors: bool = False) -> str:
     prompt = (
         f"Найди email для отдела продаж, закупок или оптовых заказов компании {company_name} (сайт: {website}) в регионе {region}. "
         f"Приоритет: sales@, orders@, wholesale@, info@, contact@, закупки@, опт@. "
@@ -155,15 +447,7 @@ async def search_email_perplexity(company_name: str, website: str, region: str)
         },
     ]
     try:
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="sonar-pro",
-                messages=messages,
-            )
-        )
-        content = response.choices[0].message.content.strip()
+        content = (await perplexity_chat(messages)).strip()
         # Вырезаем email из ответа (или пустую строку)
         # Сначала ищем стандартный email паттерн
         match = re.search(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", content)
@@ -186,17 +470,192 @@ async def search_email_perplexity(company_name: str, website: str, region: str)
         return ""
     except Exception as e:
         print(f"Perplexity email search error: {e}")
+        if raise_errors:
+            raise
         return ""
 
-# Новый endpoint: проверка сайтов через whois
-async def check_websites_whois(sites: List[str]) -> List[str]:
-    valid = []
-    for url in sites:
-        domain = re.sub(r"^https?://", "", url).split("/")[0]
+class DomainResultCache:
+    """Двухуровневый кэш результатов проверки доменов: TTLCache в памяти процесса и таблица в Postgres.
+
+    model — таблица с колонками domain (unique), checked_at и колонкой значения field.
+    empty_ttl — отдельный (обычно более короткий) срок жизни для пустых значений.
+    Ошибки БД не прерывают поиск: промах кэша просто означает повторную проверку.
+    """
+
+    def __init__(self, name: str, model, field: str, ttl: int, maxsize: int, empty_ttl: Optional[int] = None):
+        self.name = name
+        self.model = model
+        self.field = field
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _ttl_for(self, value) -> Optional[int]:
+        return self.empty_ttl if self.empty_ttl is not None and not value else None
+
+    def _load(self, domains: List[str]) -> dict:
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            rows = db.query(self.model.domain, getattr(self.model, self.field), self.model.checked_at).filter(
+                self.model.domain.in_(domains),
+                self.model.checked_at >= now - datetime.timedelta(seconds=self.ttl),
+            ).all()
+            if self.empty_ttl is None:
+                return {domain: value for domain, value, _ in rows}
+            empty_since = now - datetime.timedelta(seconds=self.empty_ttl)
+            return {domain: value for domain, value, checked_at in rows if value or checked_at >= empty_since}
+        finally:
+            db.close()
+
+    def _store(self, results: dict):
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            stmt = pg_insert(self.model).values([
+                {"domain": domain, self.field: value, "checked_at": now}
+                for domain, value in results.items()
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["domain"],
+                set_={self.field: getattr(stmt.excluded, self.field), "checked_at": stmt.excluded.checked_at},
+            )
+            db.execute(stmt)
+            db.commit()
+        finally:
+            db.close()
+
+    async def get_many(self, domains: List[str]) -> dict:
+        """Известные результаты по доменам: сначала из памяти, затем из Postgres"""
+        results = {}
+        missing = []
+        for domain in domains:
+            value = self.memory.get(domain)
+            if value is None:
+                missing.append(domain)
+            else:
+                results[domain] = value
+        if missing:
+            try:
+                loop = asyncio.get_event_loop()
+                stored = await loop.run_in_executor(None, self._load, missing)
+            except Exception as e:
+                print(f"{self.name} cache read error: {e}")
+                stored = {}
+            for domain, value in stored.items():
+                self.memory.set(domain, value, self._ttl_for(value))
+            results.update(stored)
+        return results
+
+    async def set_many(self, results: dict):
+        """Сохраняет результаты в оба уровня кэша"""
+        if not results:
+            return
+        for domain, value in results.items():
+            self.memory.set(domain, value, self._ttl_for(value))
         try:
-            w = await asyncio.get_event_loop().run_in_executor(None, lambda: whois.whois(domain))
-            if w.domain_name:
-                valid.append(url)
-        except Exception:
-            continue
-    return valid 
\ No newline at end of file
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._store, results)
+        except Exception as e:
+            print(f"{self.name} cache write error: {e}")
+
+# Массовый поиск email: один запрос на домен, ограничение частоты запросов к Perplexity,
+# результат (в том числе «не найден») кэшируется по домену
+EMAIL_SEARCH_CONCURRENCY = int(os.getenv("EMAIL_SEARCH_CONCURRENCY", "5"))
+EMAIL_SEARCH_RATE = float(os.getenv("EMAIL_SEARCH_RATE", "2"))  # запросов в секунду на процесс
+EMAIL_CACHE_TTL = int(os.getenv("EMAIL_CACHE_TTL", str(30 * 24 * 3600)))
+EMAIL_CACHE_EMPTY_TTL = int(os.getenv("EMAIL_CACHE_EMPTY_TTL", str(24 * 3600)))
+email_cache = DomainResultCache(
+    "Email", models.DomainEmailCache, "email", EMAIL_CACHE_TTL,
+    maxsize=int(os.getenv("EMAIL_CACHE_SIZE", "5000")), empty_ttl=EMAIL_CACHE_EMPTY_TTL,
+)
+email_rate_limiter = AsyncRateLimiter(EMAIL_SEARCH_RATE)
+
+async def find_emails_for_domains(companies: List[dict]) -> dict:
+    """Ищет email для компаний, по одному запросу на домен.
+
+    companies — список словарей с ключами name, website, region.
+    Возвращает {domain: email}; пустая строка — email не найден,
+    домены, по которым запрос завершился ошибкой, в ответ не попадают.
+    """
+    by_domain = {}
+    for c in companies:
+        domain = extract_domain(c.get("website", ""))
+        if domain and domain not in by_domain:
+            by_domain[domain] = c
+    results = await email_cache.get_many(list(by_domain))
+    missing = [d for d in by_domain if d not in results]
+
+    semaphore = asyncio.Semaphore(EMAIL_SEARCH_CONCURRENCY)
+
+    async def lookup(domain: str):
+        company = by_domain[domain]
+        async with semaphore:
+            await email_rate_limiter.wait()
+            try:
+                return domain, await search_email_perplexity(
+                    company.get("name", ""), company.get("website", ""), company.get("region", ""), raise_errors=True
+                )
+            except Exception:
+                return domain, None
+
+    # Ошибки запроса не кэшируем, чтобы домен можно было проверить повторно
+    found = {d: email for d, email in await asyncio.gather(*(lookup(d) for d in missing)) if email is not None}
+    await email_cache.set_many(found)
+    results.update(found)
+    return results
+
+# Проверка сайтов через whois: домены дедуплицируются, запросы идут параллельно,
+# результат кэшируется в памяти и в Postgres
+WHOIS_CONCURRENCY = int(os.getenv("WHOIS_CONCURRENCY", "10"))
+WHOIS_TIMEOUT = float(os.getenv("WHOIS_TIMEOUT", "20"))  # таймаут сокета внутри whois-запроса, сек
+WHOIS_CACHE_TTL = int(os.getenv("WHOIS_CACHE_TTL", str(7 * 24 * 3600)))
+whois_cache = DomainResultCache(
+    "Whois", models.DomainWhoisCache, "registered", WHOIS_CACHE_TTL,
+    maxsize=int(os.getenv("WHOIS_CACHE_SIZE", "5000")),
+)
+# Отдельный пул потоков, чтобы медленные whois-серверы не занимали общий пул run_in_executor
+_whois_executor = ThreadPoolExecutor(max_workers=WHOIS_CONCURRENCY, thread_name_prefix="whois")
+
+try:
+    from whois.exceptions import WhoisDomainNotFoundError
+except ImportError:  # python-whois < 0.9
+    from whois.parser import PywhoisError as WhoisDomainNotFoundError
+
+def _whois_registered(domain: str) -> bool:
+    """Незарегистрированный домен — False (кэшируется); сетевые ошибки и таймауты пробрасываются.
+
+    Таймаут задается самому запросу (на сокет whois), поэтому время ожидания свободного
+    потока в пуле в него не входит, а прерванный запрос не продолжает занимать поток.
+    """
+    try:
+        info = whois.whois(domain, quiet=True, ignore_socket_errors=False, timeout=WHOIS_TIMEOUT)
+    except WhoisDomainNotFoundError:
+        return False
+    return bool(info.domain_name)
+
+async def check_domains_whois(domains: List[str]) -> dict:
+    """Возвращает {domain: registered}. Домены, которые не удалось проверить, в ответ не попадают"""
+    loop = asyncio.get_event_loop()
+    domains = list(dict.fromkeys(d for d in domains if d))
+    results = await whois_cache.get_many(domains)
+    missing = [d for d in domains if d not in results]
+
+    semaphore = asyncio.Semaphore(WHOIS_CONCURRENCY)
+
+    async def lookup(domain: str):
+        async with semaphore:
+            try:
+                return domain, await loop.run_in_executor(_whois_executor, _whois_registered, domain)
+            except Exception as e:
+                print(f"Whois lookup failed for {domain}: {e}")
+                return domain, None
+
+    checked = {d: registered for d, registered in await asyncio.gather(*(lookup(d) for d in missing)) if registered is not None}
+    await whois_cache.set_many(checked)
+    results.update(checked)
+    return results
+
+async def check_websites_whois(sites: List[str]) -> List[str]:
+    registered = await check_domains_whois([extract_domain(url) for url in sites])
+    return [url for url in sites if registered.get(extract_domain(url))]
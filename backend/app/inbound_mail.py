@@ -0,0 +1,564 @@
+"""Загрузка ответов поставщиков из почтового ящика (IMAP).
+
+Синхронизация инкрементальная: в mailbox_sync_state хранится UIDVALIDITY ящика и последний
+обработанный UID, каждый проход запрашивает только письма с большим UID. Проход берет ящик
+в работу отметкой claimed_at и сразу коммитит: во время IMAP-загрузки транзакция и соединение
+с БД не держатся, а второй воркер видит отметку и пропускает ящик. Сначала для пачки
+скачиваются одни заголовки; с кампанией письмо связывается по In-Reply-To/References,
+которые ссылаются на Message-ID отправленного письма (EmailMessage.external_id).
+Тела и вложения скачиваются только у совпавших писем: вложения — частями по
+IMAP_FETCH_CHUNK байт (BODY.PEEK[part]<offset.length>) с декодированием на лету, так что
+большой файл не держится в памяти целиком. Письма и вложения пачки вставляются bulk insert.
+"""
+import asyncio
+import binascii
+import datetime
+import imaplib
+import os
+import re
+import uuid
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from email.utils import parseaddr, parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import unquote
+
+from sqlalchemy import bindparam, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+IMAP_HOST = os.getenv("IMAP_HOST", "")  # Пусто — загрузка ответов выключена
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_USERNAME = os.getenv("IMAP_USERNAME", "")
+IMAP_PASSWORD = os.getenv("IMAP_PASSWORD", "")
+IMAP_USE_SSL = os.getenv("IMAP_USE_SSL", "true").lower() == "true"
+IMAP_MAILBOX = os.getenv("IMAP_MAILBOX", "INBOX")
+IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", "60"))
+IMAP_POLL_INTERVAL = float(os.getenv("IMAP_POLL_INTERVAL", "60"))
+IMAP_BATCH_SIZE = int(os.getenv("IMAP_BATCH_SIZE", "200"))  # UID за один проход
+# Через сколько секунд ящик, взятый воркером, считается брошенным (воркер умер посреди прохода)
+IMAP_CLAIM_TIMEOUT = int(os.getenv("IMAP_CLAIM_TIMEOUT", "1800"))
+IMAP_FETCH_CHUNK = int(os.getenv("IMAP_FETCH_CHUNK", str(1024 * 1024)))
+# Текст письма больше этого размера обрезается (вложения не ограничены)
+IMAP_MAX_BODY_BYTES = int(os.getenv("IMAP_MAX_BODY_BYTES", str(1024 * 1024)))
+EMAIL_ATTACHMENTS_DIR = os.getenv(
+    "EMAIL_ATTACHMENTS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads", "email_attachments"),
+)
+
+HEADER_FIELDS = "MESSAGE-ID IN-REPLY-TO REFERENCES FROM TO SUBJECT DATE"
+MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+_poller_task = None
+
+
+# --- Разбор ответов FETCH ---------------------------------------------------
+
+OPEN, CLOSE = object(), object()
+
+
+def _tokenize(text: bytes):
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i:i + 1]
+        if c in b" \r\n\t":
+            i += 1
+        elif c == b"(":
+            yield OPEN
+            i += 1
+        elif c == b")":
+            yield CLOSE
+            i += 1
+        elif c == b'"':
+            i += 1
+            value = bytearray()
+            while i < n and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b"\\":
+                    i += 1
+                value += text[i:i + 1]
+                i += 1
+            i += 1
+            yield bytes(value)
+        else:
+            start = i
+            while i < n and text[i:i + 1] not in b" ()\r\n\t":
+                if text[i:i + 1] == b"[":
+                    # BODY[HEADER.FIELDS (A B)] — скобки и пробелы внутри [] часть имени
+                    i = text.index(b"]", i)
+                i += 1
+            atom = text[start:i]
+            yield None if atom.upper() == b"NIL" else atom
+
+
+def _tokens(data):
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+            yield from _tokenize(re.sub(rb"\{\d+\}$", b"", text))
+            yield literal
+        elif item:
+            yield from _tokenize(item)
+
+
+def _parse(tokens) -> list:
+    stack = [[]]
+    for token in tokens:
+        if token is OPEN:
+            stack.append([])
+        elif token is CLOSE:
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def parse_fetch(data) -> Dict[int, Dict[bytes, object]]:
+    """Ответ UID FETCH -> {uid: {b"BODYSTRUCTURE": ..., b"BODY[1]<0>": b"...", ...}}"""
+    result = {}
+    for item in _parse(_tokens(data)):
+        if not isinstance(item, list):
+            continue  # Номер сообщения перед списком атрибутов
+        attrs = {}
+        for key, value in zip(item[::2], item[1::2]):
+            attrs[key.upper()] = value
+        if b"UID" in attrs:
+            result.setdefault(int(attrs[b"UID"]), {}).update(attrs)
+    return result
+
+
+def _body_value(attrs: dict, prefix: bytes) -> bytes:
+    for key, value in attrs.items():
+        if key.startswith(prefix):
+            return value or b""
+    return b""
+
+
+# --- Структура письма (BODYSTRUCTURE) ----------------------------------------
+
+def _str(value) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else (value or "")
+
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    params = {}
+    for key, val in zip(value[::2], value[1::2]):
+        key, val = _str(key).lower(), _str(val)
+        if key.endswith("*"):
+            # RFC 2231: filename*=utf-8''%D0%BF...
+            charset, _, encoded = val.split("'", 2) if val.count("'") >= 2 else ("", "", val)
+            key, val = key[:-1], unquote(encoded, encoding=charset or "utf-8", errors="replace")
+        params[key] = val
+    return params
+
+
+def _decode_words(value: str) -> str:
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def iter_parts(structure: list, prefix: str = ""):
+    """Листовые части письма: (номер части для BODY[...], описание)"""
+    if structure and isinstance(structure[0], list):
+        children = [p for p in structure if isinstance(p, list)]
+        for i, child in enumerate(children, 1):
+            yield from iter_parts(child, f"{prefix}{i}." if child and isinstance(child[0], list) else f"{prefix}{i}")
+        return
+    main_type, sub_type = _str(structure[0]).lower(), _str(structure[1]).lower()
+    # Расширенные поля: после size у text/* идет число строк, у message/rfc822 — envelope, body, lines
+    ext = 7 + (1 if main_type == "text" else 0) + (3 if (main_type, sub_type) == ("message", "rfc822") else 0)
+    disposition = structure[ext + 1] if len(structure) > ext + 1 and isinstance(structure[ext + 1], list) else None
+    params = _params(structure[2])
+    disposition_params = _params(disposition[1]) if disposition and len(disposition) > 1 else {}
+    filename = disposition_params.get("filename") or params.get("name")
+    yield prefix or "1", {
+        "mime_type": f"{main_type}/{sub_type}",
+        "charset": params.get("charset") or "utf-8",
+        "encoding": _str(structure[5]).lower(),
+        "size": int(structure[6] or 0),
+        "attachment": bool(filename) or (disposition is not None and _str(disposition[0]).lower() == "attachment"),
+        "filename": _decode_words(filename) if filename else None,
+    }
+
+
+# --- Декодирование transfer-encoding частями ---------------------------------
+
+class StreamDecoder:
+    """Декодирует base64 / quoted-printable по кускам произвольной длины"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._rest = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self._rest + chunk
+        if self.encoding == "base64":
+            data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+            cut = len(data) - len(data) % 4
+            self._rest = data[cut:]
+            return binascii.a2b_base64(data[:cut]) if cut else b""
+        if self.encoding == "quoted-printable":
+            # Мягкий перенос и =XX не режутся: декодируем только целые строки
+            cut = data.rfind(b"\n") + 1
+            self._rest = data[cut:]
+            return binascii.a2b_qp(data[:cut]) if cut else b""
+        return data
+
+    def flush(self) -> bytes:
+        data, self._rest = self._rest, b""
+        if not data:
+            return b""
+        if self.encoding == "base64":
+            return binascii.a2b_base64(data + b"=" * (-len(data) % 4))
+        if self.encoding == "quoted-printable":
+            return binascii.a2b_qp(data)
+        return data
+
+
+# --- IMAP --------------------------------------------------------------------
+
+def connect() -> imaplib.IMAP4:
+    imap_class = imaplib.IMAP4_SSL if IMAP_USE_SSL else imaplib.IMAP4
+    imap = imap_class(IMAP_HOST, IMAP_PORT, timeout=IMAP_TIMEOUT)
+    imap.login(IMAP_USERNAME, IMAP_PASSWORD)
+    return imap
+
+
+def _uid_fetch(imap: imaplib.IMAP4, uids, items: str) -> dict:
+    typ, data = imap.uid("FETCH", ",".join(str(u) for u in uids), items)
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    return parse_fetch(data)
+
+
+def select_mailbox(imap: imaplib.IMAP4, mailbox: str) -> int:
+    typ, data = imap.select(mailbox, readonly=True)
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+    return int(imap.response("UIDVALIDITY")[1][0])
+
+
+def search_new_uids(imap: imaplib.IMAP4, last_uid: int) -> List[int]:
+    typ, data = imap.uid("SEARCH", None, "UID", f"{last_uid + 1}:*")
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    # "N:*" всегда включает последнее письмо, даже если его UID меньше N
+    return sorted(uid for uid in (int(u) for u in b" ".join(d for d in data if d).split()) if uid > last_uid)
+
+
+def fetch_part(imap: imaplib.IMAP4, uid: int, part: str, limit: int = None) -> bytes:
+    items = f"(BODY.PEEK[{part}]<0.{limit}>)" if limit else f"(BODY.PEEK[{part}])"
+    return _body_value(_uid_fetch(imap, [uid], items).get(uid, {}), b"BODY[")
+
+
+def stream_part(imap: imaplib.IMAP4, uid: int, part: str, encoding: str, path: str) -> int:
+    """Скачивает часть письма в файл кусками по IMAP_FETCH_CHUNK байт; возвращает размер файла"""
+    decoder = StreamDecoder(encoding)
+    size = offset = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = fetch_part_chunk(imap, uid, part, offset)
+            data = decoder.feed(chunk)
+            f.write(data)
+            size += len(data)
+            offset += len(chunk)
+            if len(chunk) < IMAP_FETCH_CHUNK:
+                break
+        data = decoder.flush()
+        f.write(data)
+        size += len(data)
+    return size
+
+
+def fetch_part_chunk(imap: imaplib.IMAP4, uid: int, part: str, offset: int) -> bytes:
+    attrs = _uid_fetch(imap, [uid], f"(BODY.PEEK[{part}]<{offset}.{IMAP_FETCH_CHUNK}>)").get(uid, {})
+    return _body_value(attrs, b"BODY[")
+
+
+# --- Синхронизация -----------------------------------------------------------
+
+def _header(headers, name: str) -> str:
+    value = headers.get(name)
+    return _decode_words(str(value)) if value else ""
+
+
+def _reply_refs(headers) -> List[str]:
+    refs = MESSAGE_ID_RE.findall(f"{headers.get('In-Reply-To', '')} {headers.get('References', '')}")
+    return list(dict.fromkeys(refs))
+
+
+def _message_date(headers) -> datetime.datetime:
+    try:
+        value = parsedate_to_datetime(headers.get("Date"))
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+    except Exception:
+        return datetime.datetime.utcnow()
+
+
+def _safe_filename(name: str) -> str:
+    name = os.path.basename(name.replace("\\", "/")).strip() or "attachment"
+    return re.sub(r"[^\w.\- ]", "_", name)[:150]
+
+
+def claim_state(db: Session, mailbox: str):
+    """Берет ящик в работу и коммитит. Возвращает (id, uidvalidity, last_uid) или None,
+    если ящик сейчас синхронизирует другой воркер"""
+    state = models.MailboxSyncState
+    now = datetime.datetime.utcnow()
+    stale_before = now - datetime.timedelta(seconds=IMAP_CLAIM_TIMEOUT)
+    claimed = db.execute(
+        update(state)
+        .where(state.mailbox == mailbox, or_(state.claimed_at.is_(None), state.claimed_at < stale_before))
+        .values(claimed_at=now)
+        .returning(state.id, state.uidvalidity, state.last_uid)
+    ).first()
+    if claimed is None and db.query(state.id).filter(state.mailbox == mailbox).first() is None:
+        try:
+            claimed = db.execute(
+                insert(state)
+                .values(mailbox=mailbox, last_uid=0, claimed_at=now)
+                .returning(state.id, state.uidvalidity, state.last_uid)
+            ).first()
+        except IntegrityError:
+            claimed = None  # Ящик одновременно завел другой воркер
+    if claimed is None:
+        db.rollback()
+        return None
+    db.commit()
+    return claimed
+
+
+def release_state(db: Session, state_id: int, **values):
+    """Снимает отметку claimed_at (без commit), заодно записывает позицию синхронизации"""
+    db.execute(
+        update(models.MailboxSyncState)
+        .where(models.MailboxSyncState.id == state_id)
+        .values(claimed_at=None, **values)
+    )
+
+
+def _decode_text(data: bytes, charset: str) -> str:
+    try:
+        return data.decode(charset, "replace")
+    except LookupError:
+        # Неизвестная кодировка: письмо все равно сохраняем, иначе оно потеряется (last_uid уйдет дальше)
+        return data.decode("utf-8", "replace")
+
+
+def _download(imap: imaplib.IMAP4, uid: int, structure: list, campaign_id: int):
+    """Текст письма и вложения (на диск). Возвращает (body, [описание вложения])"""
+    body = None
+    html = None
+    attachments = []
+    for part, info in iter_parts(structure):
+        if info["attachment"]:
+            directory = os.path.join(EMAIL_ATTACHMENTS_DIR, str(campaign_id))
+            os.makedirs(directory, exist_ok=True)
+            filename = info["filename"] or f"part-{part}"
+            path = os.path.join(directory, f"{uuid.uuid4().hex}_{_safe_filename(filename)}")
+            try:
+                size = stream_part(imap, uid, part, info["encoding"], path)
+            except Exception:
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+            attachments.append({"filename": filename, "file_path": path, "file_size": size, "mime_type": info["mime_type"]})
+        elif info["mime_type"] in ("text/plain", "text/html") and (body is None if info["mime_type"] == "text/plain" else html is None):
+            decoder = StreamDecoder(info["encoding"])
+            raw = fetch_part(imap, uid, part, IMAP_MAX_BODY_BYTES)
+            text = _decode_text(decoder.feed(raw) + decoder.flush(), info["charset"])
+            if info["mime_type"] == "text/plain":
+                body = text
+            else:
+                html = text
+    if body is None and html is not None:
+        body = re.sub(r"<[^>]+>", " ", html)
+    return body or "", attachments
+
+
+def _remove_files(rows: List[dict]):
+    for row in rows:
+        for attachment in row["attachments"]:
+            try:
+                os.remove(attachment["file_path"])
+            except OSError:
+                pass
+
+
+def sync_mailbox(db: Session, imap: imaplib.IMAP4, mailbox: str = None) -> int:
+    """Один проход: обрабатывает до IMAP_BATCH_SIZE новых писем. Возвращает число просмотренных UID"""
+    mailbox = mailbox or IMAP_MAILBOX
+    state = claim_state(db, mailbox)
+    if state is None:
+        return 0
+    rows = []
+    try:
+        uidvalidity = select_mailbox(imap, mailbox)
+        # Ящик пересоздан (новый UIDVALIDITY) — старые UID недействительны; дубли отсекаются по Message-ID
+        last_uid = (state.last_uid or 0) if state.uidvalidity == uidvalidity else 0
+        uids = search_new_uids(imap, last_uid)[:IMAP_BATCH_SIZE]
+        if not uids:
+            release_state(db, state.id, uidvalidity=uidvalidity, last_uid=last_uid,
+                          synced_at=datetime.datetime.utcnow())
+            db.commit()
+            return 0
+
+        parser = BytesHeaderParser()
+        headers = {
+            uid: parser.parsebytes(_body_value(attrs, b"BODY[HEADER"))
+            for uid, attrs in _uid_fetch(imap, uids, f"(UID BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])").items()
+        }
+
+        # Одним запросом: на какие наши письма отвечают и какие ответы уже загружены
+        all_refs = {ref for h in headers.values() for ref in _reply_refs(h)}
+        own_ids = {h.get("Message-ID", "").strip() for h in headers.values()} - {""}
+        sent = dict(
+            db.query(models.EmailMessage.external_id, models.EmailMessage.campaign_id)
+            .filter(models.EmailMessage.message_type == "sent", models.EmailMessage.external_id.in_(all_refs))
+            .all()
+        ) if all_refs else {}
+        known = {
+            external_id for (external_id,) in
+            db.query(models.EmailMessage.external_id)
+            .filter(models.EmailMessage.message_type == "received", models.EmailMessage.external_id.in_(own_ids))
+        } if own_ids else set()
+        # Закрываем транзакцию чтения: пока качаются тела и вложения, соединение возвращается в пул
+        db.rollback()
+
+        matched = {}
+        for uid in uids:
+            h = headers.get(uid)
+            if h is None or h.get("Message-ID", "").strip() in known:
+                continue
+            campaign_id = next((sent[ref] for ref in _reply_refs(h) if ref in sent), None)
+            if campaign_id is not None:
+                matched[uid] = campaign_id
+
+        structures = _uid_fetch(imap, list(matched), "(UID BODYSTRUCTURE)") if matched else {}
+        for uid, campaign_id in matched.items():
+            h = headers[uid]
+            try:
+                body, attachments = _download(imap, uid, structures[uid][b"BODYSTRUCTURE"], campaign_id)
+            except (imaplib.IMAP4.abort, OSError):
+                raise  # Связь оборвалась — пачка повторится целиком при следующем опросе
+            except Exception as e:
+                # Письмо, которое не удается разобрать, не должно навсегда останавливать синхронизацию
+                print(f"Inbound mail {mailbox}: skipping UID {uid}: {e}")
+                continue
+            rows.append({
+                "campaign_id": campaign_id,
+                "message_type": "received",
+                "subject": _header(h, "Subject"),
+                "body": body,
+                "from_email": parseaddr(_header(h, "From"))[1] or _header(h, "From"),
+                "to_email": parseaddr(_header(h, "To"))[1] or _header(h, "To"),
+                "sent_at": _message_date(h),
+                "is_read": False,
+                "external_id": h.get("Message-ID", "").strip() or None,
+                "attachments": attachments,
+            })
+        save_replies(db, rows)
+        release_state(db, state.id, uidvalidity=uidvalidity, last_uid=max(uids),
+                      synced_at=datetime.datetime.utcnow())
+        db.commit()
+    except Exception:
+        db.rollback()
+        _remove_files(rows)
+        try:
+            # Следующий опрос повторит пачку, не дожидаясь IMAP_CLAIM_TIMEOUT
+            release_state(db, state.id)
+            db.commit()
+        except Exception:
+            db.rollback()
+        raise
+    if rows:
+        print(f"Inbound mail {mailbox}: {len(uids)} new, {len(rows)} replies to campaigns")
+    return len(uids)
+
+
+def save_replies(db: Session, rows: List[dict]):
+    """Bulk insert ответов и вложений, обновление кампаний (без commit)"""
+    if not rows:
+        return
+    message_ids = db.scalars(
+        insert(models.EmailMessage).returning(models.EmailMessage.id, sort_by_parameter_order=True),
+        [{k: v for k, v in row.items() if k != "attachments"} for row in rows],
+    ).all()
+    attachments = [
+        dict(attachment, message_id=message_id)
+        for message_id, row in zip(message_ids, rows)
+        for attachment in row["attachments"]
+    ]
+    if attachments:
+        db.execute(insert(models.EmailAttachment), attachments)
+
+    per_campaign = {}
+    for row in rows:
+        count, last = per_campaign.get(row["campaign_id"], (0, row["sent_at"]))
+        per_campaign[row["campaign_id"]] = (count + 1, max(last, row["sent_at"]))
+    now = datetime.datetime.utcnow()
+    db.connection().execute(
+        update(models.EmailCampaign)
+        .where(models.EmailCampaign.id == bindparam("b_id"))
+        .values(
+            status="replied",
+            last_reply_at=bindparam("b_last"),
+            messages_count=models.EmailCampaign.messages_count + bindparam("b_count"),
+            updated_at=now,
+        ),
+        [{"b_id": cid, "b_count": count, "b_last": last} for cid, (count, last) in per_campaign.items()],
+    )
+
+
+def poll_once() -> int:
+    """Синхронизирует ящик до конца (пачками). Вызывается из пула потоков"""
+    imap = connect()
+    db = SessionLocal()
+    total = 0
+    try:
+        while True:
+            processed = sync_mailbox(db, imap)
+            total += processed
+            if not processed:
+                return total
+    finally:
+        db.close()
+        try:
+            imap.logout()
+        except Exception:
+            pass
+
+
+async def poller_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, poll_once)
+        except Exception as e:
+            print(f"Inbound mail poll error: {e}")
+        await asyncio.sleep(IMAP_POLL_INTERVAL)
+
+
+def start_poller():
+    """Запускает опрос ящика, если настроен IMAP_HOST"""
+    global _poller_task
+    if IMAP_HOST and _poller_task is None:
+        _poller_task = asyncio.create_task(poller_loop())
+
+
+async def stop_poller():
+    global _poller_task
+    if _poller_task is not None:
+        _poller_task.cancel()
+        await asyncio.gather(_poller_task, return_exceptions=True)
+        _poller_task = None
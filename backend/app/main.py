@@ -1,11 +1,13 @@
-from fastapi import FastAPI, Form, Depends, HTTPException, Body, Security
+from fastapi import FastAPI, Form, Depends, HTTPException, Body, Security, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import create_engine, Column, Integer, String
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 import datetime
-from . import crud, google_search, schemas, models, auth
+from . import catalog, crud, google_search, schemas, models, auth
 from . import chat_api
+from . import supplier_jobs, admin_metrics, outbound_mail, inbound_mail
 from .routers import support_tickets, admin_dashboard
 from fastapi import BackgroundTasks
 from typing import List, Optional
@@ -46,16 +48,43 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Count-Estimated"],
 )
 
 # Используем настройки базы данных из database.py
-from .database import engine, Base, get_db
+from .database import engine, async_engine, Base, get_db, get_async_db, describe_pool_config
 
 Base.metadata.create_all(bind=engine)
 
+# Фоновые обработчики очереди поиска и общие HTTP-клиенты
+@app.on_event("startup")
+async def on_startup():
+    print(describe_pool_config())
+    supplier_jobs.start_workers()
+    admin_metrics.start_refresher()
+    outbound_mail.start_worker()
+    inbound_mail.start_poller()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await supplier_jobs.stop_workers()
+    await admin_metrics.stop_refresher()
+    await outbound_mail.stop_worker()
+    await inbound_mail.stop_poller()
+    await google_search.close_clients()
+    await async_engine.dispose()
+
 @app.post("/token")
-def login(username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, username, password)
+async def login(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    ip = request.client.host if request.client else None
+    auth.check_login_rate(username, ip)
+    user = await auth.get_user_async(db, username)
+    # Завершаем читающую транзакцию, чтобы не держать соединение, пока считается bcrypt
+    # (в пуле auth._password_executor, а не в общем threadpool)
+    await db.commit()
+    if user and not await auth.verify_password_async(password, user.hashed_password):
+        user = None
+    auth.record_login_result(username, ip, success=bool(user))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,7 +93,7 @@ def login(username: str = Form(...), password: str = Form(...), db: Session = De
         )
     access_token_expires = datetime.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     return {
         "access_token": access_token, 
@@ -87,7 +116,7 @@ class AddArticleRequest(BaseModel):
 
 @api_router.post("/articles/")
 def add_article(req: AddArticleRequest, db: Session = Depends(get_db)):
-    article = models.Article(code=req.code)
+    article = catalog.attach_part(db, models.Article(code=req.code))
     db.add(article)
     db.commit()
     db.refresh(article)
@@ -111,16 +140,10 @@ async def search_suppliers(article_id: int, current_user: models.User = Depends(
     article = db.query(models.Article).filter(models.Article.id == article_id).first()
     if not article:
         raise HTTPException(status_code=404, detail="Article not found")
-    db.query(models.Supplier).filter(models.Supplier.article_id == article_id).delete()
-    db.commit()
-    regions = ["Europe", "North America", "South America", "Russia", "Asia"]
-    suppliers = []
-    for region in regions:
-        found = await google_search.search_suppliers_perplexity(article.code, region)
-        for s in found:
-            supplier = crud.add_supplier(db, article_id, s["name"], s["website"], s["email"], s["country"], current_user.id)
-            suppliers.append(supplier)
-    crud.add_analytics(db, current_user.id, "Поиск поставщиков", f"Артикул: {article.code}, найдено: {len(suppliers)} поставщиков")
+    found, stats = await catalog.search_suppliers(article.code)
+    suppliers = crud.add_suppliers_bulk(db, [article_id], found, current_user.id)
+    region_stats = google_search.format_region_stats(stats)
+    crud.add_analytics(db, current_user.id, "Поиск поставщиков", f"Артикул: {article.code}, найдено: {len(suppliers)} поставщиков; регионы: {region_stats}")
     return suppliers
 
 class EmailUpdateRequest(BaseModel):
@@ -171,24 +194,25 @@ class ChangePasswordRequest(BaseModel):
     new_password: str
 
 @api_router.post("/change_password/")
-def change_password(
+async def change_password(
     req: ChangePasswordRequest,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Сменить пароль пользователя"""
     if req.current_password is not None:
         # Проверяем текущий пароль
-        if not auth.verify_password(req.current_password, current_user.hashed_password):
+        if not await auth.verify_password_async(req.current_password, current_user.hashed_password):
             raise HTTPException(status_code=400, detail="Неверный текущий пароль")
     
     # Хешируем новый пароль
-    hashed_password = auth.get_password_hash(req.new_password)
+    hashed_password = await auth.get_password_hash_async(req.new_password)
     
     # Обновляем пароль в базе
     current_user.hashed_password = hashed_password
     current_user.force_password_change = False
-    db.commit()
+    await db.commit()
+    auth.invalidate_user_cache(current_user.username)
     
     return {"message": "Пароль успешно изменен"}
 
@@ -466,9 +490,10 @@ class CreateUserRequest(BaseModel):
     company: str
 
 @api_router.post("/users/")
-def create_user(req: CreateUserRequest, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.username == req.username).first():
+async def create_user(req: CreateUserRequest, db: AsyncSession = Depends(get_async_db)):
+    if await auth.get_user_async(db, req.username):
         raise HTTPException(status_code=400, detail="User already exists")
+    hashed_password = await auth.get_password_hash_async("default123")
     user = models.User(
         username=req.username,
         email=req.email,
@@ -477,11 +502,10 @@ def create_user(req: CreateUserRequest, db: Session = Depends(get_db)):
         position=req.position,
         phone=req.phone,
         company=req.company,
-        hashed_password=auth.get_password_hash("default123")
+        hashed_password=hashed_password
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
     return {"id": user.id, "username": user.username, "email": user.email}
 
 @api_router.get("/users/profile", response_model=schemas.UserResponse)
@@ -500,6 +524,7 @@ def update_user_role(user_id: int, req: UpdateUserRoleRequest, current_user: mod
         raise HTTPException(status_code=404, detail="User not found")
     user.role = req.role
     db.commit()
+    auth.invalidate_user_cache(user.username)
     db.refresh(user)
     return {"id": user.id, "username": user.username, "role": user.role}
 
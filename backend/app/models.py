@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Float, String, ForeignKey, DateTime, Text, Boolean, UniqueConstraint, Index, DDL, event
+from sqlalchemy.orm import relationship, validates
 from .database import Base
+from .article_codes import normalize_article_code
 import datetime
 
 class User(Base):
@@ -36,8 +37,8 @@ class Request(Base):
     __tablename__ = "requests"
     id = Column(Integer, primary_key=True, index=True)
     number = Column(String, unique=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     articles = relationship("Article", back_populates="request")
     user = relationship("User", back_populates="requests")
 
@@ -45,16 +46,62 @@ class Article(Base):
     __tablename__ = "articles"
     id = Column(Integer, primary_key=True, index=True)
     code = Column(String, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    request_id = Column(Integer, ForeignKey("requests.id"), nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Канонический артикул для поиска (см. article_codes.normalize_article_code), заполняется из code
+    normalized_code = Column(String)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    request_id = Column(Integer, ForeignKey("requests.id"), nullable=True, index=True)
+    part_id = Column(Integer, ForeignKey("parts.id"), nullable=True, index=True)  # Деталь из общего каталога
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     suppliers = relationship("Supplier", back_populates="article")
     request = relationship("Request", back_populates="articles")
+    part = relationship("Part", back_populates="articles")
+
+    __table_args__ = (
+        # Префиксный поиск (LIKE 'ABC%') и нечеткий поиск по триграммам (pg_trgm)
+        Index("ix_articles_normalized_code_prefix", "normalized_code",
+              postgresql_ops={"normalized_code": "varchar_pattern_ops"}),
+        Index("ix_articles_normalized_code_trgm", "normalized_code",
+              postgresql_using="gist", postgresql_ops={"normalized_code": "gist_trgm_ops"}),
+    )
+
+    @validates("code")
+    def _set_normalized_code(self, key, value):
+        self.normalized_code = normalize_article_code(value)
+        return value
+
+class Part(Base):
+    """Деталь общего каталога: одна строка на нормализованный артикул для всех пользователей"""
+    __tablename__ = "parts"
+    id = Column(Integer, primary_key=True, index=True)
+    normalized_code = Column(String, unique=True, index=True, nullable=False)
+    code = Column(String, nullable=False)  # Артикул в том виде, в каком его ввели первым
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    suppliers_updated_at = Column(DateTime, nullable=True)  # Когда поставщиков последний раз искали по всем регионам
+    articles = relationship("Article", back_populates="part")
+    suppliers = relationship("PartSupplier", back_populates="part")
+
+class PartSupplier(Base):
+    """Поставщик детали из каталога, без дублей по домену"""
+    __tablename__ = "part_suppliers"
+    __table_args__ = (UniqueConstraint("part_id", "domain", name="uq_part_suppliers_part_domain"),)
+    id = Column(Integer, primary_key=True, index=True)
+    part_id = Column(Integer, ForeignKey("parts.id"), nullable=False, index=True)
+    domain = Column(String, nullable=False)
+    name = Column(String)
+    website = Column(String)
+    email = Column(String)
+    country = Column(String)
+    first_seen_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.datetime.utcnow)
+    part = relationship("Part", back_populates="suppliers")
+
+# Для gist_trgm_ops нужно расширение pg_trgm
+event.listen(Article.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
 
 class Supplier(Base):
     __tablename__ = "suppliers"
     id = Column(Integer, primary_key=True, index=True)
-    article_id = Column(Integer, ForeignKey("articles.id"))
+    article_id = Column(Integer, ForeignKey("articles.id"), index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     name = Column(String)
     website = Column(String)
@@ -74,9 +121,9 @@ class EmailTemplate(Base):
 class Analytics(Base):
     __tablename__ = "analytics"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     action = Column(String)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     details = Column(Text)
     user = relationship("User", back_populates="analytics")
 
@@ -144,9 +191,9 @@ class SupportTicket(Base):
     status = Column(String, default="open")  # open, in_progress, resolved, closed
     priority = Column(String, default="medium")  # low, medium, high, urgent
     assigned_to = Column(Integer, ForeignKey("users.id"), nullable=True)  # Назначенный админ
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
-    resolved_at = Column(DateTime, nullable=True)  # Время решения
+    resolved_at = Column(DateTime, nullable=True, index=True)  # Время решения
     closed_at = Column(DateTime, nullable=True)  # Время закрытия
     first_response_at = Column(DateTime, nullable=True)  # Время первого ответа
     estimated_resolution = Column(DateTime, nullable=True)  # Ожидаемое время решения
@@ -213,6 +260,9 @@ class EmailCampaign(Base):
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     sent_at = Column(DateTime, nullable=True)  # Когда отправлено
     last_reply_at = Column(DateTime, nullable=True)  # Последний ответ
+    # Счетчики для списка кампаний; меняются в той же транзакции, что и артикулы/сообщения
+    articles_count = Column(Integer, default=0, nullable=False)
+    messages_count = Column(Integer, default=0, nullable=False)
     
     # Связи
     user = relationship("User", back_populates="email_campaigns")
@@ -244,7 +294,14 @@ class EmailMessage(Base):
     to_email = Column(String, nullable=False)  # Кому
     sent_at = Column(DateTime, default=datetime.datetime.utcnow)  # Когда отправлено/получено
     is_read = Column(Boolean, default=False)  # Прочитано ли
-    external_id = Column(String, nullable=True)  # Внешний ID письма (для интеграции с почтовыми сервисами)
+    external_id = Column(String, nullable=True, index=True)  # Message-ID письма (по нему ответы связываются с кампанией)
+    # Доставка исходящих через очередь (см. outbound_mail): queued, sending, sent, failed.
+    # NULL — письмо добавлено вручную и не отправлялось
+    delivery_status = Column(String, nullable=True, index=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)  # Не раньше этого времени (backoff)
+    claimed_at = Column(DateTime, nullable=True)  # Когда воркер взял письмо
+    delivery_error = Column(Text, nullable=True)
     
     # Связи
     campaign = relationship("EmailCampaign", back_populates="messages")
@@ -311,4 +368,78 @@ class Permission(Base):
     description = Column(String, nullable=True)
     resource = Column(String, nullable=True)  # Ресурс (users, articles, etc.)
     action = Column(String, nullable=True)    # Действие (create, read, update, delete)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow) 
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Кэш результатов поиска поставщиков, общий для всех воркеров
+class SupplierSearchCache(Base):
+    __tablename__ = "supplier_search_cache"
+    __table_args__ = (UniqueConstraint("article_code", "region", name="uq_supplier_search_cache_code_region"),)
+    id = Column(Integer, primary_key=True, index=True)
+    article_code = Column(String, nullable=False, index=True)  # Нормализованный артикул
+    region = Column(String, nullable=False)
+    results = Column(Text, nullable=False)  # JSON-массив найденных поставщиков
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+# Очередь фоновых задач поиска поставщиков (переживает перезапуск процесса)
+class SupplierSearchJob(Base):
+    __tablename__ = "supplier_search_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(Integer, ForeignKey("articles.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    use_cache = Column(Boolean, default=True)  # Можно ли брать результаты из кэша поиска
+    regions_total = Column(Integer, default=0)
+    regions_done = Column(Integer, default=0)
+    suppliers_found = Column(Integer, default=0)
+    region_stats = Column(Text, nullable=True)  # JSON со статистикой по регионам
+    error = Column(Text, nullable=True)
+    worker_id = Column(String, nullable=True)  # Какой воркер взял задачу
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Последний признак жизни воркера
+    finished_at = Column(DateTime, nullable=True)
+
+    # Связи
+    article = relationship("Article")
+    user = relationship("User")
+
+# Ограничение частоты писем на домен получателя, общее для всех процессов (см. outbound_mail)
+class MailDomainThrottle(Base):
+    __tablename__ = "mail_domain_throttle"
+    domain = Column(String, primary_key=True)
+    next_send_at = Column(Float, nullable=False)  # Unix time, раньше которого следующее письмо не уходит
+
+# Позиция инкрементальной синхронизации почтового ящика (см. inbound_mail)
+class MailboxSyncState(Base):
+    __tablename__ = "mailbox_sync_state"
+    id = Column(Integer, primary_key=True, index=True)
+    mailbox = Column(String, unique=True, nullable=False)
+    uidvalidity = Column(BigInteger, nullable=True)  # При смене UIDVALIDITY старые UID недействительны
+    last_uid = Column(BigInteger, default=0, nullable=False)  # Последний обработанный UID
+    synced_at = Column(DateTime, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)  # Ящик синхронизирует воркер (аренда до IMAP_CLAIM_TIMEOUT)
+
+# Кэш результатов whois: зарегистрирован ли домен
+class DomainWhoisCache(Base):
+    __tablename__ = "domain_whois_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, unique=True, index=True, nullable=False)
+    registered = Column(Boolean, nullable=False)
+    checked_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+# Кэш найденных email по домену сайта поставщика
+class DomainEmailCache(Base):
+    __tablename__ = "domain_email_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, unique=True, index=True, nullable=False)
+    email = Column(String, nullable=False, default="")  # Пустая строка — email не найден
+    checked_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class AdminMetricsSnapshot(Base):
+    """Снимок счетчиков админских дашбордов (одна строка, см. app/admin_metrics.py)"""
+    __tablename__ = "admin_metrics_snapshots"
+    id = Column(Integer, primary_key=True)
+    data = Column(Text, nullable=False)  # JSON со счетчиками
+    computed_at = Column(DateTime, nullable=False)
+    compute_ms = Column(Integer)
@@ -0,0 +1,342 @@
+"""Очередь исходящих писем email-кампаний.
+
+Отправка кампании только ставит строку EmailMessage в состояние queued. Воркер в каждом
+uvicorn-процессе забирает письма пачками (SELECT ... FOR UPDATE SKIP LOCKED), держит пул
+авторизованных SMTP-соединений и отправляет параллельно, не чаще MAIL_DOMAIN_RATE писем
+в секунду на домен получателя — на все процессы вместе: время следующей отправки на домен
+резервируется в mail_domain_throttle. Временные ошибки повторяются с экспоненциальной
+задержкой, итог (sent/failed) записывается в письмо и в статус кампании. Запросы к БД
+воркер выполняет в пуле потоков, каждый в своей сессии, чтобы не блокировать event loop.
+"""
+import asyncio
+import datetime
+import os
+import socket
+import time
+import uuid
+from email.message import EmailMessage as MimeMessage
+from email.utils import formatdate, make_msgid
+from typing import List, Optional
+
+import aiosmtplib
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")  # Пусто — отправка выключена, кампании не ставятся в очередь
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "false").lower() == "true"  # SMTPS (порт 465)
+SMTP_START_TLS = os.getenv("SMTP_START_TLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# Адрес, от которого идет отправка; адрес пользователя тогда уходит в Reply-To
+MAIL_FROM = os.getenv("MAIL_FROM", "")
+DEFAULT_FROM = "noreply@company.com"
+
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "4"))  # SMTP-соединений на процесс
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_DOMAIN_RATE = float(os.getenv("MAIL_DOMAIN_RATE", "1"))  # писем в секунду на домен получателя (всего)
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "60"))  # секунд до первого повтора, дальше x2
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "3600"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "2"))
+# Через сколько секунд письмо в состоянии sending считается брошенным (воркер умер)
+MAIL_STALE_AFTER = int(os.getenv("MAIL_STALE_AFTER", "600"))
+
+_worker_task = None
+
+
+class SMTPPool:
+    """Пул SMTP-соединений: соединение открывается и авторизуется один раз и переиспользуется"""
+
+    def __init__(self, size: int = None, **smtp_kwargs):
+        self.size = size or MAIL_POOL_SIZE
+        self.smtp_kwargs = smtp_kwargs or {
+            "hostname": SMTP_HOST,
+            "port": SMTP_PORT,
+            "username": SMTP_USERNAME or None,
+            "password": SMTP_PASSWORD or None,
+            "use_tls": SMTP_USE_TLS,
+            "start_tls": SMTP_START_TLS and not SMTP_USE_TLS,
+            "timeout": SMTP_TIMEOUT,
+        }
+        self.connections_opened = 0
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(self.size)
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(**self.smtp_kwargs)
+        await smtp.connect()
+        self.connections_opened += 1
+        return smtp
+
+    async def _send_on(self, smtp: aiosmtplib.SMTP, message: MimeMessage, sender: str):
+        try:
+            await smtp.send_message(message, sender=sender)
+        except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+            # Сервер отказал в письме, но соединение живо — сбрасываем транзакцию и возвращаем в пул
+            try:
+                await smtp.rset()
+                self._idle.append(smtp)
+            except aiosmtplib.SMTPException:
+                smtp.close()
+            raise
+        except BaseException:
+            smtp.close()
+            raise
+        self._idle.append(smtp)
+
+    async def send(self, message: MimeMessage, sender: str):
+        async with self._semaphore:
+            smtp = self._idle.pop() if self._idle else None
+            if smtp is not None and smtp.is_connected:
+                try:
+                    return await self._send_on(smtp, message, sender)
+                except aiosmtplib.SMTPServerDisconnected:
+                    pass  # Сервер закрыл простаивавшее соединение — повторяем на новом
+            return await self._send_on(await self._connect(), message, sender)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for smtp in idle:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+def recipient_domain(address: str) -> str:
+    return address.rsplit("@", 1)[-1].strip().lower()
+
+
+def is_enabled() -> bool:
+    """Отправка настроена: без SMTP_HOST воркер не запускается и ставить письма в очередь нельзя"""
+    return bool(SMTP_HOST)
+
+
+def reserve_domain_slot(db: Session, domain: str) -> float:
+    """Резервирует время отправки письма на домен; возвращает, сколько секунд подождать.
+
+    Один атомарный UPDATE ... RETURNING, поэтому лимит общий для всех процессов.
+    """
+    if MAIL_DOMAIN_RATE <= 0:
+        return 0
+    interval = 1.0 / MAIL_DOMAIN_RATE
+    now = time.time()
+    throttle = models.MailDomainThrottle
+    stmt = (
+        update(throttle)
+        .where(throttle.domain == domain)
+        .values(next_send_at=case((throttle.next_send_at > now, throttle.next_send_at), else_=now) + interval)
+        .returning(throttle.next_send_at)
+    )
+    next_send_at = db.execute(stmt).scalar()
+    if next_send_at is None:
+        try:
+            with db.begin_nested():
+                db.execute(insert(throttle).values(domain=domain, next_send_at=now + interval))
+            next_send_at = now + interval
+        except IntegrityError:
+            # Строку для домена одновременно вставил другой процесс
+            next_send_at = db.execute(stmt).scalar()
+    db.commit()
+    return max(0.0, next_send_at - interval - now)
+
+
+def enqueue_campaign(db: Session, campaign: models.EmailCampaign, from_email: str) -> models.EmailMessage:
+    """Ставит письмо кампании в очередь (без commit — вызывающий коммитит вместе со своими изменениями)"""
+    from_email = from_email or MAIL_FROM or DEFAULT_FROM
+    message = models.EmailMessage(
+        campaign_id=campaign.id,
+        message_type="sent",
+        subject=campaign.subject,
+        body=campaign.body,
+        from_email=from_email,
+        to_email=campaign.supplier_email,
+        # Message-ID известен заранее: по нему ответы сопоставляются с кампанией (In-Reply-To)
+        external_id=make_msgid(domain=recipient_domain(MAIL_FROM or from_email)),
+        delivery_status="queued",
+        attempts=0,
+    )
+    db.add(message)
+    campaign.messages_count = models.EmailCampaign.messages_count + 1
+    campaign.status = "sending"
+    campaign.updated_at = datetime.datetime.utcnow()
+    return message
+
+
+def build_mime(message: models.EmailMessage) -> MimeMessage:
+    mime = MimeMessage()
+    mime["From"] = MAIL_FROM or message.from_email
+    if MAIL_FROM and message.from_email != MAIL_FROM:
+        mime["Reply-To"] = message.from_email
+    mime["To"] = message.to_email
+    mime["Subject"] = message.subject or ""
+    mime["Message-ID"] = message.external_id
+    mime["Date"] = formatdate(localtime=True)
+    mime.set_content(message.body)
+    return mime
+
+
+def requeue_stale_messages(db: Session) -> int:
+    """Возвращает в очередь письма, воркер которых умер посреди отправки"""
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=MAIL_STALE_AFTER)
+    result = db.execute(
+        update(models.EmailMessage)
+        .where(models.EmailMessage.delivery_status == "sending", models.EmailMessage.claimed_at < stale_before)
+        .values(delivery_status="queued", claimed_at=None)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def claim_batch(db: Session, limit: int = None) -> List[models.EmailMessage]:
+    """Атомарно забирает пачку писем, срок отправки которых наступил"""
+    now = datetime.datetime.utcnow()
+    messages = (
+        db.query(models.EmailMessage)
+        .filter(
+            models.EmailMessage.delivery_status == "queued",
+            (models.EmailMessage.next_attempt_at.is_(None)) | (models.EmailMessage.next_attempt_at <= now),
+        )
+        .order_by(models.EmailMessage.id)
+        .limit(limit or MAIL_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for message in messages:
+        message.delivery_status = "sending"
+        message.claimed_at = now
+        message.attempts = (message.attempts or 0) + 1
+    db.commit()
+    return messages
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """5xx на письмо или всех получателей — повтор не поможет. Ошибки авторизации и сети — временные"""
+    if isinstance(error, aiosmtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code >= 500 for r in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return error.code >= 500
+    return False
+
+
+def retry_delay(attempts: int) -> float:
+    return min(MAIL_RETRY_BASE * 2 ** max(attempts - 1, 0), MAIL_RETRY_MAX)
+
+
+def record_result(db: Session, message: models.EmailMessage, error: Optional[Exception] = None):
+    """Записывает итог попытки в письмо и, если письмо отправлено или окончательно не ушло, в кампанию"""
+    now = datetime.datetime.utcnow()
+    campaign_status = None
+    values = {"claimed_at": None}
+    if error is None:
+        values.update(delivery_status="sent", sent_at=now, delivery_error=None)
+        campaign_status = "sent"
+    elif is_permanent_error(error) or (message.attempts or 0) >= MAIL_MAX_ATTEMPTS:
+        values.update(delivery_status="failed", delivery_error=str(error))
+        campaign_status = "failed"
+    else:
+        values.update(
+            delivery_status="queued",
+            delivery_error=str(error),
+            next_attempt_at=now + datetime.timedelta(seconds=retry_delay(message.attempts or 0)),
+        )
+    # UPDATE по id: письмо пришло из другой (уже закрытой) сессии
+    db.execute(update(models.EmailMessage).where(models.EmailMessage.id == message.id).values(**values))
+    if campaign_status:
+        campaign_values = {"status": campaign_status, "updated_at": now}
+        if campaign_status == "sent":
+            campaign_values["sent_at"] = now
+        # Ответ поставщика мог прийти раньше — его статус не перетираем
+        db.execute(
+            update(models.EmailCampaign)
+            .where(models.EmailCampaign.id == message.campaign_id, models.EmailCampaign.status == "sending")
+            .values(**campaign_values)
+        )
+    db.commit()
+
+
+def _in_session(session_factory, fn, *args):
+    # expire_on_commit=False: письма из claim_batch нужны воркеру и после закрытия сессии
+    db = session_factory(expire_on_commit=False)
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def _claim(db: Session, limit: int = None) -> List[models.EmailMessage]:
+    requeue_stale_messages(db)
+    return claim_batch(db, limit)
+
+
+async def _run_db(session_factory, fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _in_session, session_factory, fn, *args)
+
+
+async def deliver(message: models.EmailMessage, pool: SMTPPool, session_factory=SessionLocal):
+    error = None
+    try:
+        delay = await _run_db(session_factory, reserve_domain_slot, recipient_domain(message.to_email))
+        if delay:
+            await asyncio.sleep(delay)
+        await pool.send(build_mime(message), sender=MAIL_FROM or message.from_email)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Email message {message.id} to {message.to_email} failed (attempt {message.attempts}): {e}")
+        error = e
+    try:
+        await _run_db(session_factory, record_result, message, error)
+    except Exception as e:
+        # Например, кампанию удалили вместе с письмом, пока оно отправлялось
+        print(f"Email message {message.id} status update failed: {e}")
+
+
+async def process_batch(pool: SMTPPool, limit: int = None, session_factory=SessionLocal) -> int:
+    """Отправляет одну пачку писем; возвращает ее размер (0 — очередь пуста)"""
+    messages = await _run_db(session_factory, _claim, limit)
+    if messages:
+        await asyncio.gather(*(deliver(message, pool, session_factory) for message in messages))
+    return len(messages)
+
+
+async def worker_loop(worker_id: str):
+    pool = SMTPPool()
+    try:
+        while True:
+            try:
+                if not await process_batch(pool):
+                    await asyncio.sleep(MAIL_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                # Недоотправленные письма вернутся в очередь через MAIL_STALE_AFTER
+                raise
+            except Exception as e:
+                print(f"Outbound mail worker {worker_id} error: {e}")
+                await asyncio.sleep(MAIL_POLL_INTERVAL)
+    finally:
+        await pool.close()
+
+
+def start_worker():
+    """Запускает отправку писем в текущем event loop, если настроен SMTP_HOST"""
+    global _worker_task
+    if is_enabled() and _worker_task is None:
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        _worker_task = asyncio.create_task(worker_loop(worker_id))
+
+
+async def stop_worker():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        await asyncio.gather(_worker_task, return_exceptions=True)
+        _worker_task = None
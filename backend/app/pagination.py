@@ -0,0 +1,82 @@
+"""Keyset-пагинация списков.
+
+Страница — это строки с id меньше курсора, отсортированные по id по убыванию
+(id растет вместе с created_at, поэтому это и есть "сначала новые"). Курсор
+следующей страницы и total отдаются в заголовках, тело ответа остается списком.
+Запрос без limit и cursor сортируется по unpaged_order ручки (прежний порядок),
+так что старые клиенты получают прежний ответ.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Response
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "500"))
+# При count=estimate таблицы меньше этого размера все равно считаются точно
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv("COUNT_ESTIMATE_THRESHOLD", "50000"))
+
+COUNT_MODES = "^(exact|estimate)$"
+
+
+@dataclass
+class Page:
+    items: list
+    next_cursor: Optional[int] = None
+    total: Optional[int] = None
+    estimated: bool = False
+
+
+def _estimated_rows(db: Session, table_name: str) -> Optional[int]:
+    """Оценка числа строк из статистики Postgres (pg_class.reltuples)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    value = db.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table_name},
+    ).scalar()
+    # -1 — таблица еще ни разу не анализировалась
+    return value if value is not None and value >= 0 else None
+
+
+def count_rows(db: Session, stmt, table_name: str, mode: str = "exact"):
+    """Возвращает (total, estimated). Оценка используется только для запросов без фильтров"""
+    if mode == "estimate" and stmt.whereclause is None:
+        estimate = _estimated_rows(db, table_name)
+        if estimate is not None and estimate >= COUNT_ESTIMATE_THRESHOLD:
+            return estimate, True
+    total = db.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+    return total, False
+
+
+def paginate(db: Session, stmt, id_column, limit: Optional[int] = None, cursor: Optional[int] = None,
+             count: Optional[str] = None, table_name: Optional[str] = None, unpaged_order=None) -> Page:
+    """Выполняет stmt постранично. Для AsyncSession вызывать через db.run_sync(paginate, ...)"""
+    page = Page(items=[])
+    if count:
+        page.total, page.estimated = count_rows(db, stmt, table_name or id_column.table.name, count)
+    if limit is None and cursor is None and unpaged_order is not None:
+        page.items = db.execute(stmt.order_by(unpaged_order)).unique().scalars().all()
+        return page
+    if cursor is not None:
+        stmt = stmt.where(id_column < cursor)
+    stmt = stmt.order_by(id_column.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    items = db.execute(stmt).unique().scalars().all()
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        page.next_cursor = items[-1].id
+    page.items = items
+    return page
+
+
+def set_page_headers(response: Response, page: Page):
+    if page.next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(page.next_cursor)
+    if page.total is not None:
+        response.headers["X-Total-Count"] = str(page.total)
+        if page.estimated:
+            response.headers["X-Total-Count-Estimated"] = "1"
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class AsyncRateLimiter:
+    """Ограничивает частоту операций: не больше rate запусков в секунду на процесс"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aenter__(self):
+        await self.wait()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class SlidingWindowLimiter:
+    """Не больше limit событий за window секунд на ключ (потокобезопасный, на процесс)"""
+
+    def __init__(self, limit: int, window: float, maxsize: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _retry_after(self, hits: deque, now: float) -> float:
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        return hits[0] + self.window - now if len(hits) >= self.limit else 0
+
+    def hit(self, key) -> float:
+        """Учитывает событие. Возвращает 0, если лимит не превышен, иначе через сколько секунд повторить"""
+        if self.limit <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+            self._hits.move_to_end(key)
+            retry_after = self._retry_after(hits, now)
+            if retry_after:
+                return retry_after
+            hits.append(now)
+            while len(self._hits) > self.maxsize:
+                self._hits.popitem(last=False)
+            return 0
+
+    def peek(self, key) -> float:
+        """Как hit, но событие не учитывает: только проверяет, исчерпан ли лимит"""
+        if self.limit <= 0:
+            return 0
+        with self._lock:
+            hits = self._hits.get(key)
+            return self._retry_after(hits, time.monotonic()) if hits else 0
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
@@ -5,7 +5,8 @@ from datetime import datetime, timedelta
 from ..database import get_db
 from ..models import User, SupportTicket, SupportEvent
 from ..schemas import UserResponse
-from ..auth import get_current_user
+from .. import auth, admin_metrics
+from ..auth import get_token_user as get_current_user
 from sqlalchemy import func, and_
 
 router = APIRouter(prefix="/admin/dashboard", tags=["admin-dashboard"])
@@ -19,23 +20,12 @@ def get_users_stats(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать статистику")
     
-    # Общее количество пользователей
-    total_users = db.query(User).count()
-    
-    # Пользователи по ролям
-    users_by_role = db.query(
-        User.role,
-        func.count(User.id).label('count')
-    ).group_by(User.role).all()
-    
-    # Новые пользователи за последние 30 дней
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    new_users = db.query(User).filter(User.created_at >= thirty_days_ago).count()
+    users = admin_metrics.get_metrics(db)["users"]
     
     return {
-        "total_users": total_users,
-        "users_by_role": {role: count for role, count in users_by_role},
-        "new_users_30_days": new_users
+        "total_users": users["total"],
+        "users_by_role": users["by_role"],
+        "new_users_30_days": users["recent_30_days"]
     }
 
 @router.get("/tickets/stats")
@@ -47,26 +37,16 @@ def get_tickets_stats(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать статистику")
     
-    # Общая статистика тикетов
-    total_tickets = db.query(SupportTicket).count()
-    open_tickets = db.query(SupportTicket).filter(SupportTicket.status == "open").count()
-    in_progress_tickets = db.query(SupportTicket).filter(SupportTicket.status == "in_progress").count()
-    resolved_tickets = db.query(SupportTicket).filter(SupportTicket.status == "resolved").count()
-    closed_tickets = db.query(SupportTicket).filter(SupportTicket.status == "closed").count()
-    
-    # Текеты по приоритетам
-    tickets_by_priority = db.query(
-        SupportTicket.priority,
-        func.count(SupportTicket.id).label('count')
-    ).group_by(SupportTicket.priority).all()
+    tickets = admin_metrics.get_metrics(db)["tickets"]
+    by_status = tickets["by_status"]
     
     return {
-        "total_tickets": total_tickets,
-        "open_tickets": open_tickets,
-        "in_progress_tickets": in_progress_tickets,
-        "resolved_tickets": resolved_tickets,
-        "closed_tickets": closed_tickets,
-        "tickets_by_priority": {priority: count for priority, count in tickets_by_priority}
+        "total_tickets": tickets["total"],
+        "open_tickets": by_status.get("open", 0),
+        "in_progress_tickets": by_status.get("in_progress", 0),
+        "resolved_tickets": by_status.get("resolved", 0),
+        "closed_tickets": by_status.get("closed", 0),
+        "tickets_by_priority": tickets["by_priority"]
     }
 
 @router.get("/events/upcoming")
@@ -142,6 +122,7 @@ def update_user_role(
     
     user.role = role
     db.commit()
+    auth.invalidate_user_cache(user.username)
     db.refresh(user)
     
     return {"message": f"Роль пользователя {user.username} изменена на {role}"}
@@ -155,29 +136,15 @@ def get_dashboard_overview(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать дашборд")
     
-    # Статистика пользователей
-    total_users = db.query(User).count()
-    admin_users = db.query(User).filter(User.role == "admin").count()
+    metrics = admin_metrics.get_metrics(db)
+    total_users = metrics["users"]["total"]
+    admin_users = metrics["users"]["by_role"].get("admin", 0)
     regular_users = total_users - admin_users
     
-    # Статистика тикетов
-    total_tickets = db.query(SupportTicket).count()
-    open_tickets = db.query(SupportTicket).filter(SupportTicket.status == "open").count()
-    urgent_tickets = db.query(SupportTicket).filter(
-        SupportTicket.priority == "urgent",
-        SupportTicket.status.in_(["open", "in_progress"])
-    ).count()
-    
-    # Ближайшие дедлайны (следующие 3 дня)
-    three_days_from_now = datetime.utcnow() + timedelta(days=3)
-    upcoming_deadlines = db.query(SupportEvent).filter(
-        and_(
-            SupportEvent.event_type == "deadline",
-            SupportEvent.event_date >= datetime.utcnow(),
-            SupportEvent.event_date <= three_days_from_now,
-            SupportEvent.is_completed == False
-        )
-    ).count()
+    total_tickets = metrics["tickets"]["total"]
+    open_tickets = metrics["tickets"]["by_status"].get("open", 0)
+    urgent_tickets = metrics["tickets"]["urgent_active"]
+    upcoming_deadlines = metrics["deadlines_upcoming_3_days"]
     
     return {
         "users": {
@@ -1,18 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime
 from ..database import get_db
 from ..models import SupportTicket, SupportEvent, User
 from ..schemas import (
     SupportTicketCreate, SupportTicketResponse, SupportTicketUpdate,
     SupportEventCreate, SupportEventResponse, SupportEventUpdate,
-    SupportAnalytics, CalendarEvent
+    SupportAnalytics, SupportTrendPoint, CalendarEvent
 )
-from ..auth import get_current_user
+from .. import support_analytics
+from ..auth import get_token_user as get_current_user
 
 router = APIRouter(prefix="/support_tickets", tags=["support-tickets"])
 
+def _tickets_query(db: Session):
+    """Обращения вместе с автором и назначенным админом (один запрос с JOIN)"""
+    return db.query(SupportTicket).options(
+        joinedload(SupportTicket.user),
+        joinedload(SupportTicket.assigned_admin),
+    )
+
+def _with_usernames(ticket: SupportTicket) -> SupportTicket:
+    """Проставляет имена автора и назначенного админа для SupportTicketResponse"""
+    ticket.user_username = ticket.user.username if ticket.user else "Unknown"
+    ticket.assigned_admin_username = ticket.assigned_admin.username if ticket.assigned_admin else None
+    return ticket
+
 @router.post("/", response_model=SupportTicketResponse)
 def create_ticket(
     ticket: SupportTicketCreate,
@@ -37,13 +51,7 @@ def create_ticket(
     db.commit()
     db.refresh(db_ticket)
     
-    # Добавляем информацию о пользователях
-    db_ticket.user_username = db.query(User).filter(User.id == db_ticket.user_id).first().username
-    if db_ticket.assigned_to:
-        assigned_admin = db.query(User).filter(User.id == db_ticket.assigned_to).first()
-        db_ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return db_ticket
+    return _with_usernames(db_ticket)
 
 @router.get("/my", response_model=List[SupportTicketResponse])
 def get_my_tickets(
@@ -51,16 +59,8 @@ def get_my_tickets(
     db: Session = Depends(get_db)
 ):
     """Получить обращения текущего пользователя"""
-    tickets = db.query(SupportTicket).filter(SupportTicket.user_id == current_user.id).all()
-    
-    # Добавляем информацию о пользователях
-    for ticket in tickets:
-        ticket.user_username = current_user.username
-        if ticket.assigned_to:
-            assigned_admin = db.query(User).filter(User.id == ticket.assigned_to).first()
-            ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return tickets
+    tickets = _tickets_query(db).filter(SupportTicket.user_id == current_user.id).all()
+    return [_with_usernames(ticket) for ticket in tickets]
 
 @router.get("/", response_model=List[SupportTicketResponse])
 def get_tickets(
@@ -74,7 +74,7 @@ def get_tickets(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать обращения")
     
-    query = db.query(SupportTicket)
+    query = _tickets_query(db)
     
     if status:
         query = query.filter(SupportTicket.status == status)
@@ -84,15 +84,7 @@ def get_tickets(
         query = query.filter(SupportTicket.priority == priority)
     
     tickets = query.order_by(SupportTicket.created_at.desc()).all()
-    
-    # Добавляем информацию о пользователях
-    for ticket in tickets:
-        ticket.user_username = db.query(User).filter(User.id == ticket.user_id).first().username
-        if ticket.assigned_to:
-            assigned_admin = db.query(User).filter(User.id == ticket.assigned_to).first()
-            ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return tickets
+    return [_with_usernames(ticket) for ticket in tickets]
 
 @router.patch("/{ticket_id}", response_model=SupportTicketResponse)
 def update_ticket(
@@ -118,14 +110,7 @@ def update_ticket(
     db.commit()
     db.refresh(db_ticket)
     
-    # Добавляем информацию о пользователях
-    user = db.query(User).filter(User.id == db_ticket.user_id).first()
-    db_ticket.user_username = user.username if user else "Unknown"
-    if db_ticket.assigned_to:
-        assigned_admin = db.query(User).filter(User.id == db_ticket.assigned_to).first()
-        db_ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return db_ticket
+    return _with_usernames(db_ticket)
 
 @router.get("/{ticket_id}", response_model=SupportTicketResponse)
 def get_ticket(
@@ -137,17 +122,11 @@ def get_ticket(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать обращения")
     
-    ticket = db.query(SupportTicket).filter(SupportTicket.id == ticket_id).first()
+    ticket = _tickets_query(db).filter(SupportTicket.id == ticket_id).first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Обращение не найдено")
     
-    # Добавляем информацию о пользователях
-    ticket.user_username = db.query(User).filter(User.id == ticket.user_id).first().username
-    if ticket.assigned_to:
-        assigned_admin = db.query(User).filter(User.id == ticket.assigned_to).first()
-        ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return ticket
+    return _with_usernames(ticket)
 
 @router.put("/{ticket_id}", response_model=SupportTicketResponse)
 def update_ticket(
@@ -180,13 +159,7 @@ def update_ticket(
     db.commit()
     db.refresh(db_ticket)
     
-    # Добавляем информацию о пользователях
-    db_ticket.user_username = db.query(User).filter(User.id == db_ticket.user_id).first().username
-    if db_ticket.assigned_to:
-        assigned_admin = db.query(User).filter(User.id == db_ticket.assigned_to).first()
-        db_ticket.assigned_admin_username = assigned_admin.username if assigned_admin else None
-    
-    return db_ticket
+    return _with_usernames(db_ticket)
 
 @router.post("/{ticket_id}/close")
 def close_ticket(
@@ -347,73 +320,25 @@ def get_support_analytics(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Только администраторы могут просматривать аналитику")
     
-    # Общая статистика
-    total_tickets = db.query(SupportTicket).count()
-    open_tickets = db.query(SupportTicket).filter(SupportTicket.status == "open").count()
-    closed_tickets = db.query(SupportTicket).filter(SupportTicket.status == "closed").count()
-    in_progress_tickets = db.query(SupportTicket).filter(SupportTicket.status == "in_progress").count()
-    resolved_tickets = db.query(SupportTicket).filter(SupportTicket.status == "resolved").count()
-    
-    # Статистика по департаментам
-    tickets_by_department = {}
-    departments = db.query(SupportTicket.department).distinct().all()
-    for dept in departments:
-        if dept[0]:
-            count = db.query(SupportTicket).filter(SupportTicket.department == dept[0]).count()
-            tickets_by_department[dept[0]] = count
-    
-    # Статистика по приоритетам
-    tickets_by_priority = {}
-    priorities = db.query(SupportTicket.priority).distinct().all()
-    for priority in priorities:
-        if priority[0]:
-            count = db.query(SupportTicket).filter(SupportTicket.priority == priority[0]).count()
-            tickets_by_priority[priority[0]] = count
-    
-    # Статистика по статусам
-    tickets_by_status = {
-        "open": open_tickets,
-        "in_progress": in_progress_tickets,
-        "resolved": resolved_tickets,
-        "closed": closed_tickets
-    }
-    
-    # Среднее время ответа и решения
-    resolved_tickets_with_response = db.query(SupportTicket).filter(
-        SupportTicket.first_response_at.isnot(None),
-        SupportTicket.resolved_at.isnot(None)
-    ).all()
-    
-    average_response_time_hours = None
-    average_resolution_time_hours = None
-    
-    if resolved_tickets_with_response:
-        total_response_time = timedelta()
-        total_resolution_time = timedelta()
-        
-        for ticket in resolved_tickets_with_response:
-            if ticket.first_response_at and ticket.created_at:
-                response_time = ticket.first_response_at - ticket.created_at
-                total_response_time += response_time
-            
-            if ticket.resolved_at and ticket.created_at:
-                resolution_time = ticket.resolved_at - ticket.created_at
-                total_resolution_time += resolution_time
-        
-        if total_response_time:
-            average_response_time_hours = total_response_time.total_seconds() / 3600 / len(resolved_tickets_with_response)
-        if total_resolution_time:
-            average_resolution_time_hours = total_resolution_time.total_seconds() / 3600 / len(resolved_tickets_with_response)
-    
-    return SupportAnalytics(
-        total_tickets=total_tickets,
-        open_tickets=open_tickets,
-        closed_tickets=closed_tickets,
-        in_progress_tickets=in_progress_tickets,
-        resolved_tickets=resolved_tickets,
-        average_response_time_hours=average_response_time_hours,
-        average_resolution_time_hours=average_resolution_time_hours,
-        tickets_by_department=tickets_by_department,
-        tickets_by_priority=tickets_by_priority,
-        tickets_by_status=tickets_by_status
-    ) 
\ No newline at end of file
+    return SupportAnalytics(**support_analytics.compute_overview(db))
+
+@router.get("/analytics/trends", response_model=List[SupportTrendPoint])
+def get_support_trends(
+    bucket: str = Query("day", pattern=support_analytics.TREND_BUCKETS),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Динамика обращений по дням или неделям (по умолчанию — последние 30 дней)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Только администраторы могут просматривать аналитику")
+    date_from, date_to = support_analytics.resolve_trend_range(date_from, date_to)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from позже date_to")
+    if (date_to - date_from).days >= support_analytics.TREND_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Диапазон не больше {support_analytics.TREND_MAX_DAYS} дней",
+        )
+    return support_analytics.compute_trends(db, bucket, date_from, date_to)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
 class UserCreate(BaseModel):
     username: str
@@ -26,9 +26,15 @@ class ArticleOut(BaseModel):
     id: int
     code: str
     request_id: Optional[int]
+    part_id: Optional[int] = None
     class Config:
         from_attributes = True
 
+class ArticleSearchResult(ArticleOut):
+    normalized_code: Optional[str] = None
+    match: str  # exact, prefix, fuzzy
+    score: float
+
 class SupplierOut(BaseModel):
     id: int
     name: str
@@ -187,6 +193,20 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True 
 
+class TokenUser(BaseModel):
+    """Пользователь, восстановленный из claims access-токена (без запроса к БД)"""
+    id: int
+    username: str
+    role: Optional[str] = "user"
+    department: Optional[str] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+    class Config:
+        from_attributes = True
+
 # Схемы для системы управления обращениями
 class SupportTicketBase(BaseModel):
     title: str
@@ -264,6 +284,12 @@ class SupportAnalytics(BaseModel):
     tickets_by_priority: dict
     tickets_by_status: dict
 
+class SupportTrendPoint(BaseModel):
+    bucket_start: date
+    created: int
+    resolved: int
+    average_resolution_time_hours: Optional[float] = None
+
 class CalendarEvent(BaseModel):
     id: int
     title: str
@@ -395,6 +421,10 @@ class EmailMessageResponse(BaseModel):
     external_id: Optional[str] = None
     sent_at: datetime
     read_at: Optional[datetime] = None
+    delivery_status: Optional[str] = None  # queued, sending, sent, failed; None — добавлено вручную
+    attempts: Optional[int] = None
+    next_attempt_at: Optional[datetime] = None
+    delivery_error: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -411,6 +441,9 @@ class EmailAttachmentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class EmailCampaignBulkSend(BaseModel):
+    campaign_ids: List[int]
+
 class SupplierGroupingRequest(BaseModel):
     request_ids: List[int]  # Список ID запросов для группировки
     template_id: Optional[int] = None  # ID шаблона письма
@@ -427,4 +460,23 @@ class SupplierGroupingResponse(BaseModel):
     supplier_country: Optional[str] = None
     articles: List[SupplierGroupingArticle]
     requests: List[int]
-    total_articles: int 
\ No newline at end of file
+    total_articles: int
+
+class EmailCampaignBulkCreate(BaseModel):
+    groups: List[SupplierGroupingResponse]  # Результат group-suppliers (все группы или выбранные)
+    name: Optional[str] = None  # По умолчанию "Кампания для {supplier_name}"
+    subject: str = "Запрос коммерческого предложения"
+    body: Optional[str] = None  # Подстановки {supplier_name} и {articles}; по умолчанию стандартный запрос КП
+
+class SupplierSearchJobOut(BaseModel):
+    id: int
+    article_id: int
+    status: str
+    regions_total: int
+    regions_done: int
+    suppliers_found: int
+    region_stats: List[dict] = []
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,246 @@
+"""Фоновая очередь поиска поставщиков.
+
+Задачи хранятся в таблице supplier_search_jobs, поэтому переживают перезапуск
+процесса. Каждый uvicorn-воркер поднимает SUPPLIER_JOB_WORKERS обработчиков,
+которые забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED. Запросы к БД
+выполняются в пуле потоков, каждый в своей короткой сессии, так что event loop не
+блокируется, а транзакция не остается открытой, пока идет поиск по регионам. Пока
+задача выполняется, отдельная корутина раз в SUPPLIER_JOB_HEARTBEAT_INTERVAL секунд
+пишет heartbeat, независимо от того, сколько длится один регион.
+"""
+import asyncio
+import datetime
+import functools
+import json
+import os
+import socket
+import uuid
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import catalog, crud, google_search, models
+from .database import SessionLocal
+
+SUPPLIER_JOB_WORKERS = int(os.getenv("SUPPLIER_JOB_WORKERS", "2"))
+SUPPLIER_JOB_POLL_INTERVAL = float(os.getenv("SUPPLIER_JOB_POLL_INTERVAL", "2"))
+# Через сколько секунд без heartbeat задача считается брошенной и возвращается в очередь
+SUPPLIER_JOB_STALE_AFTER = int(os.getenv("SUPPLIER_JOB_STALE_AFTER", "300"))
+SUPPLIER_JOB_HEARTBEAT_INTERVAL = float(os.getenv("SUPPLIER_JOB_HEARTBEAT_INTERVAL", "30"))
+SUPPLIER_JOB_MAX_ATTEMPTS = int(os.getenv("SUPPLIER_JOB_MAX_ATTEMPTS", "3"))
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("done", "failed")
+
+_worker_tasks = []
+
+
+def job_to_dict(job: models.SupplierSearchJob) -> dict:
+    return {
+        "id": job.id,
+        "article_id": job.article_id,
+        "status": job.status,
+        "regions_total": job.regions_total or 0,
+        "regions_done": job.regions_done or 0,
+        "suppliers_found": job.suppliers_found or 0,
+        "region_stats": json.loads(job.region_stats) if job.region_stats else [],
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def enqueue_search_job(db: Session, article_id: int, user_id: int, use_cache: bool = True) -> models.SupplierSearchJob:
+    """Ставит поиск в очередь. Если по артикулу уже есть активная задача — возвращает ее"""
+    existing = db.query(models.SupplierSearchJob).filter(
+        models.SupplierSearchJob.article_id == article_id,
+        models.SupplierSearchJob.status.in_(ACTIVE_STATUSES),
+    ).first()
+    if existing:
+        return existing
+    job = models.SupplierSearchJob(
+        article_id=article_id,
+        user_id=user_id,
+        use_cache=use_cache,
+        regions_total=len(google_search.SEARCH_REGIONS),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.SupplierSearchJob]:
+    return db.query(models.SupplierSearchJob).filter(models.SupplierSearchJob.id == job_id).first()
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[models.SupplierSearchJob]:
+    """Атомарно забирает самую старую задачу из очереди"""
+    job = (
+        db.query(models.SupplierSearchJob)
+        .filter(models.SupplierSearchJob.status == "queued")
+        .order_by(models.SupplierSearchJob.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if not job:
+        db.rollback()
+        return None
+    now = datetime.datetime.utcnow()
+    job.status = "running"
+    job.worker_id = worker_id
+    job.attempts = (job.attempts or 0) + 1
+    job.started_at = now
+    job.heartbeat_at = now
+    job.regions_done = 0
+    job.suppliers_found = 0
+    job.region_stats = None
+    job.error = None
+    db.commit()
+    return job
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    """Возвращает в очередь задачи, воркер которых умер (нет heartbeat)"""
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=SUPPLIER_JOB_STALE_AFTER)
+    stale = db.query(models.SupplierSearchJob).filter(
+        models.SupplierSearchJob.status == "running",
+        models.SupplierSearchJob.heartbeat_at < stale_before,
+    ).with_for_update(skip_locked=True).all()
+    for job in stale:
+        if (job.attempts or 0) >= SUPPLIER_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.error = "Превышено число попыток"
+            job.finished_at = datetime.datetime.utcnow()
+        else:
+            job.status = "queued"
+            job.worker_id = None
+    db.commit()
+    return len(stale)
+
+
+def _in_session(fn, *args, **kwargs):
+    # expire_on_commit=False: задача из claim_next_job нужна и после закрытия сессии
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def _run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(_in_session, fn, *args, **kwargs))
+
+
+def _claim(db: Session, worker_id: str) -> Optional[models.SupplierSearchJob]:
+    requeue_stale_jobs(db)
+    return claim_next_job(db, worker_id)
+
+
+def _update_job(db: Session, job_id: int, owner: str = None, **values):
+    """UPDATE задачи по id. С owner — только пока задача еще принадлежит этому воркеру"""
+    stmt = update(models.SupplierSearchJob).where(models.SupplierSearchJob.id == job_id)
+    if owner is not None:
+        stmt = stmt.where(
+            models.SupplierSearchJob.worker_id == owner,
+            models.SupplierSearchJob.status == "running",
+        )
+    db.execute(stmt.values(**values))
+    db.commit()
+
+
+def _article_code(db: Session, article_id: int) -> Optional[str]:
+    article = db.query(models.Article.code).filter(models.Article.id == article_id).first()
+    return article.code if article else None
+
+
+def _finish_job(db: Session, job: models.SupplierSearchJob, code: str, suppliers: list, stats: list):
+    # Старые поставщики заменяются новыми одной транзакцией
+    crud.add_suppliers_bulk(db, [job.article_id], suppliers, job.user_id)
+    _update_job(
+        db, job.id, job.worker_id,
+        status="done",
+        regions_total=len(stats),  # Из каталога приходит один "регион"
+        finished_at=datetime.datetime.utcnow(),
+    )
+    region_stats = google_search.format_region_stats(stats)
+    print(f"Supplier search job {job.id} ({code}): {region_stats}")
+    crud.add_analytics(db, job.user_id, "Поиск поставщиков", f"Артикул: {code}, найдено: {len(suppliers)} поставщиков; регионы: {region_stats}")
+
+
+async def heartbeat_loop(job: models.SupplierSearchJob):
+    """Пишет heartbeat задачи, пока ее не отменят"""
+    while True:
+        await asyncio.sleep(SUPPLIER_JOB_HEARTBEAT_INTERVAL)
+        try:
+            await _run_db(_update_job, job.id, job.worker_id, heartbeat_at=datetime.datetime.utcnow())
+        except Exception as e:
+            print(f"Supplier search job {job.id} heartbeat error: {e}")
+
+
+async def process_job(job: models.SupplierSearchJob):
+    """Выполняет поиск по всем регионам: прогресс сохраняется после каждого региона, поставщики — в конце"""
+    code = await _run_db(_article_code, job.article_id)
+    if code is None:
+        await _run_db(_update_job, job.id, job.worker_id, status="failed", error="Артикул не найден",
+                      finished_at=datetime.datetime.utcnow())
+        return
+
+    stats = []
+    suppliers = []
+    async for region, found, stat in catalog.iter_suppliers(code, use_cache=job.use_cache):
+        suppliers.extend(found)
+        stats.append(stat)
+        await _run_db(
+            _update_job, job.id, job.worker_id,
+            regions_done=len(stats),
+            suppliers_found=len(suppliers),
+            region_stats=json.dumps(stats, ensure_ascii=False),
+        )
+    await _run_db(_finish_job, job, code, suppliers, stats)
+
+
+async def worker_loop(worker_id: str):
+    while True:
+        try:
+            job = await _run_db(_claim, worker_id)
+            if job is None:
+                await asyncio.sleep(SUPPLIER_JOB_POLL_INTERVAL)
+                continue
+            heartbeat = asyncio.create_task(heartbeat_loop(job))
+            try:
+                await process_job(job)
+            except asyncio.CancelledError:
+                # Процесс останавливается — отдаем задачу другому воркеру
+                await asyncio.shield(_run_db(_update_job, job.id, worker_id, status="queued", worker_id=None))
+                raise
+            except Exception as e:
+                print(f"Supplier search job {job.id} failed: {e}")
+                await _run_db(_update_job, job.id, worker_id, status="failed", error=str(e),
+                              finished_at=datetime.datetime.utcnow())
+            finally:
+                heartbeat.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Supplier job worker {worker_id} error: {e}")
+            await asyncio.sleep(SUPPLIER_JOB_POLL_INTERVAL)
+
+
+def start_workers():
+    """Запускает обработчиков очереди в текущем event loop (вызывается на старте приложения)"""
+    if _worker_tasks:
+        return
+    prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    for i in range(SUPPLIER_JOB_WORKERS):
+        _worker_tasks.append(asyncio.create_task(worker_loop(f"{prefix}:{i}")))
+
+
+async def stop_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
@@ -0,0 +1,159 @@
+"""Аналитика обращений в поддержку.
+
+Сводка считается одним запросом: GROUP BY по статусу, приоритету и департаменту,
+а время ответа и решения суммируется в той же группировке (SUM(EXTRACT(EPOCH ...)))
+и усредняется уже по готовым группам. Тренды — один запрос с date_trunc по дням
+или неделям в заданном диапазоне дат (по индексам created_at и resolved_at).
+"""
+import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import Integer, and_, case, cast, func, literal, literal_column, select, union_all
+from sqlalchemy.orm import Session
+
+from .models import SupportTicket
+
+TICKET_STATUSES = ("open", "in_progress", "resolved", "closed")
+TREND_BUCKETS = "^(day|week)$"
+# Ограничение диапазона трендов, чтобы один запрос не превращался в выгрузку за годы
+TREND_MAX_DAYS = 366
+TREND_DEFAULT_DAYS = 30
+
+
+def _seconds_between(db: Session, start, end):
+    """end - start в секундах (SQLite используется только в тестах)"""
+    if db.get_bind().dialect.name == "sqlite":
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return func.extract("epoch", end - start)
+
+
+def _bucket_start(db: Session, bucket: str, column):
+    if bucket not in ("day", "week"):
+        raise ValueError(f"Unknown trend bucket: {bucket}")
+    if db.get_bind().dialect.name == "sqlite":
+        if bucket == "week":
+            return func.date(column, "-6 days", "weekday 1")
+        return func.date(column)
+    # Литерал, а не параметр: иначе выражение в SELECT и GROUP BY для Postgres разное
+    return func.date_trunc(literal_column(f"'{bucket}'"), column)
+
+
+def _hours(total_seconds, count) -> Optional[float]:
+    if not count or not total_seconds:
+        return None
+    return total_seconds / 3600 / count
+
+
+def compute_overview(db: Session) -> dict:
+    """Все поля SupportAnalytics за один запрос"""
+    timed = and_(SupportTicket.first_response_at.isnot(None), SupportTicket.resolved_at.isnot(None))
+    stmt = select(
+        SupportTicket.status,
+        SupportTicket.priority,
+        SupportTicket.department,
+        func.count().label("total"),
+        func.sum(case((timed, 1), else_=0)).label("timed"),
+        func.sum(case((timed, _seconds_between(db, SupportTicket.created_at, SupportTicket.first_response_at)),
+                      else_=0)).label("response_seconds"),
+        func.sum(case((timed, _seconds_between(db, SupportTicket.created_at, SupportTicket.resolved_at)),
+                      else_=0)).label("resolution_seconds"),
+    ).group_by(SupportTicket.status, SupportTicket.priority, SupportTicket.department)
+
+    total = timed_count = 0
+    response_seconds = resolution_seconds = 0.0
+    by_status = {status: 0 for status in TICKET_STATUSES}
+    by_department = {}
+    by_priority = {}
+    for status, priority, department, count, timed_rows, response, resolution in db.execute(stmt):
+        total += count
+        timed_count += timed_rows or 0
+        response_seconds += float(response or 0)
+        resolution_seconds += float(resolution or 0)
+        if status in by_status:
+            by_status[status] += count
+        if department:
+            by_department[department] = by_department.get(department, 0) + count
+        if priority:
+            by_priority[priority] = by_priority.get(priority, 0) + count
+
+    return {
+        "total_tickets": total,
+        "open_tickets": by_status["open"],
+        "closed_tickets": by_status["closed"],
+        "in_progress_tickets": by_status["in_progress"],
+        "resolved_tickets": by_status["resolved"],
+        "average_response_time_hours": _hours(response_seconds, timed_count),
+        "average_resolution_time_hours": _hours(resolution_seconds, timed_count),
+        "tickets_by_department": by_department,
+        "tickets_by_priority": by_priority,
+        "tickets_by_status": by_status,
+    }
+
+
+def _as_date(value) -> datetime.date:
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def _bucket_dates(bucket: str, date_from: datetime.date, date_to: datetime.date):
+    start = date_from - datetime.timedelta(days=date_from.weekday()) if bucket == "week" else date_from
+    step = datetime.timedelta(days=7 if bucket == "week" else 1)
+    while start <= date_to:
+        yield start
+        start += step
+
+
+def resolve_trend_range(date_from: Optional[datetime.date] = None,
+                        date_to: Optional[datetime.date] = None) -> Tuple[datetime.date, datetime.date]:
+    """Подставляет границы по умолчанию: date_to — сегодня, date_from — TREND_DEFAULT_DAYS дней до date_to"""
+    date_to = date_to or datetime.datetime.utcnow().date()
+    date_from = date_from or date_to - datetime.timedelta(days=TREND_DEFAULT_DAYS - 1)
+    return date_from, date_to
+
+
+def compute_trends(db: Session, bucket: str, date_from: datetime.date, date_to: datetime.date) -> list:
+    """Созданные и решенные обращения по дням или неделям, включая пустые периоды.
+
+    Границы уже должны быть подставлены и проверены (resolve_trend_range, TREND_MAX_DAYS).
+    """
+    start = datetime.datetime.combine(date_from, datetime.time.min)
+    end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)
+
+    created_bucket = _bucket_start(db, bucket, SupportTicket.created_at)
+    resolved_bucket = _bucket_start(db, bucket, SupportTicket.resolved_at)
+    stmt = union_all(
+        select(
+            created_bucket.label("bucket"),
+            literal("created").label("kind"),
+            func.count().label("total"),
+            cast(literal(0), Integer).label("seconds"),
+        )
+        .where(SupportTicket.created_at >= start, SupportTicket.created_at < end)
+        .group_by(created_bucket),
+        select(
+            resolved_bucket.label("bucket"),
+            literal("resolved").label("kind"),
+            func.count().label("total"),
+            func.sum(_seconds_between(db, SupportTicket.created_at, SupportTicket.resolved_at)).label("seconds"),
+        )
+        .where(SupportTicket.resolved_at >= start, SupportTicket.resolved_at < end)
+        .group_by(resolved_bucket),
+    )
+
+    points = {
+        day: {"bucket_start": day, "created": 0, "resolved": 0, "average_resolution_time_hours": None}
+        for day in _bucket_dates(bucket, date_from, date_to)
+    }
+    for bucket_value, kind, total, seconds in db.execute(stmt):
+        point = points.get(_as_date(bucket_value))
+        if point is None:
+            continue
+        if kind == "created":
+            point["created"] = total
+        else:
+            point["resolved"] = total
+            point["average_resolution_time_hours"] = _hours(float(seconds or 0), total)
+    return list(points.values())
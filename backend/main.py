@@ -6,9 +6,29 @@ from api import news_api, calendar_api, requests_api, support_api, analytics_api
 app = FastAPI()
 
 # Авто-создание всех таблиц ORM (PostgreSQL)
-from app.database import engine, Base
+from app.database import engine, async_engine, Base, describe_pool_config
 Base.metadata.create_all(bind=engine)
 
+# Фоновые обработчики очереди поиска и общие HTTP-клиенты
+from app import supplier_jobs, google_search, admin_metrics, outbound_mail, inbound_mail
+
+@app.on_event("startup")
+async def on_startup():
+    print(describe_pool_config())
+    supplier_jobs.start_workers()
+    admin_metrics.start_refresher()
+    outbound_mail.start_worker()
+    inbound_mail.start_poller()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await supplier_jobs.stop_workers()
+    await admin_metrics.stop_refresher()
+    await outbound_mail.stop_worker()
+    await inbound_mail.stop_poller()
+    await google_search.close_clients()
+    await async_engine.dispose()
+
 app.include_router(auth_api.router, prefix="/api")
 app.include_router(users_api.router, prefix="/api")
 app.include_router(suppliers_api.router, prefix="/api")
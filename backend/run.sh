@@ -5,4 +5,5 @@ echo "[run.sh] Жду инициализации базы и запускаю м
 python init_db.py
 
 echo "[run.sh] Запускаю backend (uvicorn)..."
-uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers 4 
\ No newline at end of file
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers $WEB_CONCURRENCY 
\ No newline at end of file
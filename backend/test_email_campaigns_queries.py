@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Регрессионный тест: группировка поставщиков для рассылки и список кампаний выполняются
+за постоянное число запросов, независимо от числа поставщиков и кампаний. Работает на временной SQLite-базе, Postgres не нужен.
+"""
+import sys
+import os
+
+# Добавляем путь к модулям приложения
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.auth import get_current_user
+from app.models import User, Request, Article, Supplier
+from api import email_campaigns_api
+from testing_helpers import make_query_client
+
+
+def _make_client(suppliers_per_article: int):
+    """Два запроса по три артикула; у каждого артикула suppliers_per_article поставщиков.
+
+    Email повторяются между артикулами (разный регистр и пробелы), чтобы проверить объединение.
+    """
+    def seed(db):
+        user = User(username="buyer", role="user")
+        db.add(user)
+        db.flush()
+        request_ids = []
+        for r in range(2):
+            req = Request(user_id=user.id)
+            db.add(req)
+            db.flush()
+            request_ids.append(req.id)
+            for code in ("A-1", "B-2", "C-3"):
+                article = Article(code=code, user_id=user.id, request_id=req.id)
+                db.add(article)
+                db.flush()
+                for i in range(suppliers_per_article):
+                    email = f"sales{i}@example.com" if r == 0 else f"  SALES{i}@Example.com "
+                    db.add(Supplier(article_id=article.id, user_id=user.id, name=f"Поставщик {i}", email=email))
+                db.add(Supplier(article_id=article.id, user_id=user.id, name="Без email", email=""))
+        user_id = user.id
+        return {get_current_user: lambda: User(id=user_id, username="buyer", role="user")}, request_ids
+
+    return make_query_client(email_campaigns_api.router, seed, "campaigns.db")
+
+
+def _group(suppliers_per_article: int):
+    client, queries, request_ids = _make_client(suppliers_per_article)
+    response = client.post("/email-campaigns/group-suppliers", json={"request_ids": request_ids})
+    assert response.status_code == 200, response.text
+    return response.json(), len(queries), request_ids
+
+
+def test_grouping_is_single_query():
+    groups, query_count, request_ids = _group(40)
+    assert query_count == 1
+    assert len(groups) == 40
+    group = next(g for g in groups if g["supplier_email"] == "sales0@example.com")
+    assert group["supplier_name"] == "Поставщик 0"
+    assert group["total_articles"] == 6
+    assert group["requests"] == sorted(request_ids)
+    assert {a["code"]: a["quantity"] for a in group["articles"]} == {"A-1": 2, "B-2": 2, "C-3": 2}
+
+
+def test_grouping_unknown_requests():
+    client, _, _ = _make_client(1)
+    response = client.post("/email-campaigns/group-suppliers", json={"request_ids": [999]})
+    assert response.status_code == 404
+
+
+def test_campaign_counters_and_list_query():
+    """Счетчики обновляются при записи, а список кампаний читается одним запросом"""
+    client, queries, request_ids = _make_client(1)
+    for i in range(5):
+        response = client.post("/email-campaigns/", json={
+            "name": f"Кампания {i}",
+            "supplier_email": "sales0@example.com",
+            "supplier_name": "Поставщик 0",
+            "subject": "Запрос цены",
+            "body": "Добрый день",
+            "article_ids": [1, 2, 3, 999],
+        })
+        assert response.status_code == 200, response.text
+        assert response.json()["articles_count"] == 3
+    campaign_id = response.json()["id"]
+    for message_type in ("sent", "received"):
+        response = client.post(f"/email-campaigns/{campaign_id}/messages", json={
+            "message_type": message_type,
+            "subject": "Re: Запрос цены",
+            "body": "Текст",
+            "from_email": "buyer@example.com",
+            "to_email": "sales0@example.com",
+        })
+        assert response.status_code == 200, response.text
+
+    queries.clear()
+    response = client.get("/email-campaigns/")
+    assert response.status_code == 200, response.text
+    assert len(queries) == 1
+    campaigns = {c["id"]: c for c in response.json()}
+    assert len(campaigns) == 5
+    assert campaigns[campaign_id]["messages_count"] == 2
+    assert all(c["articles_count"] == 3 for c in campaigns.values())
+
+
+def _bulk_create(suppliers_per_article: int):
+    client, queries, request_ids = _make_client(suppliers_per_article)
+    groups = client.post("/email-campaigns/group-suppliers", json={"request_ids": request_ids}).json()
+    queries.clear()
+    response = client.post("/email-campaigns/bulk", json={"groups": groups, "body": "Для {supplier_name}:\n{articles}"})
+    assert response.status_code == 200, response.text
+    return response.json(), len(queries)
+
+
+def test_bulk_campaign_creation():
+    """Кампании по всем группам создаются за постоянное число запросов, с артикулами"""
+    few, few_queries = _bulk_create(2)
+    many, many_queries = _bulk_create(40)
+    assert few_queries == many_queries, f"2 группы: {few_queries} запросов, 40 групп: {many_queries}"
+    assert len(many) == 40
+    campaign = next(c for c in many if c["supplier_email"] == "sales0@example.com")
+    # Каждый код есть в обоих запросах: 3 кода x 2 запроса
+    assert campaign["articles_count"] == 6 and campaign["status"] == "draft"
+    assert campaign["body"].startswith("Для Поставщик 0:\n- A-1 (количество: 2)")
+
+
+if __name__ == "__main__":
+    test_grouping_is_single_query()
+    test_grouping_unknown_requests()
+    test_campaign_counters_and_list_query()
+    test_bulk_campaign_creation()
+    print("✅ Группировка поставщиков и список кампаний выполняются за постоянное число запросов")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Тест загрузки ответов поставщиков по IMAP: локальный IMAP-сервер-заглушка (socketserver),
+инкрементальная синхронизация по UID, сопоставление по In-Reply-To/References и
+скачивание больших вложений частями. Работает на временной SQLite-базе.
+"""
+import sys
+import os
+import datetime
+import imaplib
+import re
+import socketserver
+import tempfile
+import threading
+from email.message import EmailMessage as MimeMessage
+from urllib.parse import quote
+
+# Добавляем путь к модулям приложения
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, EmailCampaign, EmailMessage, EmailAttachment, MailboxSyncState
+from app import inbound_mail
+
+SENT_MESSAGE_ID = "<campaign-1@company.example>"
+
+
+class FakeMailbox:
+    def __init__(self):
+        self.uidvalidity = 1000
+        self.messages = {}  # uid -> email.message.EmailMessage
+        self.fetched = []  # (uid, items) каждого UID FETCH
+        self.max_literal = 0
+
+    def add(self, uid, message):
+        self.messages[uid] = message
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part) -> str:
+    if part.is_multipart():
+        return "(" + "".join(_bodystructure(p) for p in part.get_payload()) + f" {_quote(part.get_content_subtype().upper())})"
+    params = []
+    if part.get_content_maintype() == "text":
+        params += ["CHARSET", part.get_content_charset() or "us-ascii"]
+    filename = part.get_filename()
+    disposition = "NIL"
+    if filename:
+        key, value = ("FILENAME", filename) if filename.isascii() else ("FILENAME*", "utf-8''" + quote(filename))
+        disposition = f"({_quote('ATTACHMENT')} ({_quote(key)} {_quote(value)}))"
+    payload = _payload(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()), _quote(part.get_content_subtype().upper()),
+        "(" + " ".join(_quote(p) for p in params) + ")" if params else "NIL",
+        "NIL", "NIL", _quote((part.get("Content-Transfer-Encoding") or "7bit").upper()), str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    fields += ["NIL", disposition]
+    return "(" + " ".join(fields) + ")"
+
+
+def _payload(part) -> bytes:
+    return part.get_payload(decode=False).encode("ascii", "surrogateescape")
+
+
+def _find_part(message, number: str):
+    part = message
+    for index in number.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+    return part
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    def send(self, text):
+        self.wfile.write(text.encode() if isinstance(text, str) else text)
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send("* OK fake IMAP4rev1 ready\r\n")
+        while True:
+            line = self.rfile.readline().decode()
+            if not line:
+                return
+            tag, command, *rest = line.strip().split(" ", 2)
+            args = rest[0] if rest else ""
+            command = command.upper()
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1\r\n")
+            elif command in ("SELECT", "EXAMINE"):
+                self.send(f"* {len(mailbox.messages)} EXISTS\r\n* OK [UIDVALIDITY {mailbox.uidvalidity}] ok\r\n")
+                self.send(f"{tag} OK [READ-ONLY] done\r\n")
+                continue
+            elif command == "UID":
+                sub, _, params = args.partition(" ")
+                if sub.upper() == "SEARCH":
+                    start = int(re.search(r"UID (\d+):\*", params).group(1))
+                    uids = sorted(mailbox.messages)
+                    found = [u for u in uids if u >= start] or uids[-1:]
+                    self.send("* SEARCH " + " ".join(map(str, found)) + "\r\n")
+                else:
+                    self._fetch(mailbox, params)
+            elif command == "LOGOUT":
+                self.send(f"* BYE\r\n{tag} OK bye\r\n")
+                return
+            self.send(f"{tag} OK done\r\n")
+
+    def _fetch(self, mailbox, params):
+        uid_set, items = params.split(" ", 1)
+        mailbox.fetched.append((uid_set, items))
+        for seq, uid in enumerate(sorted(mailbox.messages), 1):
+            if str(uid) not in uid_set.split(","):
+                continue
+            message = mailbox.messages[uid]
+            out = [f"* {seq} FETCH (UID {uid}".encode()]
+            for item in re.findall(r"BODYSTRUCTURE|BODY\.PEEK\[[^\]]*\](?:<\d+\.\d+>)?", items):
+                if item == "BODYSTRUCTURE":
+                    out.append(f" BODYSTRUCTURE {_bodystructure(message)}".encode())
+                    continue
+                section, offset, length = re.match(r"BODY\.PEEK\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", item).groups()
+                if section.startswith("HEADER.FIELDS"):
+                    names = section[section.index("(") + 1:-1].lower().split()
+                    data = "".join(f"{k}: {v}\r\n" for k, v in message.items() if k.lower() in names).encode() + b"\r\n"
+                    key = f"BODY[{section}]"
+                else:
+                    data = _payload(_find_part(message, section))
+                    key = f"BODY[{section}]"
+                    if offset is not None:
+                        offset, length = int(offset), int(length)
+                        data = data[offset:offset + length]
+                        key += f"<{offset}>"
+                mailbox.max_literal = max(mailbox.max_literal, len(data))
+                out.append(f" {key} {{{len(data)}}}\r\n".encode() + data)
+            self.send(b"".join(out) + b")\r\n")
+
+
+def _start_server(mailbox):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeIMAPHandler)
+    server.daemon_threads = True
+    server.mailbox = mailbox
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _reply(message_id, in_reply_to=None, references=None, body="Цена 100 руб.", attachment=None):
+    message = MimeMessage()
+    message["From"] = "Поставщик <sales@supplier.example>"
+    message["To"] = "buyer@company.example"
+    message["Subject"] = "Re: Запрос цены"
+    message["Date"] = "Mon, 02 Mar 2026 12:00:00 +0300"
+    message["Message-ID"] = message_id
+    if in_reply_to:
+        message["In-Reply-To"] = in_reply_to
+    if references:
+        message["References"] = references
+    message.set_content(body, cte="quoted-printable")
+    if attachment:
+        filename, data = attachment
+        message.add_attachment(data, maintype="application", subtype="octet-stream", filename=filename)
+    return message
+
+
+def _make_db():
+    db_path = os.path.join(tempfile.mkdtemp(), "inbound.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    TestSession = sessionmaker(bind=engine)
+    db = TestSession()
+    user = User(username="buyer", role="user")
+    db.add(user)
+    db.flush()
+    campaign = EmailCampaign(name="Кампания", supplier_email="sales@supplier.example", supplier_name="Поставщик",
+                             subject="Запрос цены", body="Добрый день", user_id=user.id,
+                             status="sent", messages_count=1)
+    db.add(campaign)
+    db.flush()
+    db.add(EmailMessage(campaign_id=campaign.id, message_type="sent", subject="Запрос цены", body="Добрый день",
+                        from_email="buyer@company.example", to_email="sales@supplier.example",
+                        external_id=SENT_MESSAGE_ID, delivery_status="sent"))
+    db.commit()
+    campaign_id = campaign.id
+    db.close()
+    return TestSession, campaign_id
+
+
+def _sync(TestSession, port):
+    imap = imaplib.IMAP4("127.0.0.1", port)
+    imap.login("mailer", "secret")
+    db = TestSession()
+    try:
+        total = 0
+        while True:
+            processed = inbound_mail.sync_mailbox(db, imap, "INBOX")
+            total += processed
+            if not processed:
+                return total
+    finally:
+        db.close()
+        imap.logout()
+
+
+def test_incremental_reply_ingestion():
+    inbound_mail.EMAIL_ATTACHMENTS_DIR = tempfile.mkdtemp()
+    inbound_mail.IMAP_FETCH_CHUNK = 64 * 1024
+    inbound_mail.IMAP_BATCH_SIZE = 2
+    big_file = os.urandom(700 * 1024)
+
+    mailbox = FakeMailbox()
+    mailbox.add(1, _reply("<unrelated@other.example>", body="Рассылка"))
+    mailbox.add(2, _reply("<r1@supplier.example>", in_reply_to=SENT_MESSAGE_ID))
+    mailbox.add(3, _reply("<r2@supplier.example>", references=f"<x@y> {SENT_MESSAGE_ID}",
+                          attachment=("прайс.xlsx", big_file)))
+    server = _start_server(mailbox)
+    TestSession, campaign_id = _make_db()
+    try:
+        assert _sync(TestSession, server.server_address[1]) == 3
+
+        db = TestSession()
+        replies = db.query(EmailMessage).filter(EmailMessage.message_type == "received").order_by(EmailMessage.id).all()
+        assert [r.external_id for r in replies] == ["<r1@supplier.example>", "<r2@supplier.example>"]
+        assert replies[0].body.strip() == "Цена 100 руб."
+        assert replies[0].from_email == "sales@supplier.example"
+        attachment = db.query(EmailAttachment).one()
+        assert attachment.message_id == replies[1].id and attachment.filename == "прайс.xlsx"
+        assert attachment.file_size == len(big_file)
+        with open(attachment.file_path, "rb") as f:
+            assert f.read() == big_file
+        # Вложение скачивалось кусками, а не одним литералом
+        assert mailbox.max_literal <= inbound_mail.IMAP_FETCH_CHUNK
+        campaign = db.get(EmailCampaign, campaign_id)
+        assert campaign.status == "replied" and campaign.messages_count == 3 and campaign.last_reply_at
+        assert db.query(MailboxSyncState).one().last_uid == 3
+        db.close()
+
+        # Следующий проход запрашивает только новые UID
+        mailbox.fetched.clear()
+        mailbox.add(4, _reply("<r3@supplier.example>", in_reply_to=SENT_MESSAGE_ID, body="Срок 2 недели"))
+        assert _sync(TestSession, server.server_address[1]) == 1
+        assert mailbox.fetched[0][0] == "4"
+        mailbox.fetched.clear()
+        assert _sync(TestSession, server.server_address[1]) == 0
+        assert mailbox.fetched == []
+
+        # Ящик пересоздан (новый UIDVALIDITY): письма перечитываются, но не дублируются
+        mailbox.uidvalidity += 1
+        mailbox.messages = {uid + 10: message for uid, message in mailbox.messages.items()}
+        _sync(TestSession, server.server_address[1])
+        db = TestSession()
+        assert db.query(EmailMessage).filter(EmailMessage.message_type == "received").count() == 3
+        assert db.get(EmailCampaign, campaign_id).messages_count == 4
+        db.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unknown_charset_and_claimed_mailbox():
+    inbound_mail.EMAIL_ATTACHMENTS_DIR = tempfile.mkdtemp()
+    inbound_mail.IMAP_BATCH_SIZE = 200
+    mailbox = FakeMailbox()
+    reply = _reply("<r1@supplier.example>", in_reply_to=SENT_MESSAGE_ID)
+    reply.set_param("charset", "x-unknown-charset")
+    mailbox.add(1, reply)
+    server = _start_server(mailbox)
+    TestSession, campaign_id = _make_db()
+    try:
+        # Ящик взят другим воркером: проход его пропускает, пока аренда не истекла
+        db = TestSession()
+        db.add(MailboxSyncState(mailbox="INBOX", last_uid=0, claimed_at=datetime.datetime.utcnow()))
+        db.commit()
+        assert _sync(TestSession, server.server_address[1]) == 0
+        assert mailbox.fetched == []
+        db.query(MailboxSyncState).update({"claimed_at": datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=inbound_mail.IMAP_CLAIM_TIMEOUT + 1)})
+        db.commit()
+        db.close()
+
+        # Неизвестная кодировка не теряет письмо: текст читается как utf-8
+        assert _sync(TestSession, server.server_address[1]) == 1
+        db = TestSession()
+        reply = db.query(EmailMessage).filter(EmailMessage.message_type == "received").one()
+        assert reply.body.strip() == "Цена 100 руб."
+        state = db.query(MailboxSyncState).one()
+        assert state.last_uid == 1 and state.claimed_at is None
+        db.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stream_decoder_chunks():
+    import base64
+    import quopri
+    data = os.urandom(10000)
+    encoded = base64.encodebytes(data)
+    decoder = inbound_mail.StreamDecoder("base64")
+    out = b"".join(decoder.feed(encoded[i:i + 777]) for i in range(0, len(encoded), 777)) + decoder.flush()
+    assert out == data
+    text = ("Строка с длинным текстом = и переносами " * 50).encode()
+    encoded = quopri.encodestring(text)
+    decoder = inbound_mail.StreamDecoder("quoted-printable")
+    out = b"".join(decoder.feed(encoded[i:i + 13]) for i in range(0, len(encoded), 13)) + decoder.flush()
+    assert out == text
+
+
+if __name__ == "__main__":
+    test_incremental_reply_ingestion()
+    test_unknown_charset_and_claimed_mailbox()
+    test_stream_decoder_chunks()
+    print("✅ Ответы поставщиков загружаются по IMAP инкрементально")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Тест очереди исходящих писем: отправка кампаний через пул SMTP-соединений на локальный
+SMTP-сервер-заглушку (asyncio), повторы временных ошибок и запись статусов.
+Работает на временной SQLite-базе, настоящий SMTP и Postgres не нужны.
+"""
+import sys
+import os
+import asyncio
+import base64
+import datetime
+import tempfile
+import time
+
+# Добавляем путь к модулям приложения
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, get_db
+from app.auth import get_current_user
+from app.models import User, EmailCampaign, EmailMessage
+from app import outbound_mail
+from api import email_campaigns_api
+
+
+class FakeSMTPServer:
+    """Минимальный SMTP-сервер: AUTH PLAIN, 550 для адресов с reject, 451 для адресов с busy"""
+
+    def __init__(self):
+        self.connections = 0
+        self.logins = 0
+        self.delivered = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 fake ESMTP\r\n")
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                writer.write(b"250-fake\r\n250-8BITMIME\r\n250 AUTH PLAIN\r\n")
+            elif verb == "AUTH":
+                _, user, password = base64.b64decode(command.split()[-1]).split(b"\0")
+                self.logins += 1
+                writer.write(b"235 ok\r\n" if (user, password) == (b"mailer", b"secret") else b"535 bad auth\r\n")
+            elif verb == "MAIL":
+                recipients = []
+                writer.write(b"250 ok\r\n")
+            elif verb == "RCPT":
+                if "reject" in command:
+                    writer.write(b"550 no such user\r\n")
+                elif "busy" in command:
+                    writer.write(b"451 try again later\r\n")
+                else:
+                    recipients.append(command.split(":", 1)[1].strip("<> "))
+                    writer.write(b"250 ok\r\n")
+            elif verb == "DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                data = []
+                while (chunk := await reader.readline()) not in (b".\r\n", b""):
+                    data.append(chunk)
+                self.delivered.extend((rcpt, b"".join(data)) for rcpt in recipients)
+                writer.write(b"250 queued\r\n")
+            elif verb in ("RSET", "NOOP"):
+                recipients = []
+                writer.write(b"250 ok\r\n")
+            elif verb == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"502 not implemented\r\n")
+            await writer.drain()
+        writer.close()
+
+
+def _make_db():
+    db_path = os.path.join(tempfile.mkdtemp(), "mail.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    TestSession = sessionmaker(bind=engine)
+    db = TestSession()
+    user = User(username="buyer", role="user", email="buyer@example.com")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return TestSession, user_id
+
+
+def _add_campaigns(TestSession, user_id, emails):
+    db = TestSession()
+    campaigns = [
+        EmailCampaign(name=f"Кампания {email}", supplier_email=email, supplier_name="Поставщик",
+                      subject="Запрос цены", body="Добрый день! Пришлите цену.", user_id=user_id)
+        for email in emails
+    ]
+    db.add_all(campaigns)
+    db.commit()
+    ids = [c.id for c in campaigns]
+    db.close()
+    return ids
+
+
+def _client(TestSession, user_id):
+    def override_get_db():
+        session = TestSession()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(email_campaigns_api.router)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_user] = lambda: User(id=user_id, username="buyer", email="buyer@example.com")
+    return TestClient(app)
+
+
+async def _run_worker(TestSession, server, pool_size=2, batches=1):
+    pool = outbound_mail.SMTPPool(
+        pool_size, hostname="127.0.0.1", port=server.port, username="mailer", password="secret",
+        start_tls=False, timeout=5,
+    )
+    try:
+        for _ in range(batches):
+            await outbound_mail.process_batch(pool, limit=100, session_factory=TestSession)
+    finally:
+        await pool.close()
+    return pool
+
+
+def _fast_domain_rate(rate=1000.0):
+    outbound_mail.MAIL_DOMAIN_RATE = rate
+    # Воркер запускается и письма ставятся в очередь только при настроенном SMTP
+    outbound_mail.SMTP_HOST = "127.0.0.1"
+
+
+def test_bulk_send_through_connection_pool():
+    _fast_domain_rate()
+    TestSession, user_id = _make_db()
+    emails = [f"sales{i}@supplier{i % 3}.example" for i in range(30)]
+    campaign_ids = _add_campaigns(TestSession, user_id, emails)
+
+    client = _client(TestSession, user_id)
+    response = client.post("/email-campaigns/send-bulk", json={"campaign_ids": campaign_ids + [999]})
+    assert response.status_code == 200, response.text
+    assert sorted(response.json()["queued"]) == sorted(campaign_ids)
+    assert response.json()["skipped"] == [999]
+    assert client.post(f"/email-campaigns/{campaign_ids[0]}/send").status_code == 400
+
+    async def scenario():
+        server = FakeSMTPServer()
+        await server.start()
+        try:
+            pool = await _run_worker(TestSession, server, pool_size=2)
+        finally:
+            await server.stop()
+        return server, pool
+
+    server, pool = asyncio.run(scenario())
+    assert len(server.delivered) == 30
+    # Соединения переиспользуются: не больше размера пула, авторизация — один раз на соединение
+    assert pool.connections_opened <= 2 and server.connections <= 2
+    assert server.logins == server.connections
+
+    db = TestSession()
+    messages = db.query(EmailMessage).all()
+    assert {m.delivery_status for m in messages} == {"sent"}
+    assert all(m.external_id and m.external_id.encode() in dict(server.delivered)[m.to_email] for m in messages)
+    campaigns = db.query(EmailCampaign).all()
+    assert {c.status for c in campaigns} == {"sent"}
+    assert all(c.messages_count == 1 and c.sent_at for c in campaigns)
+    db.close()
+
+
+def test_retry_and_permanent_failure():
+    _fast_domain_rate()
+    TestSession, user_id = _make_db()
+    ok_id, busy_id, reject_id = _add_campaigns(
+        TestSession, user_id, ["ok@supplier.example", "busy@supplier.example", "reject@supplier.example"]
+    )
+    client = _client(TestSession, user_id)
+    for campaign_id in (ok_id, busy_id, reject_id):
+        response = client.post(f"/email-campaigns/{campaign_id}/send")
+        assert response.status_code == 200 and response.json()["status"] == "queued", response.text
+
+    async def scenario():
+        server = FakeSMTPServer()
+        await server.start()
+        try:
+            # Вторая пачка пуста: письмо с 451 ждет next_attempt_at
+            await _run_worker(TestSession, server, pool_size=1, batches=2)
+        finally:
+            await server.stop()
+        return server
+
+    server = asyncio.run(scenario())
+    assert [rcpt for rcpt, _ in server.delivered] == ["ok@supplier.example"]
+
+    db = TestSession()
+    by_email = {m.to_email: m for m in db.query(EmailMessage).all()}
+    assert by_email["ok@supplier.example"].delivery_status == "sent"
+    busy = by_email["busy@supplier.example"]
+    assert busy.delivery_status == "queued" and busy.attempts == 1
+    assert busy.next_attempt_at > datetime.datetime.utcnow() and "451" in busy.delivery_error
+    assert by_email["reject@supplier.example"].delivery_status == "failed"
+    statuses = {c.id: c.status for c in db.query(EmailCampaign).all()}
+    assert statuses == {ok_id: "sent", busy_id: "sending", reject_id: "failed"}
+    db.close()
+
+    response = client.get(f"/email-campaigns/{busy_id}/messages")
+    assert response.json()[0]["delivery_status"] == "queued"
+
+
+def test_domain_rate_limit():
+    _fast_domain_rate(10)
+    TestSession, user_id = _make_db()
+    campaign_ids = _add_campaigns(TestSession, user_id, [f"sales{i}@one-domain.example" for i in range(5)])
+    _client(TestSession, user_id).post("/email-campaigns/send-bulk", json={"campaign_ids": campaign_ids})
+
+    async def scenario():
+        server = FakeSMTPServer()
+        await server.start()
+        started = time.monotonic()
+        try:
+            await _run_worker(TestSession, server, pool_size=4)
+        finally:
+            await server.stop()
+        return server, time.monotonic() - started
+
+    server, elapsed = asyncio.run(scenario())
+    assert len(server.delivered) == 5
+    # 5 писем на один домен при 10 письмах в секунду — не быстрее 0.4 с
+    assert elapsed >= 0.4, elapsed
+    _fast_domain_rate()
+
+
+def test_domain_slots_are_shared_through_db():
+    """Слоты отправки на домен резервируются в БД: два "процесса" (сессии) не отправят на домен чаще лимита"""
+    _fast_domain_rate(2)
+    TestSession, _ = _make_db()
+    first, second = TestSession(), TestSession()
+    delays = [outbound_mail.reserve_domain_slot(db, "one-domain.example") for db in (first, second, first, second)]
+    first.close()
+    second.close()
+    assert delays[0] == 0
+    for expected, delay in zip((0.5, 1.0, 1.5), delays[1:]):
+        assert abs(delay - expected) < 0.1, delays
+    _fast_domain_rate()
+
+
+def test_send_requires_smtp():
+    _fast_domain_rate()
+    TestSession, user_id = _make_db()
+    campaign_id, = _add_campaigns(TestSession, user_id, ["sales@supplier.example"])
+    client = _client(TestSession, user_id)
+    outbound_mail.SMTP_HOST = ""
+    try:
+        assert client.post(f"/email-campaigns/{campaign_id}/send").status_code == 503
+        assert client.post("/email-campaigns/send-bulk", json={"campaign_ids": [campaign_id]}).status_code == 503
+    finally:
+        _fast_domain_rate()
+    # Кампания осталась черновиком и уйдет, когда отправку настроят
+    db = TestSession()
+    assert db.get(EmailCampaign, campaign_id).status == "draft"
+    assert db.query(EmailMessage).count() == 0
+    db.close()
+    assert client.post(f"/email-campaigns/{campaign_id}/send").status_code == 200
+
+
+if __name__ == "__main__":
+    test_bulk_send_through_connection_pool()
+    test_retry_and_permanent_failure()
+    test_domain_rate_limit()
+    test_domain_slots_are_shared_through_db()
+    test_send_requires_smtp()
+    print("✅ Очередь исходящих писем работает")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Тест каталога деталей: поиск по регионам пополняет каталог, а если какой-то регион
+не ответил (ошибка Perplexity), деталь не помечается как найденная и следующий поиск
+снова идет во внешние источники. Работает на временной SQLite-базе, без сети.
+"""
+import sys
+import os
+import asyncio
+import json
+import tempfile
+
+# Добавляем путь к модулям приложения
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Part, PartSupplier
+from app import catalog, google_search
+
+
+def _make_db():
+    db_path = os.path.join(tempfile.mkdtemp(), "catalog.db")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    TestSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    catalog.SessionLocal = TestSession
+    return TestSession
+
+
+REGION_SLUGS = {"Россия": "ru", "Китай": "cn", "Европа": "eu"}
+
+
+def _fake_perplexity(failing_regions):
+    async def perplexity_chat(messages):
+        prompt = messages[-1]["content"]
+        region = next(r for r in REGION_SLUGS if f"в регионе {r}" in prompt)
+        if region in failing_regions:
+            raise RuntimeError("502 Bad Gateway")
+        return json.dumps([
+            {"name": f"Shop {region}", "website": f"https://shop-{REGION_SLUGS[region]}.example/parts", "email": "", "country": region},
+            {"name": "Common", "website": "https://common.example", "email": "sales@common.example", "country": region},
+        ], ensure_ascii=False)
+    return perplexity_chat
+
+
+def _search(code, regions):
+    return asyncio.run(catalog.search_suppliers(code, use_cache=False, regions=regions, timeout=5))
+
+
+def test_failed_region_keeps_part_incomplete():
+    TestSession = _make_db()
+    regions = list(REGION_SLUGS)
+
+    google_search.perplexity_chat = _fake_perplexity({"Китай"})
+    found, stats = _search("ab-123", regions)
+    statuses = {stat["region"]: stat["status"] for stat in stats}
+    assert statuses == {"Россия": "ok", "Китай": "error", "Европа": "ok"}, statuses
+    assert len(found) == 4, found
+
+    db = TestSession()
+    part = db.query(Part).filter(Part.normalized_code == "AB123").one()
+    assert part.suppliers_updated_at is None, "деталь с упавшим регионом не должна считаться найденной"
+    domains = sorted(s.domain for s in db.query(PartSupplier).filter(PartSupplier.part_id == part.id))
+    assert domains == ["common.example", "shop-eu.example", "shop-ru.example"], domains
+    assert catalog.load_part_suppliers(db, "AB123") is None
+    db.close()
+
+    # Все регионы ответили — деталь найдена, повторный поиск читает каталог
+    google_search.perplexity_chat = _fake_perplexity(set())
+    found, stats = _search("AB123", regions)
+    assert all(stat["status"] == "ok" for stat in stats), stats
+    db = TestSession()
+    part = db.query(Part).filter(Part.normalized_code == "AB123").one()
+    assert part.suppliers_updated_at is not None
+    known = catalog.load_part_suppliers(db, "AB123")
+    domains = sorted(google_search.extract_domain(s["website"]) for s in known)
+    assert domains == ["common.example", "shop-cn.example", "shop-eu.example", "shop-ru.example"], domains
+    db.close()
+    print("✅ Упавший регион не помечает деталь найденной")
+
+
+if __name__ == "__main__":
+    test_failed_region_keeps_part_incomplete()
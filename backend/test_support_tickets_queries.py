@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Регрессионный тест: списки обращений не делают запрос на каждого пользователя (N+1),
+а аналитика считается агрегатами в БД за постоянное число запросов.
+Работает на временной SQLite-базе, Postgres не нужен.
+"""
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Добавляем путь к модулям приложения
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.auth import get_token_user
+from app.models import User, SupportTicket
+from app.schemas import TokenUser
+from app.routers import support_tickets
+from testing_helpers import make_query_client
+
+
+BASE_TIME = datetime(2026, 3, 2, 9, 0)  # понедельник
+
+
+def _make_client(ticket_count: int):
+    """Приложение с роутером обращений на новой базе с ticket_count обращениями.
+
+    Каждое третье обращение решено: ответ через 1 час, решение через 4 часа.
+    """
+    def seed(db):
+        admin = User(username="admin", role="admin")
+        db.add(admin)
+        db.flush()
+        for i in range(ticket_count):
+            author = User(username=f"user{i}", role="user")
+            db.add(author)
+            db.flush()
+            db.add(SupportTicket(
+                user_id=author.id,
+                title=f"Обращение {i}",
+                description="Описание",
+                assigned_to=admin.id if i % 2 else None,
+                department="IT" if i % 2 else "Снабжение",
+                priority="high" if i % 4 == 0 else "medium",
+                status="resolved" if i % 3 == 0 else "open",
+                created_at=BASE_TIME + timedelta(days=i),
+                first_response_at=BASE_TIME + timedelta(days=i, hours=1) if i % 3 == 0 else None,
+                resolved_at=BASE_TIME + timedelta(days=i, hours=4) if i % 3 == 0 else None,
+            ))
+        token_user = TokenUser(id=admin.id, username="admin", role="admin")
+        return {get_token_user: lambda: token_user}, None
+
+    client, queries, _ = make_query_client(support_tickets.router, seed, "tickets.db")
+    return client, queries
+
+
+def _count_queries(ticket_count: int, url: str):
+    client, queries = _make_client(ticket_count)
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == ticket_count
+    return len(queries), response.json()
+
+
+def test_ticket_list_query_count_is_constant():
+    """Число запросов списка не зависит от числа обращений"""
+    few, _ = _count_queries(2, "/support_tickets/")
+    many, tickets = _count_queries(50, "/support_tickets/")
+    assert few == many, f"2 обращения: {few} запросов, 50 обращений: {many}"
+    assert all(t["user_username"].startswith("user") for t in tickets)
+    assert {t["assigned_admin_username"] for t in tickets} == {"admin", None}
+
+
+def test_ticket_usernames_in_single_ticket():
+    client, queries = _make_client(3)
+    response = client.get("/support_tickets/2")
+    assert response.status_code == 200, response.text
+    assert response.json()["user_username"] == "user1"
+    assert response.json()["assigned_admin_username"] == "admin"
+    assert len(queries) == 1
+
+
+def test_analytics_overview_single_query():
+    """Сводка за один запрос, значения совпадают с подсчетом вручную"""
+    client, queries = _make_client(12)
+    response = client.get("/support_tickets/analytics/overview")
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert len(queries) == 1, queries
+    assert data["total_tickets"] == 12
+    assert data["resolved_tickets"] == 4 and data["open_tickets"] == 8
+    assert data["tickets_by_status"] == {"open": 8, "in_progress": 0, "resolved": 4, "closed": 0}
+    assert data["tickets_by_department"] == {"IT": 6, "Снабжение": 6}
+    assert data["tickets_by_priority"] == {"high": 3, "medium": 9}
+    assert abs(data["average_response_time_hours"] - 1) < 0.01
+    assert abs(data["average_resolution_time_hours"] - 4) < 0.01
+
+
+def test_analytics_trends_by_day_and_week():
+    client, queries = _make_client(14)
+    start = BASE_TIME.date()
+    response = client.get("/support_tickets/analytics/trends", params={
+        "bucket": "day", "date_from": str(start), "date_to": str(start + timedelta(days=6)),
+    })
+    assert response.status_code == 200, response.text
+    days = response.json()
+    assert len(queries) == 1
+    assert [d["created"] for d in days] == [1] * 7
+    assert [d["resolved"] for d in days] == [1, 0, 0, 1, 0, 0, 1]
+    assert abs(days[0]["average_resolution_time_hours"] - 4) < 0.01
+
+    response = client.get("/support_tickets/analytics/trends", params={
+        "bucket": "week", "date_from": str(start + timedelta(days=2)), "date_to": str(start + timedelta(days=13)),
+    })
+    weeks = response.json()
+    assert [w["bucket_start"] for w in weeks] == [str(start), str(start + timedelta(days=7))]
+    assert [w["created"] for w in weeks] == [5, 7]
+    assert [w["resolved"] for w in weeks] == [2, 2]
+
+    response = client.get("/support_tickets/analytics/trends", params={
+        "date_from": str(start), "date_to": str(start + timedelta(days=400)),
+    })
+    assert response.status_code == 400
+    # Одна граница: вторая подставляется по умолчанию и диапазон проверяется так же
+    response = client.get("/support_tickets/analytics/trends", params={"date_from": "1900-01-01"})
+    assert response.status_code == 400, response.text
+    response = client.get("/support_tickets/analytics/trends", params={"date_to": str(start + timedelta(days=6))})
+    assert response.status_code == 200 and len(response.json()) == 30
+    assert response.json()[-1]["bucket_start"] == str(start + timedelta(days=6))
+
+
+if __name__ == "__main__":
+    test_ticket_list_query_count_is_constant()
+    test_ticket_usernames_in_single_ticket()
+    test_analytics_overview_single_query()
+    test_analytics_trends_by_day_and_week()
+    print("✅ Списки и аналитика обращений выполняются за постоянное число запросов")
@@ -0,0 +1,47 @@
+"""
+Общие помощники для регрессионных тестов на временной SQLite-базе: приложение FastAPI
+с нужным роутером, подмененной get_db и счетчиком SQL-запросов.
+"""
+import os
+import tempfile
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, get_db
+
+
+def make_query_client(router, seed, db_name: str = "test.db"):
+    """Приложение с router на новой базе. Возвращает (client, queries, seeded).
+
+    seed(db) заполняет базу и возвращает (overrides, seeded): overrides — словарь
+    {зависимость: замена} (например, текущий пользователь), seeded отдается вызывающему.
+    queries — SQL-запросы, выполненные после заполнения базы.
+    """
+    db_path = os.path.join(tempfile.mkdtemp(), db_name)
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    TestSession = sessionmaker(bind=engine)
+
+    db = TestSession()
+    overrides, seeded = seed(db)
+    db.commit()
+    db.close()
+
+    def override_get_db():
+        session = TestSession()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides.update(overrides)
+
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    return TestClient(app), queries, seeded
@@ -170,13 +170,27 @@ const EmailCampaigns: React.FC = () => {
     }
   };
 
+  const handleCreateAllCampaigns = async () => {
+    try {
+      const response = await axios.post('/api/email-campaigns/bulk', {
+        groups: supplierGroups
+      });
+
+      setCampaigns([...response.data, ...campaigns]);
+      setGroupDialogOpen(false);
+    } catch (error) {
+      console.error('Ошибка создания кампаний:', error);
+      alert('Ошибка при создании кампаний');
+    }
+  };
+
   const handleSendCampaign = async (campaignId: number) => {
     try {
       await axios.post(`/api/email-campaigns/${campaignId}/send`);
       fetchCampaigns(); // Обновляем список
-    } catch (error) {
+    } catch (error: any) {
       console.error('Ошибка отправки кампании:', error);
-      alert('Ошибка при отправке кампании');
+      alert(error.response?.data?.detail || 'Ошибка при отправке кампании');
     }
   };
 
@@ -195,7 +209,9 @@ const EmailCampaigns: React.FC = () => {
   const getStatusColor = (status: string) => {
     switch (status) {
       case 'draft': return 'default';
+      case 'sending': return 'info';
       case 'sent': return 'primary';
+      case 'failed': return 'error';
       case 'replied': return 'success';
       default: return 'default';
     }
@@ -204,7 +220,9 @@ const EmailCampaigns: React.FC = () => {
   const getStatusText = (status: string) => {
     switch (status) {
       case 'draft': return 'Черновик';
+      case 'sending': return 'Отправляется';
       case 'sent': return 'Отправлено';
+      case 'failed': return 'Ошибка отправки';
       case 'replied': return 'Получен ответ';
       default: return status;
     }
@@ -339,7 +357,7 @@ const EmailCampaigns: React.FC = () => {
                     <IconButton size="small" color="primary">
                       <EditIcon />
                     </IconButton>
-                    {campaign.status === 'draft' && (
+                    {(campaign.status === 'draft' || campaign.status === 'failed') && (
                       <IconButton 
                         size="small" 
                         color="success"
@@ -436,6 +454,11 @@ const EmailCampaigns: React.FC = () => {
           )}
         </DialogContent>
         <DialogActions>
+          {supplierGroups.length > 0 && (
+            <Button variant="contained" onClick={handleCreateAllCampaigns}>
+              Создать кампании для всех ({supplierGroups.length})
+            </Button>
+          )}
           <Button onClick={() => setGroupDialogOpen(false)}>Закрыть</Button>
         </DialogActions>
       </Dialog>
@@ -22,7 +22,9 @@ if [ -f create_admin_user.py ]; then
   python create_admin_user.py || true
 fi
 
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4 > /app/backend.log 2>&1 &
+# Число воркеров; app/database.py делит бюджет соединений с БД на это же число
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --workers $WEB_CONCURRENCY > /app/backend.log 2>&1 &
 
 # Ждём, пока backend поднимется
 sleep 3